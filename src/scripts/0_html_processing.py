@@ -1,20 +1,50 @@
 import os
 import pandas as pd
 from bs4 import BeautifulSoup, Comment
-from urllib.parse import urljoin, urlparse
+import lxml.html
+from urllib.parse import urljoin, urlparse, parse_qsl, urlencode, unquote
+from html import unescape
+from urllib.robotparser import RobotFileParser
 import re
 import json
 import time
 import asyncio
 import hashlib
+import sqlite3
+import gzip
+import glob
+import shutil
+import random
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import socket
+import ipaddress
+import ssl
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from playwright.async_api import async_playwright
 import aiohttp
+from aiohttp import web
 from datetime import datetime
 import google.generativeai as genai
 from getpass import getpass
 
+try:
+    import zstandard
+except ImportError:  # zstd es opcional; sin él los snapshots se comprimen con gzip
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional; solo hace falta para entradas/salidas .parquet
+    pa = pq = None
+
+try:
+    import fcntl
+except ImportError:  # Sin fcntl (Windows) la salida se escribe sin bloqueo entre procesos
+    fcntl = None
+
 # ========== CONFIGURACIÓN ==========
 print("🔐 Configuración de Google Gemini API Key")
 print("Necesitas una API Key de Google AI Studio para usar Gemini")
@@ -29,17 +59,119 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 INPUT_CSV = os.environ.get("COMPANY_XLSX", os.path.join(DATA_DIR, "companies_demo.xlsx"))
+# Columnas de la lista de empresas (.xlsx, .csv o .parquet) y filas leídas por bloque
+COMPANY_COLUMN = "Company Name"
+WEBSITE_COLUMN = "Website"
+INPUT_CHUNK_ROWS = int(os.environ.get("INPUT_CHUNK_ROWS", "10000"))
 HTML_DIR = os.environ.get("COMPANY_HTML", os.path.join(DATA_DIR, "htmls"))
 OUTPUT_DIR = HTML_DIR
 OUTPUT_FILE = os.environ.get("COMPANY_OUT", os.path.join(DATA_DIR, "processed", "company_info_V5.csv"))
+# Formato de salida: 'csv' (OUTPUT_FILE) o 'parquet' (carpeta de partes junto a OUTPUT_FILE)
+RESULT_FORMAT = os.environ.get("RESULT_FORMAT", "csv")
+# Filas acumuladas antes de escribirlas a disco de una vez
+RESULT_BATCH_SIZE = int(os.environ.get("RESULT_BATCH_SIZE", "50"))
 CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, "checkpoint.json")
+JOURNAL_FILE = os.path.join(OUTPUT_DIR, "checkpoint_journal.jsonl")
 CACHE_FILE = os.path.join(OUTPUT_DIR, "gpt_cache.json")
+LLM_CACHE_FILE = os.path.join(OUTPUT_DIR, "llm_cache.sqlite")
 BLOCKED_SITES_FILE = os.path.join(OUTPUT_DIR, "blocked_sites.json")
+FAILURES_FILE = os.path.join(OUTPUT_DIR, "failures.jsonl")
+DOMAIN_PROFILES_FILE = os.path.join(OUTPUT_DIR, "domain_profiles.json")
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "html_manifest.jsonl")
+SNAPSHOT_DIR = os.path.join(OUTPUT_DIR, "snapshots")
+
+# Reintento de sitios fallidos: horas de espera tras el primer fallo de cada clase
+# (se duplica en cada fallo seguido) y tope en días
+RETRY_BASE_HOURS = {
+    'timeout': 1, 'connection': 1, 'rate_limited': 2, 'server_error': 2, 'render': 6, 'unknown': 6,
+    'http_error': 24, 'forbidden': 24, 'tls': 72, 'dns': 72, 'not_found': 168,
+}
+RETRY_MAX_DAYS = float(os.environ.get("RETRY_MAX_DAYS", "30"))
 
 # Configuración de procesamiento
 MAX_CONCURRENT_COMPANIES = int(os.environ.get("MAX_CONCURRENT", "5"))
 GPT_RATE_LIMIT_DELAY = float(os.environ.get("GPT_DELAY", "1.0"))
 URL_VALIDATION_TIMEOUT = int(os.environ.get("URL_TIMEOUT", "10"))
+# Pool de conexiones HTTP compartido: conexiones totales, por host y segundos de caché DNS
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", "4"))
+DNS_CACHE_TTL = int(os.environ.get("DNS_CACHE_TTL", "300"))
+# Bytes que lee la validación de una URL, y si guarda la home HTML para no volver a pedirla
+VALIDATE_PEEK_BYTES = int(os.environ.get("VALIDATE_PEEK_BYTES", "1024"))
+VALIDATE_PREFETCH = os.environ.get("VALIDATE_PREFETCH", "1") == "1"
+
+# Almacenamiento de HTML: 'snapshots' (comprimido y deduplicado en segmentos) o 'files' (un .html por página)
+HTML_STORE = os.environ.get("HTML_STORE", "snapshots")
+SNAPSHOT_SEGMENT_MB = int(os.environ.get("SNAPSHOT_SEGMENT_MB", "64"))
+
+# Workers por etapa del pipeline (validación, renderizado, extracción de texto, LLM)
+VALIDATE_CONCURRENCY = int(os.environ.get("VALIDATE_CONCURRENCY", "10"))
+RENDER_CONCURRENCY = int(os.environ.get("RENDER_CONCURRENCY", str(MAX_CONCURRENT_COMPANIES)))
+EXTRACT_CONCURRENCY = int(os.environ.get("EXTRACT_CONCURRENCY", "2"))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "1"))
+# Extractor de texto visible: 'lxml' (una sola pasada) o 'bs4' (el original)
+TEXT_EXTRACTOR = os.environ.get("TEXT_EXTRACTOR", "lxml")
+# Cliente LLM: backend ('gemini' o 'stub'), límites por minuto y reintentos
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gemini")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+LLM_RPM = float(os.environ.get("LLM_RPM", str(60 / GPT_RATE_LIMIT_DELAY if GPT_RATE_LIMIT_DELAY > 0 else 60)))
+LLM_TPM = float(os.environ.get("LLM_TPM", "1000000"))
+# Ráfaga máxima de los límites por minuto, en segundos de cupo acumulado
+LLM_BURST_SECONDS = float(os.environ.get("LLM_BURST_SECONDS", "5"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "2.0"))
+STUB_LLM_LATENCY = float(os.environ.get("STUB_LLM_LATENCY", "0.0"))
+# Versión del prompt: subirla al cambiar build_prompt para no reutilizar respuestas viejas
+PROMPT_VERSION = "1"
+# Límites de la caché de respuestas del LLM (entradas y antigüedad en días)
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "200000"))
+LLM_CACHE_MAX_AGE_DAYS = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", "365"))
+# Caché semántica: similitud SimHash mínima (0-1) para reutilizar un resultado; >1 la desactiva
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Empresas por llamada a Gemini (1 = una llamada por empresa) y espera máxima para llenar un lote
+GEMINI_BATCH_SIZE = int(os.environ.get("GEMINI_BATCH_SIZE", "1"))
+GEMINI_BATCH_WAIT = float(os.environ.get("GEMINI_BATCH_WAIT", "2.0"))
+# Presupuesto de tokens del texto de cada empresa en el prompt (~4 caracteres por token)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "2500"))
+CHARS_PER_TOKEN = 4
+# Pre-extracción sin LLM (JSON-LD, microdata, enlaces tel:, teléfonos y países en el texto) y campos
+# que hacen falta del LLM: si la pre-extracción los resuelve todos, la empresa no pasa por el LLM
+PRE_EXTRACT = os.environ.get("PRE_EXTRACT", "1") == "1"
+LLM_FIELDS = [field.strip() for field in os.environ.get("LLM_FIELDS", "").split(",") if field.strip()]
+# Procesos para parsear HTML fuera del event loop (0 = parsear en el propio proceso)
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Empresas terminadas entre cada guardado de checkpoint y caches
+CHECKPOINT_EVERY = int(os.environ.get("CHECKPOINT_EVERY", "5"))
+
+# Pool de navegador: número de páginas simultáneas y páginas por contexto antes de reciclarlo
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "4"))
+# Con RENDER_BROWSER=0 no se lanza Chromium: solo HTTP simple, aunque la página pida JavaScript
+RENDER_BROWSER = os.environ.get("RENDER_BROWSER", "1") == "1"
+PAGES_PER_CONTEXT = int(os.environ.get("PAGES_PER_CONTEXT", "20"))
+# Espera adaptativa de renderizado (ms): ventana sin mutaciones, tope duro y mínimo por sitio
+RENDER_QUIET_MS = int(os.environ.get("RENDER_QUIET_MS", "500"))
+RENDER_MAX_WAIT_MS = int(os.environ.get("RENDER_MAX_WAIT_MS", "8000"))
+RENDER_MIN_WAIT_MS = int(os.environ.get("RENDER_MIN_WAIT_MS", "1500"))
+# Texto visible mínimo para aceptar una página descargada por HTTP simple sin renderizar
+STATIC_MIN_TEXT = int(os.environ.get("STATIC_MIN_TEXT", "500"))
+# Cortesía por dominio: peticiones simultáneas, segundos mínimos entre peticiones,
+# tope al crawl-delay de robots.txt y días antes de volver a leer robots.txt
+HOST_CONCURRENCY = int(os.environ.get("HOST_CONCURRENCY", "2"))
+HOST_MIN_INTERVAL = float(os.environ.get("HOST_MIN_INTERVAL", "1.0"))
+ROBOTS_MAX_DELAY = float(os.environ.get("ROBOTS_MAX_DELAY", "30"))
+ROBOTS_TTL_DAYS = float(os.environ.get("ROBOTS_TTL_DAYS", "7"))
+# Enlaces internos: máximo a descargar por empresa y si se usan además los de sitemap.xml
+MAX_SECTION_LINKS = int(os.environ.get("MAX_SECTION_LINKS", "8"))
+SITEMAP_SEED = os.environ.get("SITEMAP_SEED", "1") == "1"
+SITEMAP_MAX_URLS = int(os.environ.get("SITEMAP_MAX_URLS", "500"))
+# Métricas: puerto local del endpoint /metrics (0 = desactivado) y resumen JSON de cada ejecución
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+RUN_SUMMARY_FILE = os.environ.get("RUN_SUMMARY_FILE", os.path.join(OUTPUT_DIR, "run_summary.json"))
+# Ejecución repartida (--ledger): registro compartido de arriendos y segundos que dura cada arriendo
+WORK_LEDGER_FILE = os.environ.get("WORK_LEDGER_FILE", os.path.join(OUTPUT_DIR, "work_ledger.sqlite"))
+LEASE_SECONDS = float(os.environ.get("LEASE_SECONDS", "600"))
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 
 # Crea las carpetas si no existen
 for path in [HTML_DIR, OUTPUT_DIR, os.path.dirname(OUTPUT_FILE)]:
@@ -57,47 +189,233 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-KEYWORDS = [
+# ========== MÉTRICAS ==========
+
+METRICS_PREFIX = "company_pipeline_"
+# Límites (segundos) de los buckets de los histogramas de latencia y de profundidad de cola
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Valores que guarda cada histograma para calcular percentiles, y dominios más lentos en el resumen
+METRICS_SAMPLES = 10000
+METRICS_TOP_DOMAINS = 20
+
+class Metrics:
+    """Métricas en memoria de una ejecución: contadores, histogramas e indicadores.
+
+    Cada serie se identifica por nombre y etiquetas. Los histogramas cuentan
+    por buckets (para /metrics en formato de texto de Prometheus) y guardan
+    una muestra de hasta METRICS_SAMPLES valores para los p50/p95 del resumen
+    JSON. Los tiempos por dominio se acumulan aparte y solo van al resumen,
+    para no crear una serie por cada dominio.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.domains = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, value, **labels):
+        """Indicador con un valor fijo o una función que se evalúa al leerlo (p. ej. `queue.qsize`)"""
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        series = self.histograms.get(key)
+        if series is None:
+            series = self.histograms[key] = {'bounds': buckets, 'buckets': [0] * len(buckets),
+                                             'count': 0, 'sum': 0.0, 'max': 0.0, 'samples': []}
+        for i, bound in enumerate(series['bounds']):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['count'] += 1
+        series['sum'] += value
+        series['max'] = max(series['max'], value)
+        # Muestreo de reservorio: todos los valores tienen la misma probabilidad de quedar en la muestra
+        if len(series['samples']) < METRICS_SAMPLES:
+            series['samples'].append(value)
+        else:
+            slot = random.randrange(series['count'])
+            if slot < METRICS_SAMPLES:
+                series['samples'][slot] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def domain_time(self, domain, seconds, tier):
+        stats = self.domains.setdefault(domain, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        stats['tier'] = tier
+
+    def counter(self, name, **labels):
+        """Suma de un contador para las series que tienen (al menos) esas etiquetas"""
+        wanted = set(labels.items())
+        return sum(value for (series_name, series_labels), value in self.counters.items()
+                   if series_name == name and wanted <= set(series_labels))
+
+    def render_prometheus(self):
+        """Métricas en el formato de texto de Prometheus"""
+        lines = []
+        for kind, series in (('counter', self.counters), ('gauge', self.gauges), ('histogram', self.histograms)):
+            current = None
+            for (name, labels), value in sorted(series.items(), key=lambda item: item[0]):
+                metric = METRICS_PREFIX + name
+                if name != current:
+                    current = name
+                    lines.append(f"# TYPE {metric} {kind}")
+                if kind == 'counter':
+                    lines.append(f"{metric}{_prometheus_labels(labels)} {value}")
+                elif kind == 'gauge':
+                    lines.append(f"{metric}{_prometheus_labels(labels)} {value() if callable(value) else value}")
+                else:
+                    for bound, count in zip(value['bounds'], value['buckets']):
+                        lines.append(f"{metric}_bucket{_prometheus_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{metric}_bucket{_prometheus_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{metric}_sum{_prometheus_labels(labels)} {value['sum']:.6f}")
+                    lines.append(f"{metric}_count{_prometheus_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Resumen JSON: contadores, indicadores, percentiles de cada histograma y dominios más lentos"""
+        histograms = {}
+        for (name, labels), series in sorted(self.histograms.items(), key=lambda item: item[0]):
+            samples = sorted(series['samples'])
+            histograms[name + _prometheus_labels(labels)] = {
+                'count': series['count'],
+                'sum': round(series['sum'], 6),
+                'mean': round(series['sum'] / series['count'], 6),
+                'p50': round(samples[int(0.50 * (len(samples) - 1))], 6),
+                'p95': round(samples[int(0.95 * (len(samples) - 1))], 6),
+                'max': round(series['max'], 6),
+            }
+        slowest = sorted(self.domains.items(), key=lambda item: -item[1]['seconds'])[:METRICS_TOP_DOMAINS]
+        return {
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'elapsed_seconds': round(time.time() - self.started, 3),
+            'counters': {name + _prometheus_labels(labels): value
+                         for (name, labels), value in sorted(self.counters.items(), key=lambda item: item[0])},
+            'gauges': {name + _prometheus_labels(labels): value() if callable(value) else value
+                       for (name, labels), value in sorted(self.gauges.items(), key=lambda item: item[0])},
+            'histograms': histograms,
+            'slowest_domains': [dict(stats, domain=domain, mean=round(stats['seconds'] / stats['count'], 6),
+                                     seconds=round(stats['seconds'], 6), max=round(stats['max'], 6))
+                                for domain, stats in slowest],
+        }
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+async def start_metrics_server(metrics, port=METRICS_PORT, host=METRICS_HOST):
+    """Servir /metrics (Prometheus) y /summary (JSON) en un puerto local; devuelve el runner para cerrarlo"""
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+    async def handle_summary(request):
+        return web.json_response(metrics.summary())
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/summary', handle_summary)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+    return runner
+
+metrics = Metrics()
+
+# Secciones internas que interesa descargar, por categoría: (peso, palabras clave).
+# Los enlaces se ordenan por el peso de la mejor categoría que mencionan.
+LINK_CATEGORIES = {
     # CONTACTO Y GENERAL
-    'contact', 'contact-us', 'get-in-touch', 'contacts', 'contact-info', 'contact-information',
-    'reach-us', 'connect', 'contactus', 'inquiries', 'support', 'customer-support', 'customer-service',
+    'contact': (10, [
+        'contact', 'contact-us', 'get-in-touch', 'contacts', 'contact-info', 'contact-information',
+        'reach-us', 'connect', 'contactus', 'inquiries', 'support', 'customer-support', 'customer-service',
+        'contacto',
+    ]),
 
     # ACERCA DE/QUIÉNES SOMOS
-    'about', 'about-us', 'who-we-are', 'our-story', 'company-overview', 'company-info', 'company-information',
-    'overview', 'mission', 'our-mission', 'vision', 'our-vision', 'history', 'our-history', 'background',
-    'values', 'our-values', 'core-values', 'what-we-do', 'who-we-are',
+    'about': (9, [
+        'about', 'about-us', 'who-we-are', 'our-story', 'company-overview', 'company-info', 'company-information',
+        'overview', 'mission', 'our-mission', 'vision', 'our-vision', 'values', 'our-values', 'core-values',
+        'what-we-do', 'empresa', 'quienes', 'quiénes', 'acerca', 'nosotros', 'mision', 'misión', 'valores',
+    ]),
 
-    # EQUIPO / LIDERAZGO
-    'team', 'our-team', 'leadership', 'leadership-team', 'management', 'management-team', 'executives',
-    'executive-team', 'board', 'board-of-directors', 'directors', 'board-members', 'founders', 'co-founders',
-    'partners', 'partner-team', 'staff', 'employees', 'people', 'our-people',
+    # SERVICIOS / PRODUCTOS
+    'services': (8, [
+        'services', 'service', 'our-services', 'products', 'our-products', 'solutions', 'what-we-offer',
+        'offerings', 'capabilities', 'portfolio', 'servicio', 'servicios',
+    ]),
 
-    # CARRERAS / EMPLEO
-    'careers', 'career', 'jobs', 'job-openings', 'work-with-us', 'join-our-team', 'opportunities', 'vacancies',
-    'employment', 'job-listings', 'internships', 'internship-opportunities',
+    # HISTORIA / TRAYECTORIA
+    'history': (5, [
+        'history', 'our-history', 'story', 'company-story', 'background', 'trajectory', 'track-record',
+        'trayectoria', 'historia',
+    ]),
 
-    # SERVICIOS / PRODUCTOS
-    'services', 'service', 'our-services', 'products', 'our-products', 'solutions', 'what-we-offer',
-    'offerings', 'capabilities', 'portfolio',
+    # EQUIPO / LIDERAZGO
+    'team': (4, [
+        'team', 'our-team', 'leadership', 'leadership-team', 'management', 'management-team', 'executives',
+        'executive-team', 'board', 'board-of-directors', 'directors', 'board-members', 'founders', 'co-founders',
+        'partner-team', 'staff', 'employees', 'people', 'our-people', 'equipo', 'gerencia', 'fundadores',
+    ]),
 
     # PARTNERS / SOCIOS
-    'partners', 'our-partners', 'partnerships', 'alliances', 'affiliates', 'collaborators',
+    'partners': (4, ['partners', 'our-partners', 'partnerships', 'alliances', 'affiliates', 'collaborators']),
 
     # RESPONSABILIDAD / SOSTENIBILIDAD
-    'sustainability', 'sustainable', 'corporate-social-responsibility', 'csr', 'responsibility',
-    'annual-report', 'esg', 'environment', 'sustainability-report', 'impact',
-
-    # HISTORIA / TRAYECTORIA
-    'history', 'our-history', 'story', 'company-story', 'background', 'trajectory', 'track-record',
+    'sustainability': (2, [
+        'sustainability', 'sustainable', 'corporate-social-responsibility', 'csr', 'responsibility',
+        'annual-report', 'esg', 'environment', 'sustainability-report', 'impact',
+    ]),
 
     # OTROS CORPORATIVOS
-    'directory', 'directory-board', 'governance', 'governance-structure', 'advisors', 'advisory-board',
-    'committee', 'committees', 'executive-board', 'leadership-structure',
+    'governance': (2, [
+        'directory', 'directory-board', 'governance', 'governance-structure', 'advisors', 'advisory-board',
+        'committee', 'committees', 'executive-board', 'leadership-structure', 'directorio',
+    ]),
 
-    # ESPAÑOL ÚTIL SI OCUPAS WEBS BILINGÜES O LATAM
-    'empresa', 'servicio', 'servicios', 'quienes', 'quiénes', 'acerca', 'nosotros', 'equipo',
-    'contacto', 'trayectoria', 'historia', 'mision', 'misión', 'valores', 'directorio', 'gerencia', 'fundadores'
-]
+    # CARRERAS / EMPLEO
+    'careers': (1, [
+        'careers', 'career', 'jobs', 'job-openings', 'work-with-us', 'join-our-team', 'opportunities', 'vacancies',
+        'employment', 'job-listings', 'internships', 'internship-opportunities',
+    ]),
+}
+KEYWORDS = list(dict.fromkeys(kw for _, keywords in LINK_CATEGORIES.values() for kw in keywords))
+
+# Secciones de poco valor para describir la empresa (blog, noticias, legales, fechas en la ruta...),
+# que nunca se descargan
+LINK_PENALTY_PATTERN = re.compile(
+    r'(?<![^\W\d_])(?:blog|news|noticias|press|prensa|posts?|articles?|tags?|category|categoria|author|events?|eventos'
+    r'|privacy|privacidad|terms|cookies|legal|login|signin|cart|feed)(?![^\W\d_])|/(?:19|20)\d\d/'
+)
+NON_HTML_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.zip', '.doc', '.docx',
+                       '.xls', '.xlsx', '.ppt', '.pptx', '.mp3', '.mp4', '.xml', '.json', '.css', '.js')
+# Parámetros de seguimiento que no cambian la página
+TRACKING_PARAMS = re.compile(r'^(?:utm_\w+|gclid|fbclid|mc_cid|mc_eid|ref|source|_ga|hsa_\w+)$', re.IGNORECASE)
+# Puntos que resta cada nivel de profundidad por debajo del primero, y los que resta que
+# la palabra clave solo aparezca en el texto del enlace (los primeros caracteres) y no en la ruta
+LINK_DEPTH_PENALTY = 1.5
+LINK_TEXT_PENALTY = 3
+LINK_TEXT_CHARS = 60
 
 
 
@@ -110,6 +428,12 @@ def normalize_url(url):
     # Remove any trailing slash first to normalize
     url = url.rstrip('/')
     
+    # Hosts locales e IPs (pruebas y benchmarks): se respeta el esquema y no se agrega www.
+    if is_local_host(url):
+        if not url.startswith(('http://', 'https://')):
+            url = 'http://' + url
+        return url + '/'
+    
     # Add protocol if missing
     if not url.startswith(('http://', 'https://')):
         url = 'https://' + url
@@ -131,16 +455,45 @@ def normalize_url(url):
     
     return url
 
+def is_local_host(url):
+    """True si la URL apunta a localhost o a una dirección IP"""
+    host = urlparse(url if '://' in url else '//' + url).hostname or ''
+    if host == 'localhost' or host.endswith('.localhost'):
+        return True
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
 def safe_filename(s, default="file"):
     s = str(s)
     s = re.sub(r'[<>:"/\\|?*\']', '_', s)
     s = re.sub(r'\s+', '_', s)
     return s if s not in ("", ".", "..") else default
 
+def page_filename(company, url):
+    """Archivo para una página: `<empresa>.html` la raíz y `<empresa>_<ruta>.html` las secciones"""
+    path = urlparse(url).path.strip("/").replace("/", "_")
+    return safe_filename(f"{company}_{path}" if path else company, "home") + ".html"
+
+# Elementos que nunca se muestran, clases que los ocultan y prioridad del contenido
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'meta', 'link', 'head'}
+HIDDEN_CLASSES = ['hidden', 'hide', 'invisible', 'sr-only']
+IMPORTANT_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title', 'p', 'div', 'section', 'article', 'main']
+IMPORTANT_CLASSES = ['content', 'main', 'body', 'description', 'about', 'info', 'text', 'mission', 'vision', 'company', 'business']
+
 def extract_visible_text(html, max_length=14000):
     """Extraer texto visible mejorado, simulando lo que ve un usuario"""
-    soup = BeautifulSoup(html, 'html.parser')
-    
+    if TEXT_EXTRACTOR == 'bs4':
+        return extract_visible_text_bs4(html, max_length)
+    return extract_visible_text_lxml(html, max_length)
+
+def extract_visible_text_bs4(html, max_length=14000):
+    """Extractor original con BeautifulSoup (varias pasadas sobre el árbol)"""
+    return _visible_text_from_soup(BeautifulSoup(html, 'html.parser'), max_length)
+
+def _visible_text_from_soup(soup, max_length):
     # Remover elementos que no son visibles o no son útiles
     for element in soup(['script', 'style', 'noscript', 'meta', 'link', 'head']):
         element.decompose()
@@ -153,12 +506,12 @@ def extract_visible_text(html, max_length=14000):
     for element in soup.find_all(attrs={'style': lambda x: x and 'display:none' in x.replace(' ', '')}):
         element.decompose()
     
-    for element in soup.find_all(attrs={'class': lambda x: x and any(hidden in str(x).lower() for hidden in ['hidden', 'hide', 'invisible', 'sr-only'])}):
+    for element in soup.find_all(attrs={'class': lambda x: x and any(hidden in str(x).lower() for hidden in HIDDEN_CLASSES)}):
         element.decompose()
     
     # Priorizar contenido importante
-    important_tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title', 'p', 'div', 'section', 'article', 'main']
-    important_classes = ['content', 'main', 'body', 'description', 'about', 'info', 'text', 'mission', 'vision', 'company', 'business']
+    important_tags = IMPORTANT_TAGS
+    important_classes = IMPORTANT_CLASSES
     
     important_text = []
     regular_text = []
@@ -192,30 +545,275 @@ def extract_visible_text(html, max_length=14000):
     
     return text[:max_length]
 
-def merge_htmls_for_company(company, html_dir):
-    prefix = safe_filename(company)
-    htmls = []
-    for fname in os.listdir(html_dir):
-        if fname.startswith(prefix) and fname.endswith('.html'):
-            try:
-                with open(os.path.join(html_dir, fname), encoding="utf-8") as f:
-                    htmls.append(f.read())
-            except Exception as e:
-                logger.warning(f"Ignorado {fname}: {e}")
-    return "\n".join(htmls) if htmls else ""
+def extract_visible_text_lxml(html, max_length=14000):
+    """Extraer texto visible en una sola pasada sobre el árbol de lxml.
+
+    Misma prioridad que el extractor original (primero bloques con clases
+    importantes, luego el resto si hay espacio), pero cada fragmento de texto
+    se asigna una sola vez a su bloque más cercano en lugar de repetir el
+    texto de cada div/section anidado.
+    """
+    return _combine_text_blocks(visible_text_blocks(html), max_length)
+
+def visible_text_blocks(html):
+    """Bloques de texto visible de una página como (es_importante, texto), en orden del documento"""
+    root = _parse_lxml(html)
+    return _text_blocks_from_tree(root) if root is not None else []
+
+def _parse_lxml(html):
+    try:
+        return lxml.html.fromstring(html)
+    except ValueError:
+        # lxml no acepta str con declaración de encoding XML
+        return lxml.html.fromstring(html.encode('utf-8'))
+    except Exception:
+        return None
+
+def _visible_text_from_tree(root, max_length):
+    return _combine_text_blocks(_text_blocks_from_tree(root), max_length)
+
+def _text_blocks_from_tree(root):
+    block_tags = set(IMPORTANT_TAGS)
+    # [es_importante, fragmentos]; un bloque anidado deja en los fragmentos de su
+    # padre una referencia a sí mismo, en la posición donde empieza
+    blocks = []
+    root_block = [False, []]
+    blocks.append(root_block)
+    
+    # Recorrido en profundidad con pila explícita: ('el', elemento, bloque, importante) o ('text', texto, bloque)
+    stack = [('el', root, root_block, False)]
+    while stack:
+        item = stack.pop()
+        if item[0] == 'text':
+            if item[1]:
+                item[2][1].append(item[1])
+            continue
+        
+        _, element, parent_block, inherited = item
+        tag = element.tag if isinstance(element.tag, str) else None
+        if tag is None or tag in SKIPPED_TAGS or _is_hidden(element):
+            # Comentarios y elementos ocultos: se descarta el subárbol, no el texto que le sigue
+            stack.append(('text', element.tail, parent_block))
+            continue
+        
+        block, important = parent_block, inherited
+        if tag in block_tags:
+            classes = (element.get('class') or '').lower()
+            important = inherited or any(cls in classes for cls in IMPORTANT_CLASSES)
+            block = [important, []]
+            blocks.append(block)
+            parent_block[1].append(block)
+        
+        stack.append(('text', element.tail, parent_block))
+        for child in reversed(element):
+            stack.append(('el', child, block, important))
+        stack.append(('text', element.text, block))
+    
+    # Como el extractor original, el filtro de texto corto mira el texto del
+    # contenedor completo: un bloque corto ("Bogotá", "Colombia") se suma al
+    # texto de su padre en lugar de descartarse. Los hijos se resuelven antes
+    # que los padres porque se crean después.
+    texts, inline = {}, {}
+    for block in reversed(blocks):
+        parts = [inline.get(id(part), '') if isinstance(part, list) else part for part in block[1]]
+        block_text = ' '.join(' '.join(parts).split())
+        texts[id(block)] = block_text
+        inline[id(block)] = '' if len(block_text) > 10 else block_text
+    
+    text_blocks = []
+    for block in blocks:
+        block_text = texts[id(block)]
+        if len(block_text) > 10 or (block is root_block and block_text):
+            text_blocks.append((block[0], block_text))
+    return text_blocks
+
+def _combine_text_blocks(text_blocks, max_length):
+    important_text, regular_text, all_text = [], [], []
+    for important, block_text in text_blocks:
+        all_text.append(block_text)
+        if len(block_text) > 10:  # Filtrar texto muy corto
+            (important_text if important else regular_text).append(block_text)
+    
+    # Si no hay texto importante, usar todo el texto
+    if not important_text:
+        text = ' '.join(all_text)
+    else:
+        text = ' '.join(important_text)
+        if len(text) < max_length // 2:
+            remaining_length = max_length - len(text)
+            text = text + ' ' + ' '.join(regular_text)[:remaining_length]
+    
+    return ' '.join(text.split())[:max_length]
+
+def _is_hidden(element):
+    style = element.get('style')
+    if style and 'display:none' in style.replace(' ', ''):
+        return True
+    classes = element.get('class')
+    return bool(classes) and any(hidden in classes.lower() for hidden in HIDDEN_CLASSES)
+
+# ========== ARMADO DEL TEXTO PARA EL PROMPT ==========
+
+# Longitud máxima de un pasaje y palabras por shingle para detectar texto repetido entre páginas
+PASSAGE_CHARS = 600
+SHINGLE_WORDS = 5
+PHONE_PATTERN = re.compile(r'(?<![\w+])(?:\+\d{1,3}[\s.-]?)?(?:\(\d{1,4}\)[\s.-]?\d{2,4}(?:[\s.-]\d{2,4}){1,4}|\d{2,4}(?:[\s.-]\d{2,4}){2,4})(?!\w)')
+# Diccionario de Latinoamérica: nombre (en minúsculas) -> nombre del país; las regiones cuentan
+# como presencia sin país concreto
+LATAM_COUNTRIES = {
+    'argentina': 'Argentina', 'bolivia': 'Bolivia', 'brasil': 'Brasil', 'brazil': 'Brasil', 'chile': 'Chile',
+    'colombia': 'Colombia', 'costa rica': 'Costa Rica', 'cuba': 'Cuba', 'ecuador': 'Ecuador',
+    'el salvador': 'El Salvador', 'guatemala': 'Guatemala', 'honduras': 'Honduras', 'méxico': 'México',
+    'mexico': 'México', 'nicaragua': 'Nicaragua', 'panamá': 'Panamá', 'panama': 'Panamá', 'paraguay': 'Paraguay',
+    'perú': 'Perú', 'peru': 'Perú', 'puerto rico': 'Puerto Rico', 'república dominicana': 'República Dominicana',
+    'dominican republic': 'República Dominicana', 'uruguay': 'Uruguay', 'venezuela': 'Venezuela',
+    'latinoamérica': None, 'latinoamerica': None, 'latin america': None, 'latam': None, 'américa latina': None,
+}
+# "New Mexico" / "Nuevo México" es un estado de EE. UU., no México
+LATAM_PATTERN = re.compile(r'\b(?<!new )(?<!nuevo )(?:' + '|'.join(re.escape(country) for country in LATAM_COUNTRIES) + r')\b', re.IGNORECASE)
+PHONE_CONTEXT_PATTERN = re.compile(r'\b(?:tel|phone|teléfono|telefono|call us|llámanos|whatsapp|fax)\b', re.IGNORECASE)
+# Señales de que un pasaje responde a alguno de los campos de PROMPT_FIELDS, con su peso
+PASSAGE_SIGNALS = [
+    (PHONE_PATTERN, 3),
+    (PHONE_CONTEXT_PATTERN, 2),
+    (re.compile(r'\b(?:headquarter\w*|hq|based in|located in|offices? in|address|street|avenue|suite|floor|zip'
+                r'|sede|oficinas?|dirección|direccion|calle|avenida|colonia|piso|c\.p\.)\b', re.IGNORECASE), 2),
+    (LATAM_PATTERN, 2),
+    (re.compile(r'\b(?:we are|our mission|founded|leading|provider|manufactur\w*|distribut\w*|wholesale|retail\w*'
+                r'|import\w*|export\w*|products?|services|solutions|industry|clients|customers'
+                r'|somos|fundada|empresa|fabrica\w*|proveedor\w*|productos?|servicios|industria|clientes)\b', re.IGNORECASE), 1),
+    (re.compile(r'\b(?:contact|contacto|about us|nosotros|quiénes somos|quienes somos)\b', re.IGNORECASE), 1),
+]
+
+def _split_passages(text, max_chars=PASSAGE_CHARS):
+    """Partir un bloque largo en pasajes de hasta `max_chars` por frases"""
+    if len(text) <= max_chars:
+        return [text]
+    passages, current = [], ""
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        while len(sentence) > max_chars:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            passages.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        passages.append(current)
+    return passages
+
+def _shingles(text):
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {hash(' '.join(words))}
+    return {hash(' '.join(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def passage_relevance(text):
+    """Puntuación de un pasaje según cuántas señales de los campos del prompt contiene"""
+    return sum(weight for pattern, weight in PASSAGE_SIGNALS if pattern.search(text))
+
+def assemble_prompt_text(pages, token_budget=PROMPT_TOKEN_BUDGET):
+    """Elegir y ordenar el texto de una empresa para el prompt dentro de `token_budget`.
+
+    `pages` es una lista de `(etiqueta, bloques)` con los bloques de
+    `visible_text_blocks` de cada página. Los bloques se parten en pasajes,
+    los repetidos en varias páginas (menú, pie, banners) se quedan en una sola
+    copia y puntúan menos, se ordenan por relevancia para los campos del
+    prompt y se meten los mejores hasta llenar el presupuesto. El resultado
+    conserva el orden original, agrupado por página con su etiqueta.
+    """
+    passages = []  # (página, posición, importante, texto, shingles)
+    for page_number, (_, blocks) in enumerate(pages):
+        for important, block_text in blocks:
+            for text in _split_passages(block_text):
+                if len(text) > 10:  # Filtrar texto muy corto
+                    passages.append((page_number, len(passages), important, text, _shingles(text)))
+    
+    # Páginas en las que aparece cada shingle
+    shingle_pages = {}
+    for page_number, _, _, _, shingles in passages:
+        for shingle in shingles:
+            shingle_pages.setdefault(shingle, set()).add(page_number)
+    
+    candidates, seen = [], set()
+    for page_number, position, important, text, shingles in passages:
+        key = frozenset(shingles)
+        if key in seen:
+            continue  # Copia exacta de un pasaje ya visto
+        seen.add(key)
+        repeated = sum(1 for shingle in shingles if len(shingle_pages[shingle]) > 1) / len(shingles)
+        score = passage_relevance(text) + (1 if important else 0)
+        if page_number == 0 and position < 3:
+            score += 1  # Título y cabecera de la home
+        if len(pages) > 1 and repeated >= 0.6:
+            score -= 2  # Texto repetido entre páginas: boilerplate
+        candidates.append((score, page_number, position, text))
+    
+    budget = token_budget * CHARS_PER_TOKEN
+    chosen = []
+    for score, page_number, position, text in sorted(candidates, key=lambda c: (-c[0], c[2])):
+        if len(text) + 1 <= budget:
+            chosen.append((page_number, position, text))
+            budget -= len(text) + 1
+    
+    sections, current_page = [], None
+    for page_number, _, text in sorted(chosen):
+        if page_number != current_page:
+            current_page = page_number
+            if len(pages) > 1:
+                sections.append(f"[{pages[page_number][0]}]")
+        sections.append(text)
+    return "\n".join(sections)
+
+def page_label(url):
+    """Etiqueta corta de una página para el prompt (la ruta, o el nombre de archivo)"""
+    if url.startswith(('http://', 'https://')):
+        return urlparse(url).path or '/'
+    return url
 
-def build_prompt(text):
+def iter_company_html(refs, html_dir):
+    """Leer las páginas de una empresa de una en una.
+
+    Cada referencia es un archivo suelto ({'file': ...}) o un bloque de un
+    segmento de snapshots; solo se lee y descomprime ese bloque.
+    """
+    for ref in refs:
+        try:
+            if 'file' in ref:
+                with open(os.path.join(html_dir, ref['file']), encoding="utf-8") as f:
+                    yield f.read()
+            else:
+                yield SnapshotStore.read_blob(ref)
+        except Exception as e:
+            logger.warning(f"Ignorado {ref.get('file') or ref.get('sha256')}: {e}")
+            yield ""
+
+# Campos que se piden al LLM y su descripción en el prompt
+PROMPT_FIELDS = {
+    'hq_city': "Ciudad de la sede principal (string)",
+    'hq_state': "Estado/provincia de la sede principal (string) ",
+    'company_description': "Descripción breve de la empresa (máximo 60 palabras)",
+    'sector': "Sector industrial (ej: 'Tecnología', 'Servicios Financieros', 'Manufactura')",
+    'rol_empresa': "Rol en la cadena de suministro (ej: 'Productor', 'Distribuidor', 'Retailer', 'Mayorista', 'Importador', 'Exportador', 'Fabricante', 'Proveedor de Servicios')",
+    'presence_in_latam': "Presencia en Latinoamérica (True/False + lista países si se mencionan)",
+    'contact_phone': "Números de teléfono de contacto (lista de strings)",
+    'productos_comercializan': "Descripción de los principales productos que comercializa la empresa",
+}
+
+def _prompt_field_lines(fields=None):
+    return "\n".join(f"- {field}: {description}" for field, description in PROMPT_FIELDS.items()
+                     if fields is None or field in fields)
+
+def build_prompt(text, fields=None):
+    """Prompt para una empresa; con `fields` solo se piden esos campos de PROMPT_FIELDS"""
     return f"""
 Eres un experto en extracción de datos empresariales. Analiza el siguiente texto de un sitio web empresarial y responde ÚNICAMENTE con un JSON que contenga:
 
-- hq_city: Ciudad de la sede principal (string)
-- hq_state: Estado/provincia de la sede principal (string) 
-- company_description: Descripción breve de la empresa (máximo 60 palabras)
-- sector: Sector industrial (ej: 'Tecnología', 'Servicios Financieros', 'Manufactura')
-- rol_empresa: Rol en la cadena de suministro (ej: 'Productor', 'Distribuidor', 'Retailer', 'Mayorista', 'Importador', 'Exportador', 'Fabricante', 'Proveedor de Servicios')
-- presence_in_latam: Presencia en Latinoamérica (True/False + lista países si se mencionan)
-- contact_phone: Números de teléfono de contacto (lista de strings)
-- productos_comercializan: Descripción de los principales productos que comercializa la empresa
+{_prompt_field_lines(fields)}
 
 Si falta algún campo, usa "No Information".
 
@@ -225,7 +823,308 @@ Texto:
 {text}
 """
 
-def call_gemini(prompt, model_name="gemini-2.0-flash", cache=None):
+def build_batch_prompt(texts, fields=None):
+    """Prompt para varias empresas a la vez; `texts` es un dict id -> texto"""
+    sections = "\n\n".join(f"### Empresa id={company_id}\n{text}" for company_id, text in texts.items())
+    return f"""
+Eres un experto en extracción de datos empresariales. A continuación hay textos de {len(texts)} sitios web empresariales, cada uno precedido por su identificador. Responde ÚNICAMENTE con un array JSON con un objeto por empresa, en el mismo orden, y cada objeto debe contener:
+
+- id: El identificador de la empresa tal como aparece (string)
+{_prompt_field_lines(fields)}
+
+Si falta algún campo, usa "No Information". No mezcles información entre empresas.
+
+Responde únicamente con el array JSON, sin explicaciones adicionales.
+
+{sections}
+"""
+
+# ========== PRE-EXTRACCIÓN SIN LLM ==========
+
+# Dígitos de un teléfono válido y teléfonos que se guardan como máximo por empresa
+PHONE_MIN_DIGITS = 7
+PHONE_MAX_DIGITS = 15
+MAX_PHONES = 5
+# Caracteres antes de un número en los que debe aparecer "tel", "teléfono"... para aceptarlo del texto
+PHONE_CONTEXT_CHARS = 40
+# Secuencias de años ("2019 2020 2021") que el patrón de teléfonos confunde con un número
+YEAR_SEQUENCE = re.compile(r'^(?:(?:19|20)\d\d[\s.-]*)+$')
+# Palabras (mínimo, máximo) de la descripción propia del sitio para usarla como company_description
+DESCRIPTION_WORDS = (8, 60)
+# Tipos schema.org cuya descripción es la de la empresa
+ORGANIZATION_TYPES = {'Organization', 'Corporation', 'LocalBusiness', 'OnlineBusiness', 'ProfessionalService', 'Store'}
+ADDRESS_KEYS = ('addressLocality', 'addressRegion', 'addressCountry')
+# Un bloque que nombra más países de Latinoamérica que esto es una lista de todos los países
+# (selector de un formulario), no una mención de presencia
+LATAM_LIST_MAX = 10
+# Una mención cuenta como presencia en Latinoamérica solo si el nombre va con mayúscula
+# ("Chile", no el chile picante) y hay una palabra de oficinas/operaciones a menos de
+# LATAM_CONTEXT_CHARS caracteres ("sombreros Panamá" no basta)
+LATAM_CONTEXT_CHARS = 60
+LATAM_MENTION_PATTERN = re.compile(
+    r'\b(?<!New )(?<!NEW )(?<!Nuevo )(?<!NUEVO )(?:'
+    + '|'.join(sorted({re.escape(form) for name in LATAM_COUNTRIES for form in (name.title(), name.upper())} | {'LatAm'},
+                      key=len, reverse=True))
+    + r')\b'
+)
+LATAM_PRESENCE_PATTERN = re.compile(
+    r'\b(?:offices?|presence|operat\w*|located|based|headquarter\w*|subsidiar\w*|branch\w*|plants?|facilit\w*'
+    r'|distribut\w*|countries|markets?|serv(?:e|es|ing)|sede|oficinas?|presencia|opera\w*|ubicad\w*|filial\w*'
+    r'|sucursal\w*|plantas?|distribuidor\w*|países|paises|mercados?)\b',
+    re.IGNORECASE,
+)
+# Códigos ISO de addressCountry en Latinoamérica
+LATAM_COUNTRY_CODES = {
+    'AR': 'Argentina', 'BO': 'Bolivia', 'BR': 'Brasil', 'CL': 'Chile', 'CO': 'Colombia', 'CR': 'Costa Rica',
+    'CU': 'Cuba', 'DO': 'República Dominicana', 'EC': 'Ecuador', 'GT': 'Guatemala', 'HN': 'Honduras',
+    'MX': 'México', 'NI': 'Nicaragua', 'PA': 'Panamá', 'PE': 'Perú', 'PR': 'Puerto Rico', 'PY': 'Paraguay',
+    'SV': 'El Salvador', 'UY': 'Uruguay', 'VE': 'Venezuela',
+}
+
+def _jsonld_types(node):
+    types = node.get('@type')
+    if isinstance(types, str):
+        return {types}
+    return {t for t in types if isinstance(t, str)} if isinstance(types, list) else set()
+
+def _jsonld_nodes(root):
+    """Objetos de los bloques JSON-LD de una página en orden, sin entrar en los de personas"""
+    for script in root.xpath('//script[contains(@type, "ld+json")]'):
+        try:
+            stack = [json.loads(script.text or "")]
+        except ValueError:
+            continue
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(reversed(item))
+            elif isinstance(item, dict) and 'Person' not in _jsonld_types(item):
+                yield item
+                stack.extend(reversed([value for value in item.values() if isinstance(value, (list, dict))]))
+
+def _jsonld_text(value):
+    """Texto de una propiedad JSON-LD, que puede venir como string, lista u objeto con 'name'"""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get('name') or value.get('@value')
+    return ' '.join(value.split()) if isinstance(value, str) and value.strip() else None
+
+def page_facts(root, blocks):
+    """Datos explícitos de una página: teléfonos, dirección, descripción propia y menciones de Latinoamérica.
+
+    `root` es el árbol lxml de la página y `blocks` sus bloques de
+    `visible_text_blocks`. Los teléfonos de enlaces tel:, JSON-LD y microdata
+    van a 'phones'; los que solo aparecen en el texto, junto a palabras como
+    "tel" o "teléfono", van aparte a 'text_phones' porque son menos fiables.
+    """
+    facts = {'phones': [], 'text_phones': [], 'address': {}, 'description': None, 'countries': [], 'latam': False}
+    if root is not None:
+        for href in root.xpath('//a/@href'):
+            href = href.strip()
+            if href[:4].lower() == 'tel:':
+                facts['phones'].append(unquote(href[4:]).split('?')[0])
+        
+        addresses = []
+        for node in _jsonld_nodes(root):
+            types = _jsonld_types(node)
+            telephones = node.get('telephone')
+            for phone in telephones if isinstance(telephones, list) else [telephones]:
+                if isinstance(phone, str):
+                    facts['phones'].append(phone)
+            if 'PostalAddress' in types or 'addressLocality' in node or 'addressRegion' in node:
+                addresses.append({key: _jsonld_text(node.get(key)) for key in ADDRESS_KEYS})
+            if types & ORGANIZATION_TYPES and not facts['description']:
+                facts['description'] = _jsonld_text(node.get('description'))
+        
+        microdata = {}
+        for element in root.xpath('//*[@itemprop]'):
+            prop = element.get('itemprop')
+            value = ' '.join((element.get('content') or element.text_content()).split())
+            if prop == 'telephone':
+                facts['phones'].append(value)
+            elif prop in ADDRESS_KEYS and value:
+                microdata.setdefault(prop, value)
+        addresses.append(microdata)
+        # Vale la primera dirección con ciudad o estado; no se mezclan campos de direcciones distintas
+        facts['address'] = next((address for address in addresses if address.get('addressLocality') or address.get('addressRegion')), {})
+    
+    for _, text in blocks:
+        if PHONE_CONTEXT_PATTERN.search(text):
+            for match in PHONE_PATTERN.finditer(text):
+                if (not YEAR_SEQUENCE.match(match.group())
+                        and PHONE_CONTEXT_PATTERN.search(text, max(0, match.start() - PHONE_CONTEXT_CHARS), match.start())):
+                    facts['text_phones'].append(match.group())
+        mentions = [
+            LATAM_COUNTRIES[match.group().lower()] for match in LATAM_MENTION_PATTERN.finditer(text)
+            if LATAM_PRESENCE_PATTERN.search(text, max(0, match.start() - LATAM_CONTEXT_CHARS), match.end() + LATAM_CONTEXT_CHARS)
+        ]
+        if mentions and len(set(mentions)) <= LATAM_LIST_MAX:
+            facts['latam'] = True
+            facts['countries'].extend(country for country in mentions if country)
+    return facts
+
+def _unique_phones(candidates):
+    phones, seen = [], set()
+    for phone in candidates:
+        phone = ' '.join(phone.split()).strip(' .-/')
+        digits = re.sub(r'\D', '', phone)
+        # Mismo número con y sin prefijo de país: se comparan los últimos dígitos
+        if not PHONE_MIN_DIGITS <= len(digits) <= PHONE_MAX_DIGITS or digits[-PHONE_MIN_DIGITS:] in seen:
+            continue
+        seen.add(digits[-PHONE_MIN_DIGITS:])
+        phones.append(phone)
+    return phones[:MAX_PHONES]
+
+def pre_extract_fields(facts_by_page):
+    """Campos de PROMPT_FIELDS resueltos sin LLM a partir de los `page_facts` de una empresa.
+
+    Solo se devuelven los campos encontrados: que falte un dato no implica
+    "No Information" ni presence_in_latam=False, eso lo decide el LLM.
+    """
+    fields = {}
+    phones = (_unique_phones(phone for facts in facts_by_page for phone in facts['phones'])
+              or _unique_phones(phone for facts in facts_by_page for phone in facts['text_phones']))
+    if phones:
+        fields['contact_phone'] = phones
+    
+    address = next((facts['address'] for facts in facts_by_page if facts['address']), {})
+    if address.get('addressLocality'):
+        fields['hq_city'] = address['addressLocality']
+    if address.get('addressRegion'):
+        fields['hq_state'] = address['addressRegion']
+    
+    description = next((facts['description'] for facts in facts_by_page if facts['description']), None)
+    if description and DESCRIPTION_WORDS[0] <= len(description.split()) <= DESCRIPTION_WORDS[1]:
+        fields['company_description'] = description
+    
+    country = address.get('addressCountry') or ''
+    countries = [LATAM_COUNTRY_CODES.get(country.upper()) or LATAM_COUNTRIES.get(country.lower())]
+    countries += [name for facts in facts_by_page for name in facts['countries']]
+    countries = list(dict.fromkeys(name for name in countries if name))
+    if countries or any(facts['latam'] for facts in facts_by_page):
+        fields['presence_in_latam'] = f"True ({', '.join(countries)})" if countries else "True"
+    return fields
+
+def fields_for_llm(known):
+    """Campos de PROMPT_FIELDS que hay que pedir al LLM, o [] si los de LLM_FIELDS ya están resueltos"""
+    if all(field in known for field in LLM_FIELDS or PROMPT_FIELDS):
+        return []
+    return [field for field in PROMPT_FIELDS if field not in known]
+
+# ========== CLIENTE LLM ==========
+
+class TokenBucket:
+    """Limitador token bucket asíncrono: `per_minute` unidades por minuto.
+
+    Por defecto solo acumula LLM_BURST_SECONDS de cupo: con el minuto entero
+    lleno, al arrancar saldrían `per_minute` peticiones de golpe.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate * LLM_BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, amount):
+        """Descontar (o devolver, si es negativo) la diferencia con el consumo real"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class GeminiBackend:
+    """Backend real: un único GenerativeModel compartido por toda la ejecución"""
+
+    def __init__(self, model_name=GEMINI_MODEL):
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    async def generate(self, prompt):
+        response = await self.model.generate_content_async(prompt)
+        usage = getattr(response, 'usage_metadata', None)
+        return response.text, getattr(usage, 'total_token_count', None)
+
+class StubBackend:
+    """Backend local para pruebas y benchmarks: responde JSON sin llamar a la API"""
+
+    model_name = "stub"
+
+    def __init__(self, latency=STUB_LLM_LATENCY):
+        self.latency = latency
+
+    async def generate(self, prompt):
+        await asyncio.sleep(self.latency)
+        answer = {field: "No Information" for field in PROMPT_FIELDS}
+        ids = re.findall(r'^### Empresa id=(\S+)$', prompt, re.MULTILINE)
+        if ids:
+            return json.dumps([dict(answer, id=company_id) for company_id in ids]), None
+        return json.dumps(answer), None
+
+class LLMClient:
+    """Cliente LLM asíncrono con límites de peticiones/tokens por minuto y reintentos.
+
+    Los errores 429/5xx y los timeouts se reintentan con backoff exponencial
+    con jitter; cualquier otro error se propaga de inmediato.
+    """
+
+    RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, backend, rpm=LLM_RPM, tpm=LLM_TPM, max_retries=LLM_MAX_RETRIES):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+
+    async def generate(self, prompt):
+        # Estimación aproximada: ~4 caracteres por token más la respuesta
+        estimated_tokens = len(prompt) // 4 + 512
+        for attempt in range(self.max_retries + 1):
+            # Espera por los límites de peticiones/tokens por minuto
+            with metrics.timer('llm_wait_seconds'):
+                await self.requests.acquire()
+                await self.tokens.acquire(estimated_tokens)
+            try:
+                with metrics.timer('llm_request_seconds'):
+                    text, used_tokens = await self.backend.generate(prompt)
+                if used_tokens:
+                    self.tokens.adjust(used_tokens - estimated_tokens)
+                metrics.inc('llm_requests_total', outcome='ok')
+                metrics.inc('llm_tokens_total', used_tokens or estimated_tokens)
+                return text
+            except Exception as e:
+                code = getattr(e, 'code', None)
+                retryable = code in self.RETRYABLE_CODES or isinstance(e, (asyncio.TimeoutError, aiohttp.ClientError))
+                if not retryable or attempt == self.max_retries:
+                    metrics.inc('llm_requests_total', outcome='error')
+                    raise
+                metrics.inc('llm_requests_total', outcome='retry')
+                delay = random.uniform(0, min(60.0, LLM_BACKOFF_BASE * 2 ** attempt))
+                logger.warning(f"Error temporal del LLM ({code or type(e).__name__}), reintento {attempt+1} en {delay:.1f} s")
+                await asyncio.sleep(delay)
+
+def create_llm_client(backend=LLM_BACKEND):
+    """Crear el cliente LLM para el backend configurado ('gemini' o 'stub')"""
+    if backend == 'stub':
+        return LLMClient(StubBackend())
+    return LLMClient(GeminiBackend())
+
+async def call_gemini(prompt, llm_client, cache=None):
     """Llamar a Gemini con caché y rate limiting."""
     if cache is None:
         cache = {}
@@ -233,16 +1132,12 @@ def call_gemini(prompt, model_name="gemini-2.0-flash", cache=None):
     cache_key = create_cache_key(prompt)
     if cache_key in cache:
         logger.info("Usando respuesta desde caché de Gemini")
+        metrics.inc('llm_cache_total', result='hit')
         return cache[cache_key]
-    
-    model = genai.GenerativeModel(model_name)
-    
-    # Rate limiting
-    time.sleep(GPT_RATE_LIMIT_DELAY)
+    metrics.inc('llm_cache_total', result='miss')
     
     try:
-        response = model.generate_content(prompt)
-        result = response.text
+        result = await llm_client.generate(prompt)
         
         cache[cache_key] = result
         
@@ -253,6 +1148,64 @@ def call_gemini(prompt, model_name="gemini-2.0-flash", cache=None):
         logger.error(f"Error en Gemini: {e}")
         return "{}"
 
+async def call_gemini_batch(texts, llm_client, cache=None, fields=None):
+    """Llamar a Gemini con varias empresas en un solo prompt.
+
+    `texts` es un dict id -> texto visible. Devuelve un dict id -> respuesta
+    en el mismo formato que `call_gemini`, así que cada respuesta se procesa
+    con `parse_response_to_dict`. Las respuestas se guardan en caché con la
+    clave del prompt individual de cada empresa. Si la respuesta del lote no
+    es un array JSON válido, o le faltan empresas, esas empresas se consultan
+    una por una. `fields` (dict id -> campos) limita los campos pedidos; el
+    lote pide la unión de los de sus empresas.
+    """
+    if cache is None:
+        cache = {}
+    fields = fields or {}
+    
+    responses, pending = {}, {}
+    for company_id, text in texts.items():
+        cache_key = create_cache_key(build_prompt(text, fields.get(company_id)))
+        if cache_key in cache:
+            responses[company_id] = cache[cache_key]
+        else:
+            pending[company_id] = text
+    if responses:
+        logger.info(f"Usando {len(responses)} respuestas desde caché de Gemini")
+        metrics.inc('llm_cache_total', len(responses), result='hit')
+    
+    if len(pending) > 1:
+        try:
+            batch_fields = None
+            if all(fields.get(company_id) is not None for company_id in pending):
+                batch_fields = {field for company_id in pending for field in fields[company_id]}
+            batch = parse_batch_response(await llm_client.generate(build_batch_prompt(pending, batch_fields)))
+            for company_id, item in batch.items():
+                if company_id in pending:
+                    result = json.dumps(item, ensure_ascii=False)
+                    cache[create_cache_key(build_prompt(pending.pop(company_id), fields.get(company_id)))] = result
+                    responses[company_id] = result
+                    metrics.inc('llm_cache_total', result='miss')
+            logger.info(f"Lote de Gemini: {len(batch)} empresas en una llamada")
+        except Exception as e:
+            logger.warning(f"Respuesta de lote de Gemini no válida, consultando por separado: {e}")
+    
+    # Lo que no resolvió el lote se consulta de forma individual
+    for company_id, text in pending.items():
+        responses[company_id] = await call_gemini(build_prompt(text, fields.get(company_id)), llm_client, cache)
+    return responses
+
+def parse_batch_response(response_text):
+    """Extraer el array JSON de una respuesta de lote como dict id -> objeto"""
+    json_start = response_text.find('[')
+    json_end = response_text.rfind(']') + 1
+    if json_start == -1 or json_end <= json_start:
+        raise ValueError("no se encontró un array JSON en la respuesta")
+    data = json.loads(response_text[json_start:json_end])
+    if not isinstance(data, list):
+        raise ValueError("la respuesta no es un array")
+    return {str(item.pop('id')): item for item in data if isinstance(item, dict) and 'id' in item}
+
 def normalize_response(data):
     """Normalize the AI response dictionary."""
     if not isinstance(data, dict):
@@ -330,81 +1283,343 @@ def parse_response_to_dict(response_text):
         logging.error(f"An unexpected error occurred in parse_response_to_dict: {e}")
         return normalize_response(None)
 
-def find_internal_links(html, base_url, keywords=KEYWORDS, max_links=8):
-    soup = BeautifulSoup(html, 'html.parser')
-    found, seen = [], set()
-    for a in soup.find_all('a', href=True):
-        href, text = a['href'], (a.get_text() or "").lower()
-        if href.startswith("#") or href.startswith("mailto:") or href.startswith("tel:"):
+def _soup_anchors(soup):
+    return ((a['href'], a.get_text()) for a in soup.find_all('a', href=True))
+
+def _tree_anchors(root):
+    return ((a.get('href'), a.text_content()) for a in root.iter('a') if a.get('href'))
+
+def _compile_link_matcher(categories):
+    """Una sola regex con todas las palabras clave (las más largas primero) y su categoría"""
+    keyword_weight = {}
+    for weight, keywords in categories.values():
+        for kw in keywords:
+            keyword_weight[kw] = max(weight, keyword_weight.get(kw, 0))
+    alternation = '|'.join(re.escape(kw) for kw in sorted(keyword_weight, key=len, reverse=True))
+    # Solo se exige que la palabra empiece en un límite: 'aboutus' cuenta, 'design' no es 'esg'
+    return re.compile(rf'(?<![^\W\d_])(?:{alternation})'), keyword_weight
+
+LINK_MATCHER, KEYWORD_WEIGHTS = _compile_link_matcher(LINK_CATEGORIES)
+
+def canonicalize_url(url):
+    """Forma canónica de un enlace: sin fragmento, parámetros de seguimiento ni barra final"""
+    parsed = urlparse(url)
+    path = re.sub(r'/{2,}', '/', parsed.path).rstrip('/') or '/'
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                             if not TRACKING_PARAMS.match(key)))
+    return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{path}" + (f"?{query}" if query else "")
+
+def _site(url):
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+def score_link(url, text=""):
+    """Relevancia de un enlace: peso de la mejor categoría mencionada en la ruta (o, con
+    menos peso, en el texto) menos la profundidad de la ruta. 0 o menos = descartar"""
+    path = unquote(urlparse(url).path).lower()
+    if LINK_PENALTY_PATTERN.search(path):
+        return 0
+    weights = [KEYWORD_WEIGHTS[m.group(0)] for m in LINK_MATCHER.finditer(path)]
+    weights += [KEYWORD_WEIGHTS[m.group(0)] - LINK_TEXT_PENALTY
+                for m in LINK_MATCHER.finditer(" ".join(text.split())[:LINK_TEXT_CHARS].lower())]
+    if not weights:
+        return 0
+    depth = len([segment for segment in path.split('/') if segment])
+    return max(weights) - LINK_DEPTH_PENALTY * max(0, depth - 1)
+
+def rank_internal_links(anchors, base_url, max_links=MAX_SECTION_LINKS):
+    """Elegir los `max_links` enlaces internos más relevantes de `(href, texto)`.
+
+    Los enlaces se canonicalizan y deduplican, y a igualdad de puntuación se
+    respeta el orden en que aparecen. Las variantes con y sin `www.` (o con
+    otro esquema) del mismo sitio se reescriben al host y esquema de
+    `base_url`, para no elegir dos veces la misma página ni volver a la home.
+    """
+    base = urlparse(base_url)
+    home, site = canonicalize_url(base_url), _site(base_url)
+    scored = {}
+    for order, (href, text) in enumerate(anchors):
+        href = (href or "").strip()
+        if not href or href.startswith(("#", "mailto:", "tel:", "javascript:")):
             continue
         full_url = urljoin(base_url, href)
-        if urlparse(full_url).netloc != urlparse(base_url).netloc: continue
-        if full_url in seen: continue
-        if any(kw in href.lower() for kw in keywords) or any(kw in text for kw in keywords):
-            found.append(full_url)
-            seen.add(full_url)
-        if len(found) >= max_links: break
-    return found
-
-async def get_rendered_html_async(url, timeout=20000, max_retries=3):
-    """Obtener HTML renderizado con mejor manejo de contenido dinámico"""
-    for attempt in range(max_retries):
+        parsed = urlparse(full_url)
+        if parsed.scheme not in ('http', 'https') or _site(full_url) != site:
+            continue
+        if parsed.path.lower().endswith(NON_HTML_EXTENSIONS):
+            continue
+        url = canonicalize_url(parsed._replace(scheme=base.scheme, netloc=base.netloc).geturl())
+        if url == home:
+            continue
+        score = score_link(url, text or "")
+        if score > 0 and (url not in scored or score > scored[url][0]):
+            scored[url] = (score, scored[url][1] if url in scored else order)
+    ranked = sorted(scored.items(), key=lambda item: (-item[1][0], item[1][1]))
+    return [url for url, _ in ranked[:max_links]]
+
+# ========== PARSEO EN POOL DE PROCESOS ==========
+
+def parse_html_page(html, base_url, max_length=14000, extra_urls=()):
+    """Parsear una página una sola vez y devolver solo texto visible y enlaces internos.
+
+    `extra_urls` (p. ej. las de sitemap.xml) compiten en el ranking con los enlaces de la página.
+    """
+    extra_anchors = [(url, "") for url in extra_urls]
+    if TEXT_EXTRACTOR == 'bs4':
+        soup = BeautifulSoup(html, 'html.parser')
+        # Los enlaces se leen antes porque la extracción de texto elimina nodos ocultos
+        links = rank_internal_links(list(_soup_anchors(soup)) + extra_anchors, base_url)
+        return {'text': _visible_text_from_soup(soup, max_length), 'links': links}
+    
+    root = _parse_lxml(html)
+    if root is None:
+        return {'text': "", 'links': rank_internal_links(extra_anchors, base_url)}
+    links = rank_internal_links(list(_tree_anchors(root)) + extra_anchors, base_url)
+    return {'text': _visible_text_from_tree(root, max_length), 'links': links}
+
+def extract_company_data(refs, html_dir, max_length=PROMPT_TOKEN_BUDGET * CHARS_PER_TOKEN):
+    """Texto para el prompt y campos pre-extraídos de una empresa (se ejecuta en el pool).
+
+    Cada página se parsea una sola vez con lxml y de ese árbol salen tanto
+    sus bloques de texto como los datos de `page_facts`.
+    """
+    pages, facts_by_page, htmls = [], [], []
+    for ref, html in zip(refs, iter_company_html(refs, html_dir)):
+        if TEXT_EXTRACTOR == 'bs4':
+            htmls.append(html)
+            if not PRE_EXTRACT:
+                continue
+        root = _parse_lxml(html)
+        blocks = _text_blocks_from_tree(root) if root is not None else []
+        pages.append((page_label(ref.get('url') or ref.get('file', '')), blocks))
+        if PRE_EXTRACT:
+            facts_by_page.append(page_facts(root, blocks))
+    
+    fields = pre_extract_fields(facts_by_page) if facts_by_page else {}
+    if TEXT_EXTRACTOR == 'bs4':
+        all_html_text = "\n".join(htmls)
+        return {'text': extract_visible_text(all_html_text, max_length=max_length) if all_html_text.strip() else "", 'fields': fields}
+    
+    # Con lxml cada página se parsea por separado y los pasajes de todas compiten
+    # por el presupuesto según su relevancia
+    return {'text': assemble_prompt_text(pages, max_length // CHARS_PER_TOKEN), 'fields': fields}
+
+_parse_pool = None
+
+async def parse_in_pool(func, *args):
+    """Ejecutar una función de parseo en el pool de procesos sin bloquear el event loop"""
+    global _parse_pool
+    if PARSE_WORKERS <= 0:
+        return func(*args)
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return await asyncio.get_running_loop().run_in_executor(_parse_pool, func, *args)
+
+def shutdown_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+        _parse_pool = None
+
+# ========== POOL DE NAVEGADOR ==========
+
+class BrowserPool:
+    """Navegador Chromium compartido con un pool de contextos reutilizables.
+
+    Se lanza una sola vez en main() y lo usan todas las tareas de empresas.
+    Cada contexto se recicla tras `pages_per_context` páginas o cuando una
+    página falla, y el navegador se relanza si se desconecta.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, pages_per_context=PAGES_PER_CONTEXT):
+        self.size = max(1, size)
+        self.pages_per_context = max(1, pages_per_context)
+        self._playwright = None
+        self._browser = None
+        self._slots = None
+        self._launch_lock = asyncio.Lock()
+
+    async def start(self):
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._slots = asyncio.Queue()
+        for _ in range(self.size):
+            self._slots.put_nowait({'context': None, 'pages': 0})
+        logger.info(f"Pool de navegador iniciado ({self.size} contextos, {self.pages_per_context} páginas por contexto)")
+
+    async def close(self):
+        if self._slots is not None:
+            while not self._slots.empty():
+                await self._dispose(self._slots.get_nowait())
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._browser = self._playwright = None
+
+    async def _ensure_browser(self):
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                logger.warning("Navegador desconectado, relanzando Chromium")
+                self._browser = await self._playwright.chromium.launch(headless=True)
+
+    async def _dispose(self, slot):
+        context = slot['context']
+        slot['context'], slot['pages'] = None, 0
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def page(self):
+        """Prestar una página nueva; se cierra y se devuelve el contexto al salir."""
+        slot = await self._slots.get()
+        page = None
+        failed = False
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context(
+            if slot['context'] is None or slot['pages'] >= self.pages_per_context:
+                await self._dispose(slot)
+                await self._ensure_browser()
+                slot['context'] = await self._browser.new_context(
                     ignore_https_errors=True,
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+                    user_agent=USER_AGENT
                 )
-                page = await context.new_page()
-                
+            page = await slot['context'].new_page()
+            slot['pages'] += 1
+            yield page
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            if page is not None:
+                try:
+                    await page.close()
+                except Exception:
+                    failed = True
+            if failed:
+                # Reciclar el contexto tras un fallo para no arrastrar estado roto
+                await self._dispose(slot)
+            self._slots.put_nowait(slot)
+
+# ========== ESPERA ADAPTATIVA DE RENDERIZADO ==========
+
+# Desplaza la página por pantallas para disparar lazy loading y espera a que el
+# DOM se estabilice: sin mutaciones durante `quietMs`, sin imágenes pendientes y
+# con la longitud del texto visible constante. Nunca espera más de `maxMs`.
+RENDER_READY_JS = """
+async ({quietMs, maxMs}) => {
+    const start = performance.now();
+    const elapsed = () => performance.now() - start;
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    let lastMutation = performance.now();
+    const observer = new MutationObserver(() => { lastMutation = performance.now(); });
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+    try {
+        const step = Math.max(window.innerHeight, 400);
+        for (let y = 0; y < document.body.scrollHeight && elapsed() < maxMs / 2; y += step) {
+            window.scrollTo(0, y);
+            await sleep(50);
+        }
+        window.scrollTo(0, 0);
+        let lastLength = -1;
+        let stableSince = performance.now();
+        while (elapsed() < maxMs) {
+            await sleep(100);
+            const now = performance.now();
+            const length = document.body ? document.body.innerText.length : 0;
+            if (length !== lastLength) {
+                lastLength = length;
+                stableSince = now;
+            }
+            const pendingImages = Array.from(document.images).filter((img) => img.currentSrc && !img.complete).length;
+            if (now - lastMutation >= quietMs && now - stableSince >= quietMs && pendingImages === 0) {
+                return {ready: true, elapsed: elapsed()};
+            }
+        }
+        return {ready: false, elapsed: elapsed()};
+    } finally {
+        observer.disconnect();
+    }
+}
+"""
+
+def load_domain_profiles(path=DOMAIN_PROFILES_FILE):
+    """Cargar perfiles aprendidos por dominio (tiempos de espera de renderizado)"""
+    if os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Error cargando perfiles de dominio: {e}")
+    return {}
+
+def save_domain_profiles(profiles, path=DOMAIN_PROFILES_FILE):
+    """Guardar perfiles aprendidos por dominio"""
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        logger.error(f"Error guardando perfiles de dominio: {e}")
+
+def render_wait_budget(profiles, url):
+    """Tiempo máximo de espera (ms) para un dominio según lo que tardó antes"""
+    profile = profiles.get(urlparse(url).netloc) if profiles is not None else None
+    if not profile or 'settle_ms' not in profile:
+        return RENDER_MAX_WAIT_MS
+    budget = max(2 * profile['settle_ms'], RENDER_MIN_WAIT_MS) + RENDER_QUIET_MS
+    return int(min(budget, RENDER_MAX_WAIT_MS))
+
+async def wait_for_render_ready(page, url, profiles=None):
+    """Esperar a que la página esté estable y actualizar el perfil del dominio"""
+    budget = render_wait_budget(profiles, url)
+    try:
+        outcome = await page.evaluate(RENDER_READY_JS, {'quietMs': RENDER_QUIET_MS, 'maxMs': budget})
+    except Exception as e:
+        logger.debug(f"    Espera adaptativa falló para {url}: {e}")
+        return False
+    
+    if profiles is not None:
+        domain = urlparse(url).netloc
+        # Si se agotó el presupuesto, aprender un tiempo mayor para la próxima vez
+        settle_ms = outcome['elapsed'] if outcome['ready'] else 2 * budget
+        profile = profiles.setdefault(domain, {})
+        profile['settle_ms'] = round(0.7 * profile.get('settle_ms', settle_ms) + 0.3 * settle_ms)
+        profile['samples'] = profile.get('samples', 0) + 1
+    
+    if not outcome['ready']:
+        logger.info(f"    Página no estabilizada tras {budget} ms: {url}")
+    return outcome['ready']
+
+async def get_rendered_html_async(url, browser_pool, domain_profiles=None, timeout=20000, max_retries=3, page_info=None, failure=None):
+    """Obtener HTML renderizado con mejor manejo de contenido dinámico"""
+    for attempt in range(max_retries):
+        try:
+            async with browser_pool.page() as page:
                 # Configurar timeouts más largos para contenido dinámico
                 page.set_default_timeout(30000)
                 page.set_default_navigation_timeout(30000)
                 
-                # Navegar a la página
-                await page.goto(url, timeout=timeout, wait_until='networkidle')
-                
-                # Esperar a que se cargue el contenido dinámico
-                await page.wait_for_timeout(5000)
-                
-                # Intentar hacer scroll para activar lazy loading
-                try:
-                    await page.evaluate("""
-                        async () => {
-                            await new Promise((resolve) => {
-                                let totalHeight = 0;
-                                const distance = 100;
-                                const timer = setInterval(() => {
-                                    const scrollHeight = document.body.scrollHeight;
-                                    window.scrollBy(0, distance);
-                                    totalHeight += distance;
-                                    
-                                    if(totalHeight >= scrollHeight){
-                                        clearInterval(timer);
-                                        resolve();
-                                    }
-                                }, 100);
-                            });
-                        }
-                    """)
-                    await page.wait_for_timeout(2000)
-                except:
-                    pass  # Si falla el scroll, continuar
-                
-                # Volver al inicio de la página
-                await page.evaluate("window.scrollTo(0, 0)")
-                await page.wait_for_timeout(1000)
+                # Navegar y esperar solo lo necesario hasta que el DOM esté estable
+                response = await page.goto(url, timeout=timeout, wait_until='load')
+                store_validators(page_info, response.headers if response else {})
+                await wait_for_render_ready(page, url, domain_profiles)
                 
                 # Obtener el HTML final renderizado
                 html = await page.content()
-                await browser.close()
                 
-                logger.info(f"    HTML renderizado obtenido para {url} (intento {attempt+1})")
-                return html
+            logger.info(f"    HTML renderizado obtenido para {url} (intento {attempt+1})")
+            return html
                 
         except Exception as e:
             logger.error(f"Error intento {attempt+1} para {url}: {e}")
+            if failure is not None:
+                reason = classify_failure(e)
+                failure['reason'] = 'render' if reason == 'unknown' else reason
             if attempt < max_retries - 1:
                 await asyncio.sleep(3 * (attempt + 1))
     
@@ -412,66 +1627,591 @@ async def get_rendered_html_async(url, timeout=20000, max_retries=3):
     return None
 
 
-def save_checkpoint(processed):
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(processed), f)
+# ========== CORTESÍA POR DOMINIO ==========
 
-def load_checkpoint():
-    if os.path.exists(CHECKPOINT_FILE):
-        with open(CHECKPOINT_FILE, encoding="utf-8") as f:
-            return set(json.load(f))
-    return set()
+class HostScheduler:
+    """Reparto de peticiones por dominio.
 
-async def download_sections(sections, company, base_output_dir, timeout=20000):
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True) 
-        tasks, results = [], {}
-        for link in sections:
-            tasks.append(_fetch_and_save_section(browser, link, company, base_output_dir, timeout))
-        results_list = await asyncio.gather(*tasks)
-        for url, html, fname in results_list:
-            if html:
-                results[url] = fname
-        await browser.close()
-        return results
+    Cada dominio admite como mucho `concurrency` peticiones a la vez y una
+    nueva petición cada `min_interval` segundos, o cada crawl-delay (o
+    request-rate) de su robots.txt si es mayor. El robots.txt se lee una vez
+    por dominio y se guarda en los perfiles de dominio durante ROBOTS_TTL_DAYS.
+    Los turnos se reservan antes de dormir, así que las peticiones a un
+    dominio salen espaciadas mientras las de otros dominios siguen su curso.
+    """
 
-async def _fetch_and_save_section(browser, link, company, base_output_dir, timeout):
-    """Descargar sección con mejor renderizado"""
-    extra = urlparse(link).path.strip("/").replace("/", "_") or "extra"
-    extra_filename = safe_filename(company + "_" + extra) + ".html"
-    
-    try:
-        context = await browser.new_context(
-            ignore_https_errors=True,
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        )
-        page = await context.new_page()
+    def __init__(self, session, domain_profiles=None, concurrency=HOST_CONCURRENCY, min_interval=HOST_MIN_INTERVAL):
+        self.session = session
+        self.domain_profiles = domain_profiles if domain_profiles is not None else {}
+        self.concurrency = max(1, concurrency)
+        self.min_interval = min_interval
+        self.hosts = {}
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'semaphore': asyncio.Semaphore(self.concurrency), 'robots_lock': asyncio.Lock(), 'next': 0.0}
+        return self.hosts[host]
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """Esperar turno para una petición a `url`"""
+        state = self._host(urlparse(url).netloc)
+        waiting = time.perf_counter()
+        interval = max(self.min_interval, await self.crawl_delay(url))
+        async with state['semaphore']:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            start = max(now, state['next'])
+            state['next'] = start + interval
+            if start > now:
+                await asyncio.sleep(start - now)
+            metrics.observe('host_wait_seconds', time.perf_counter() - waiting)
+            yield
+
+    async def crawl_delay(self, url):
+        """Segundos entre peticiones que pide el robots.txt del dominio (0 si no pide nada)"""
+        parsed = urlparse(url)
+        profile = self.domain_profiles.setdefault(parsed.netloc, {})
+        async with self._host(parsed.netloc)['robots_lock']:
+            robots = profile.get('robots')
+            if robots is None or time.time() - robots['checked'] > ROBOTS_TTL_DAYS * 86400:
+                delay = await self._fetch_crawl_delay(f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+                robots = profile['robots'] = {'checked': time.time(), 'delay': delay}
+        return robots['delay']
+
+    async def _fetch_crawl_delay(self, robots_url):
+        try:
+            async with self.session.get(robots_url) as response:
+                if response.status >= 400:
+                    return 0.0
+                text = await response.text(errors='replace')
+        except Exception as e:
+            logger.debug(f"    No se pudo leer {robots_url}: {e}")
+            return 0.0
         
-        # Configurar timeouts
-        page.set_default_timeout(25000)
-        page.set_default_navigation_timeout(25000)
+        parser = RobotFileParser()
+        parser.parse(text.splitlines())
+        delay = parser.crawl_delay(USER_AGENT) or 0.0
+        rate = parser.request_rate(USER_AGENT)
+        if rate and rate.requests:
+            delay = max(delay, rate.seconds / rate.requests)
+        return min(float(delay), ROBOTS_MAX_DELAY)
+
+def host_slot(scheduler, url):
+    """Turno del scheduler para `url`, o nada si no hay scheduler"""
+    return scheduler.slot(url) if scheduler is not None else nullcontext()
+
+# ========== DESCARGA ESCALONADA (HTTP -> NAVEGADOR) ==========
+
+# Señales de una SPA cuyo contenido solo aparece tras ejecutar JavaScript
+SPA_MARKERS = re.compile(
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt)["\'][^>]*>\s*</div>'
+    r'|<app-root|ng-version=|data-reactroot|window\.__NUXT__|enable javascript',
+    re.IGNORECASE
+)
+
+def store_validators(page_info, headers):
+    """Guardar ETag/Last-Modified de una respuesta para futuras peticiones condicionales"""
+    if page_info is None:
+        return
+    for header, key in (('etag', 'etag'), ('last-modified', 'last_modified')):
+        if headers.get(header):
+            page_info[key] = headers.get(header)
+
+def needs_rendering(html):
+    """Decidir si un HTML descargado por HTTP simple necesita renderizado con navegador"""
+    # Un <body> vacío o un shell de JavaScript deja casi sin texto visible
+    text_length = len(extract_visible_text(html))
+    if text_length < STATIC_MIN_TEXT:
+        return True
+    return bool(SPA_MARKERS.search(html)) and text_length < 4 * STATIC_MIN_TEXT
+
+async def fetch_html_http(session, url, page_info=None):
+    """Descargar HTML con un GET simple, sin navegador"""
+    try:
+        async with session.get(url) as response:
+            if response.status >= 400:
+                return None
+            store_validators(page_info, response.headers)
+            if 'html' not in response.headers.get('Content-Type', 'text/html').lower():
+                return None
+            return await response.text(errors='replace')
+    except Exception as e:
+        logger.debug(f"    GET simple falló para {url}: {e}")
+        return None
+
+async def fetch_html_tiered(url, session, render, domain_profiles=None, page_info=None, scheduler=None, prefetched=None):
+    """Probar primero HTTP simple y escalar a Playwright solo si el resultado no sirve.
+
+    `render` es una función sin argumentos que devuelve la corrutina de
+    renderizado, o None si no hay navegador (entonces se devuelve lo que
+    llegó por HTTP). El nivel que funcionó se guarda por dominio para que las
+    siguientes páginas y ejecuciones vayan directo a él. Cada nivel espera su
+    turno en `scheduler` si se indica. `prefetched` es el HTML ya bajado al
+    validar la URL, que sustituye al GET simple.
+    """
+    domain = urlparse(url).netloc
+    profile = domain_profiles.setdefault(domain, {}) if domain_profiles is not None else {}
+    
+    if render is None or profile.get('tier') != 'browser':
+        if prefetched is not None:
+            html = prefetched
+            metrics.inc('fetch_total', tier='prefetched', outcome='ok')
+        else:
+            async with host_slot(scheduler, url):
+                started = time.perf_counter()
+                html = await fetch_html_http(session, url, page_info)
+                record_fetch(domain, 'http', started, html)
+        if html and not await parse_in_pool(needs_rendering, html):
+            profile['tier'] = 'http'
+            return html
+        if render is None:
+            return html
+        logger.info(f"    HTTP simple insuficiente para {url}, usando navegador")
+    
+    html = None
+    async with host_slot(scheduler, url):
+        started = time.perf_counter()
+        try:
+            html = await render()
+        finally:
+            record_fetch(domain, 'browser', started, html)
+    if html:
+        profile['tier'] = 'browser'
+    return html
+
+def record_fetch(domain, tier, started, html):
+    """Registrar en las métricas una descarga de `tier` ('http' o 'browser') que empezó en `started`"""
+    seconds = time.perf_counter() - started
+    metrics.observe('fetch_seconds', seconds, tier=tier)
+    metrics.inc('fetch_total', tier=tier, outcome='ok' if html else 'error')
+    metrics.domain_time(domain, seconds, tier)
+
+SITEMAP_LOC = re.compile(r'<loc>\s*(.*?)\s*</loc>', re.IGNORECASE | re.DOTALL)
+
+async def fetch_sitemap_urls(session, base_url, scheduler=None, max_urls=SITEMAP_MAX_URLS):
+    """URLs de /sitemap.xml; si es un índice se leen unos pocos sub-sitemaps (primero los de páginas)"""
+    parsed = urlparse(base_url)
+    pending, visited, urls = [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"], set(), []
+    while pending and len(visited) < 4 and len(urls) < max_urls:
+        sitemap_url = pending.pop(0)
+        visited.add(sitemap_url)
+        try:
+            async with host_slot(scheduler, sitemap_url), session.get(sitemap_url) as response:
+                if response.status >= 400:
+                    continue
+                body = (await response.content.read(2 * 1024 * 1024)).decode('utf-8', errors='replace')
+        except Exception as e:
+            logger.debug(f"    No se pudo leer {sitemap_url}: {e}")
+            continue
         
-        # Navegar y esperar contenido
-        await page.goto(link, timeout=timeout, wait_until='networkidle')
-        await page.wait_for_timeout(3000)
+        locs = [unescape(loc) for loc in SITEMAP_LOC.findall(body)]
+        if '<sitemapindex' in body:
+            children = [loc for loc in locs if loc not in visited and not loc.endswith('.gz')]
+            pending.extend(sorted(children, key=lambda loc: 'page' not in loc.lower()))
+        else:
+            urls.extend(locs)
+    return urls[:max_urls]
+
+async def page_unchanged(session, entry, scheduler=None):
+    """GET condicional con los validadores guardados: True solo si el servidor responde 304"""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    if not headers:
+        return False
+    try:
+        async with host_slot(scheduler, entry['url']), session.get(entry['url'], headers=headers) as response:
+            return response.status == 304
+    except Exception as e:
+        logger.debug(f"    GET condicional falló para {entry['url']}: {e}")
+        return False
+
+# ========== ÍNDICE DE HTMLS DESCARGADOS ==========
+
+class SnapshotStore:
+    """Almacén de HTML comprimido y deduplicado por hash de contenido.
+
+    Cada página distinta se comprime (zstd si está instalado, si no gzip) y se
+    agrega al segmento actual `segment-NNNNN.pack`. Cuando el segmento supera
+    SNAPSHOT_SEGMENT_MB se abre uno nuevo. `index.jsonl` guarda
+    sha256 -> (segmento, offset, longitud, codec), con el nombre del segmento
+    relativo a la carpeta para que esta se pueda mover. Una página idéntica ya
+    guardada no ocupa espacio otra vez, y leer una página solo descomprime
+    su propio bloque. `put` se puede llamar desde varios hilos a la vez.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, segment_bytes=SNAPSHOT_SEGMENT_MB * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.index = {}
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        location = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Línea a medio escribir por una caída
+                    self.index[location['sha256']] = location
+        segments = sorted(name for name in os.listdir(directory) if name.endswith('.pack'))
+        self.segment = segments[-1] if segments else self._segment_name(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _segment_name(number):
+        return f"segment-{number:05d}.pack"
+
+    def put(self, html):
+        """Guardar una página y devolver su hash; si ya existe no se vuelve a escribir"""
+        data = html.encode('utf-8')
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 in self.index:
+            return sha256
         
-        # Scroll rápido para activar lazy loading
-        try:
-            await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            await page.wait_for_timeout(1000)
-            await page.evaluate("window.scrollTo(0, 0)")
-            await page.wait_for_timeout(500)
-        except:
-            pass
+        if zstandard is not None:
+            codec, blob = 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+        else:
+            codec, blob = 'gzip', gzip.compress(data, compresslevel=6)
+        
+        # Se comprime fuera del lock; la escritura y el índice, de uno en uno
+        with self._lock:
+            if sha256 in self.index:
+                return sha256
+            path = os.path.join(self.directory, self.segment)
+            if os.path.exists(path) and os.path.getsize(path) + len(blob) > self.segment_bytes:
+                self.segment = self._segment_name(int(self.segment[8:13]) + 1)
+                path = os.path.join(self.directory, self.segment)
+            
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+            metrics.inc('bytes_written_total', len(blob), target='snapshots')
+            
+            location = {
+                'sha256': sha256, 'segment': self.segment,
+                'offset': offset, 'length': len(blob), 'codec': codec, 'size': len(data),
+            }
+            # El índice se escribe después del bloque: una caída deja como mucho bytes huérfanos
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(location) + "\n")
+            self.index[sha256] = location
+        return sha256
+
+    def locate(self, sha256):
+        """Ubicación de un bloque, con la ruta completa del segmento para `read_blob`"""
+        location = self.index.get(sha256)
+        if location is None:
+            return None
+        # Los índices antiguos guardaban rutas absolutas: solo cuenta el nombre del segmento
+        return dict(location, segment=os.path.join(self.directory, os.path.basename(location['segment'])))
+
+    @staticmethod
+    def read_blob(location):
+        """Leer y descomprimir un único bloque (sirve en procesos del pool sin cargar el índice)"""
+        with open(location['segment'], "rb") as f:
+            f.seek(location['offset'])
+            blob = f.read(location['length'])
+        if location['codec'] == 'zstd':
+            data = zstandard.ZstdDecompressor().decompress(blob)
+        else:
+            data = gzip.decompress(blob)
+        return data.decode('utf-8')
+
+    def get(self, sha256):
+        return self.read_blob(self.locate(sha256))
+
+class HtmlManifest:
+    """Índice empresa -> URL -> página HTML, guardado como JSON-lines.
+
+    Cada descarga agrega una línea con fecha, tamaño y hash del contenido, y
+    el archivo suelto o el snapshot donde quedó guardada. Al cargar, la última
+    línea de cada (empresa, URL) es la que vale. Las consultas son O(1) y
+    exactas por nombre de empresa, sin recorrer el directorio ni comparar
+    prefijos.
+
+    Las páginas nuevas van a `store` (o a archivos sueltos si es None); las
+    ya guardadas como snapshots se leen de `store` o de cualquiera de
+    `readers`, así cambiar HTML_STORE no deja sin texto a lo ya descargado.
+    """
+
+    def __init__(self, path=MANIFEST_FILE, html_dir=HTML_DIR, store=None, readers=()):
+        self.path = path
+        self.html_dir = html_dir
+        self.store = store
+        self.readers = ([store] if store is not None else []) + list(readers)
+        self.entries = {}
+        self.text_hashes = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Línea a medio escribir por una caída
+                    if 'url' in entry:
+                        self.entries.setdefault(entry['company'], {})[entry['url']] = entry
+                    else:
+                        self.text_hashes[entry['company']] = entry['text_sha256']
+
+    def save(self, company, url, html, filename, page_info=None):
+        """Guardar una página (en el almacén de snapshots o como archivo) e indexarla"""
+        filename = self._write(company, url, html, filename)
+        self._index(company, url, filename, html, page_info)
+
+    async def save_async(self, company, url, html, filename, page_info=None):
+        """Como `save`, pero comprimiendo y escribiendo en un hilo para no bloquear el event loop"""
+        filename = await asyncio.get_running_loop().run_in_executor(None, self._write, company, url, html, filename)
+        self._index(company, url, filename, html, page_info)
+
+    def _write(self, company, url, html, filename):
+        if self.store is not None:
+            self.store.put(html)
+            return None
+        # Una página guardada antes como snapshot no tiene archivo: se le asigna uno
+        filename = filename or page_filename(company, url)
+        with open(os.path.join(self.html_dir, filename), "w", encoding="utf-8") as f:
+            f.write(html)
+        return filename
+
+    def _index(self, company, url, filename, html, page_info):
+        # Las métricas y el manifiesto se tocan solo desde el hilo del event loop
+        if filename is not None:
+            metrics.inc('bytes_written_total', len(html.encode('utf-8')), target='html')
+        self.record(company, url, filename, html, page_info)
+
+    def record(self, company, url, filename, html, page_info=None):
+        data = html.encode('utf-8')
+        entry = {
+            'company': company,
+            'url': url,
+            'fetched_at': datetime.now().isoformat(timespec='seconds'),
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+        if filename:
+            entry['file'] = filename
+        entry.update(page_info or {})
+        self.entries.setdefault(company, {})[url] = entry
+        self._append(entry)
+
+    def _append(self, entry):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def text_hash(self, company):
+        return self.text_hashes.get(company)
+
+    def record_text_hash(self, company, text_hash):
+        """Guardar el hash del texto extraído para detectar cambios en un re-crawl"""
+        if self.text_hashes.get(company) != text_hash:
+            self.text_hashes[company] = text_hash
+            self._append({'company': company, 'text_sha256': text_hash})
+
+    def has(self, company):
+        return bool(self.entries.get(company))
+
+    def refs(self, company):
+        """Referencias de lectura para `iter_company_html`: archivo suelto o bloque de snapshot"""
+        refs = []
+        for entry in self.entries.get(company, {}).values():
+            if 'file' in entry:
+                refs.append({'file': entry['file'], 'url': entry['url']})
+            else:
+                location = next(filter(None, (reader.locate(entry['sha256']) for reader in self.readers)), None)
+                if location is not None:
+                    refs.append(dict(location, url=entry['url']))
+        return refs
+
+    def bootstrap(self, companies, html_dir):
+        """Indexar una sola vez los HTML descargados antes de existir el manifiesto.
+
+        Cada archivo se asigna a la empresa con el prefijo más largo que
+        coincida, así `2048_Ventures_*.html` no se atribuye a la empresa `2048`
+        si `2048 Ventures` también está en la lista.
+        """
+        if os.path.exists(self.path):
+            return
+        prefixes = sorted({safe_filename(company): company for company in companies}.items(), key=lambda item: -len(item[0]))
+        indexed = 0
+        for fname in sorted(os.listdir(html_dir)):
+            if not fname.endswith('.html'):
+                continue
+            for prefix, company in prefixes:
+                if fname == prefix + '.html' or fname.startswith(prefix + '_'):
+                    with open(os.path.join(html_dir, fname), encoding="utf-8", errors="replace") as f:
+                        self.record(company, fname, fname, f.read())
+                    indexed += 1
+                    break
+        # Crear el archivo aunque no haya nada que indexar para no repetir el escaneo
+        open(self.path, "a", encoding="utf-8").close()
+        logger.info(f"Manifiesto de HTMLs creado con {indexed} archivos existentes")
+
+# Etapas por las que pasa cada empresa, en orden
+STAGES = ('validated', 'fetched', 'extracted', 'llm_done', 'written')
+
+def resume_stage(stage, has_html):
+    """Etapa del journal desde la que retomar una empresa, o None para procesarla desde cero.
+
+    Solo se retoman las etapas previas al LLM (`llm_done` se escribe
+    directamente). Una empresa `written` que llega aquí no tiene HTMLs (p. ej.
+    migrada de checkpoint.json) y se procesa entera, y la descarga solo se
+    salta si el manifiesto tiene sus HTMLs.
+    """
+    if stage not in STAGES[:STAGES.index('llm_done')]:
+        return None
+    if stage != 'validated' and not has_html:
+        return 'validated'
+    return stage
+
+class CheckpointJournal:
+    """Registro append-only (JSONL) del estado de cada empresa, indexado por URL.
+
+    Cada transición (`validated`, `fetched`, `extracted`, `llm_done` o
+    `written`) es una línea nueva, así que guardar progreso cuesta
+    lo mismo con diez empresas que con cien mil y una caída a mitad de
+    escritura solo puede perder la última línea. `llm_done` guarda además el
+    resultado para no repetir la llamada al LLM si la ejecución se corta antes
+    de escribirlo. El log se compacta a una línea por URL cuando crece.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.states = {}
+        self.results = {}
+        # URLs con la antigua etapa `blocked`, para que FailureStore las importe
+        self.legacy_blocked = set()
+        self.lines = 0
+        if not os.path.exists(path):
+            self._migrate()
+            return
+        torn = False
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                torn = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Línea a medio escribir por una caída
+                self._apply(record)
+                self.lines += 1
+        if torn:
+            # Reescribir sin la línea cortada para no pegarle la siguiente
+            self.compact()
+        else:
+            self.file = open(path, "a", encoding="utf-8")
+
+    def _apply(self, record):
+        url, stage = record['url'], record['stage']
+        if stage == 'blocked':
+            self.legacy_blocked.add(url)
+            stage = None
+        if stage is None:
+            self.states.pop(url, None)
+        else:
+            self.states[url] = stage
+        if stage == 'llm_done':
+            self.results[url] = record['result']
+        else:
+            self.results.pop(url, None)
+
+    def _migrate(self):
+        """Importar una sola vez checkpoint.json"""
+        for url in load_checkpoint():
+            self.states[url] = 'written'
+        if self.states:
+            logger.info(f"Journal de checkpoint creado a partir de {len(self.states)} URLs del checkpoint anterior")
+        self.compact()
+
+    def stage(self, url):
+        return self.states.get(url)
+
+    def result(self, url):
+        return self.results.get(url)
+
+    def mark(self, url, stage, result=None):
+        """Registrar que `url` llegó a `stage` (None la olvida por completo)"""
+        record = {'url': url, 'stage': stage}
+        if stage == 'llm_done':
+            record['result'] = result
+        self._apply(record)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.lines += 1
+
+    def sync(self):
+        """Forzar a disco lo escrito y compactar si el log ya duplica a las URLs vivas"""
+        os.fsync(self.file.fileno())
+        if self.lines > 2 * len(self.states) + 1000:
+            self.compact()
+
+    def compact(self):
+        lines = []
+        for url, stage in self.states.items():
+            record = {'url': url, 'stage': stage}
+            if stage == 'llm_done':
+                record['result'] = self.results[url]
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        if getattr(self, 'file', None):
+            self.file.close()
+        _atomic_write(self.path, "".join(lines).encode('utf-8'))
+        self.lines = len(lines)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self.file.close()
+
+def load_checkpoint():
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE, encoding="utf-8") as f:
+            return set(json.load(f))
+    return set()
+
+async def download_sections(sections, company, browser_pool, session, manifest, domain_profiles=None, timeout=20000, scheduler=None):
+    results = {}
+    tasks = [_fetch_and_save_section(browser_pool, session, link, company, manifest, domain_profiles, timeout, scheduler) for link in sections]
+    results_list = await asyncio.gather(*tasks)
+    for url, html, fname in results_list:
+        if html:
+            results[url] = fname
+    return results
+
+async def _render_section(browser_pool, link, domain_profiles, timeout, page_info=None):
+    """Renderizar una sección con el navegador compartido"""
+    async with browser_pool.page() as page:
+        # Configurar timeouts
+        page.set_default_timeout(25000)
+        page.set_default_navigation_timeout(25000)
         
-        html_section = await page.content()
+        # Navegar y esperar contenido
+        response = await page.goto(link, timeout=timeout, wait_until='load')
+        store_validators(page_info, response.headers if response else {})
+        await wait_for_render_ready(page, link, domain_profiles)
         
-        # Guardar archivo
-        with open(os.path.join(base_output_dir, extra_filename), "w", encoding="utf-8") as f:
-            f.write(html_section)
+        return await page.content()
+
+async def _fetch_and_save_section(browser_pool, session, link, company, manifest, domain_profiles, timeout, scheduler=None):
+    """Descargar sección con mejor renderizado"""
+    extra = urlparse(link).path.strip("/").replace("/", "_") or "extra"
+    extra_filename = safe_filename(company + "_" + extra) + ".html"
+    
+    try:
+        page_info = {}
+        html_section = await fetch_html_tiered(
+            link, session,
+            (lambda: _render_section(browser_pool, link, domain_profiles, timeout, page_info)) if browser_pool is not None else None,
+            domain_profiles, page_info, scheduler
+        )
+        if not html_section:
+            return (link, None, extra_filename)
         
-        await page.close()
-        await context.close()
+        # Guardar página
+        await manifest.save_async(company, link, html_section, extra_filename, page_info)
         
         logger.info(f"    Descargado: {link} -> {extra_filename}")
         return (link, html_section, extra_filename)
@@ -480,32 +2220,406 @@ async def _fetch_and_save_section(browser, link, company, base_output_dir, timeo
         logger.error(f"    Error descargando {link}: {e}")
         return (link, None, extra_filename)
 
+# ========== LECTURA DE LA LISTA DE EMPRESAS ==========
+
+def iter_companies(path=INPUT_CSV, chunk_rows=INPUT_CHUNK_ROWS):
+    """Recorrer la lista de empresas en streaming.
+
+    Produce `(idx, empresa, url_normalizada)` por cada fila con web, leyendo el
+    archivo por bloques de `chunk_rows` filas para que la memoria no crezca con
+    el tamaño de la entrada. `idx` es el número de fila de datos (desde 0).
+    """
+    for chunk in _iter_input_chunks(path, chunk_rows):
+        yield from _company_records(chunk)
+
+def _iter_input_chunks(path, chunk_rows):
+    """Bloques de filas como DataFrames con las columnas de empresa y web"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        reader = pd.read_csv(path, dtype=str, chunksize=chunk_rows,
+                             usecols=lambda column: column in (COMPANY_COLUMN, WEBSITE_COLUMN))
+        yield from reader
+    elif ext == '.parquet':
+        if pq is None:
+            raise ImportError("Leer entradas .parquet requiere pyarrow (pip install pyarrow)")
+        parquet = pq.ParquetFile(path)
+        columns = [c for c in (COMPANY_COLUMN, WEBSITE_COLUMN) if c in parquet.schema_arrow.names]
+        start = 0
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    else:
+        yield from _iter_excel_chunks(path, chunk_rows)
+
+def _iter_excel_chunks(path, chunk_rows):
+    """Leer la primera hoja con openpyxl en modo solo lectura, sin cargar el libro entero"""
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(value).strip() if value is not None else "" for value in next(rows, ())]
+        wanted = {column: header.index(column) for column in (COMPANY_COLUMN, WEBSITE_COLUMN) if column in header}
+        start, buffer = 0, []
+        for row in rows:
+            buffer.append([row[i] if i < len(row) else None for i in wanted.values()])
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=list(wanted), index=pd.RangeIndex(start, start + len(buffer)))
+                start, buffer = start + len(buffer), []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=list(wanted), index=pd.RangeIndex(start, start + len(buffer)))
+    finally:
+        workbook.close()
+
+def _company_records(chunk):
+    """Convertir un bloque en registros ligeros, normalizando cada URL distinta una sola vez"""
+    if WEBSITE_COLUMN not in chunk:
+        return
+    websites = chunk[WEBSITE_COLUMN].fillna("").astype(str).str.strip()
+    websites = websites[(websites != "") & (websites.str.lower() != "nan")]
+    normalized = {url: normalize_url(url) for url in websites.unique()}
+    if COMPANY_COLUMN in chunk:
+        names = chunk[COMPANY_COLUMN].loc[websites.index]
+    else:
+        names = pd.Series(index=websites.index, dtype=object)
+    for idx, name, url in zip(websites.index, names, websites):
+        if pd.isna(name):
+            name = f"empresa_{idx}"
+        yield idx, str(name), normalized[url]
+
 # ========== FUNCIONES DE VALIDACIÓN Y CACHÉ ==========
 
 def create_cache_key(text):
     """Crear clave única para caché basada en el contenido"""
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
-def load_gpt_cache():
-    """Cargar caché de respuestas GPT"""
-    if os.path.exists(CACHE_FILE):
+class LLMCache:
+    """Caché persistente de respuestas del LLM en SQLite.
+
+    Se usa como un dict indexado por `create_cache_key(prompt)`, pero cada
+    entrada queda ligada al modelo y a PROMPT_VERSION, de modo que cambiar
+    cualquiera de los dos no devuelve respuestas obsoletas. Cada inserción
+    se confirma por separado (O(1), atómica); la expulsión por antigüedad y
+    por número de entradas se hace al abrir y al cerrar.
+    """
+
+    def __init__(self, path=LLM_CACHE_FILE, model_name=GEMINI_MODEL, prompt_version=PROMPT_VERSION,
+                 max_entries=LLM_CACHE_MAX_ENTRIES, max_age_days=LLM_CACHE_MAX_AGE_DAYS):
+        self.scope = (model_name, prompt_version)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, prompt_version, prompt_hash)
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._import_legacy_json()
+        self.evict()
+
+    def _import_legacy_json(self):
+        """Importar una sola vez gpt_cache.json en el ámbito actual (modelo configurado y PROMPT_VERSION)"""
+        if not os.path.exists(CACHE_FILE) or self.conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return
         try:
             with open(CACHE_FILE, encoding="utf-8") as f:
-                return json.load(f)
+                legacy = json.load(f)
+            now = time.time()
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    [(*self.scope, key, value, now, now) for key, value in legacy.items()]
+                )
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_imported', ?)", (str(now),))
+            logger.info(f"Importadas {len(legacy)} respuestas de {CACHE_FILE} a la caché SQLite")
         except Exception as e:
-            logger.warning(f"Error cargando caché GPT: {e}")
-    return {}
+            logger.warning(f"Error importando caché GPT antigua: {e}")
 
-def save_gpt_cache(cache):
-    """Guardar caché de respuestas GPT"""
-    try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Error guardando caché GPT: {e}")
+    def get(self, key, default=None):
+        row = self.conn.execute(
+            "SELECT response FROM responses WHERE model = ? AND prompt_version = ? AND prompt_hash = ?",
+            (*self.scope, key)
+        ).fetchone()
+        if row is None:
+            return default
+        self.conn.execute(
+            "UPDATE responses SET last_used = ? WHERE model = ? AND prompt_version = ? AND prompt_hash = ?",
+            (time.time(), *self.scope, key)
+        )
+        return row[0]
+
+    def __contains__(self, key):
+        return self.conn.execute(
+            "SELECT 1 FROM responses WHERE model = ? AND prompt_version = ? AND prompt_hash = ?",
+            (*self.scope, key)
+        ).fetchone() is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (*self.scope, key, value, now, now)
+        )
+
+    def __len__(self):
+        """Entradas del modelo y versión de prompt actuales (la expulsión cuenta todas)"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM responses WHERE model = ? AND prompt_version = ?", self.scope
+        ).fetchone()[0]
+
+    def evict(self):
+        """Eliminar entradas más viejas que max_age_days y las menos usadas por encima de max_entries"""
+        cutoff = time.time() - self.max_age_days * 86400
+        with self.conn:
+            self.conn.execute("BEGIN")
+            expired = self.conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+            overflow = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+        if expired > 0 or overflow > 0:
+            logger.info(f"Caché LLM: {expired} entradas caducadas y {max(overflow, 0)} expulsadas por tamaño")
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+def text_fingerprint(text, shingle_size=4):
+    """SimHash de 64 bits sobre shingles de palabras del texto normalizado.
+
+    Se ignoran mayúsculas y puntuación. Los números se conservan: un teléfono
+    o una dirección que cambia tiene que cambiar la huella.
+    """
+    words = re.findall(r'\w+', text.lower())
+    shingles = [' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def fingerprint_similarity(a, b):
+    return 1 - bin(a ^ b).count('1') / 64
+
+def _phones_in_text(value, text):
+    """Si todos los teléfonos de `value` siguen en `text` (se comparan los últimos dígitos)"""
+    value = ' '.join(value) if isinstance(value, list) else str(value)
+    present = {re.sub(r'\D', '', match.group())[-PHONE_MIN_DIGITS:] for match in PHONE_PATTERN.finditer(text)}
+    return all(re.sub(r'\D', '', match.group())[-PHONE_MIN_DIGITS:] in present for match in PHONE_PATTERN.finditer(value))
+
+class SemanticCache:
+    """Caché de resultados estructurados indexada por la huella SimHash del texto extraído.
+
+    Un re-crawl casi idéntico de la misma web (similitud >=
+    SEMANTIC_CACHE_THRESHOLD) reutiliza el resultado anterior aunque el
+    prompt exacto haya cambiado. Nunca se reutiliza entre webs distintas:
+    plantillas compartidas o páginas de desafío anti-bot copiarían la
+    descripción y los teléfonos de una empresa en otra. El teléfono guardado
+    solo se reutiliza si sigue apareciendo en el texto actual.
+    """
+
+    def __init__(self, path=LLM_CACHE_FILE, model_name=GEMINI_MODEL, threshold=SEMANTIC_CACHE_THRESHOLD):
+        # Los resultados dependen del modelo y del conjunto de campos, no de la redacción del prompt
+        self.scope = f"{model_name}:{create_cache_key(','.join(PROMPT_FIELDS))[:8]}"
+        self.threshold = threshold
+        self.hits = self.misses = 0
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                scope TEXT NOT NULL,
+                website TEXT NOT NULL,
+                simhash INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (scope, website, simhash)
+            )
+        """)
+
+    @staticmethod
+    def _to_sql(fingerprint):
+        # SQLite guarda enteros con signo de 64 bits
+        return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+    def lookup(self, fingerprint, website, text):
+        """Devolver el resultado de un texto casi idéntico de la misma web ya analizado, o None"""
+        if self.threshold > 1:
+            return None
+        rows = self.conn.execute(
+            "SELECT simhash, result FROM fingerprints WHERE scope = ? AND website = ?",
+            (self.scope, website)
+        ).fetchall()
+        
+        best_similarity, best_result = 0.0, None
+        for simhash, result in rows:
+            similarity = fingerprint_similarity(fingerprint, simhash % (1 << 64))
+            if similarity > best_similarity:
+                best_similarity, best_result = similarity, result
+        
+        if best_result is not None and best_similarity >= self.threshold:
+            self.hits += 1
+            logger.info(f"Caché semántica: acierto para {website} (similitud {best_similarity:.3f})")
+            data = json.loads(best_result)
+            if not _phones_in_text(data.get('contact_phone', 'No Information'), text):
+                # El teléfono cambió: se vuelve a pedir solo ese campo
+                del data['contact_phone']
+            return data
+        self.misses += 1
+        logger.info(f"Caché semántica: fallo para {website} (mejor similitud {best_similarity:.3f})")
+        return None
+
+    def store(self, fingerprint, website, data):
+        # No guardar respuestas vacías (errores del LLM) para no reutilizarlas
+        if all(value == 'No Information' for value in data.values()):
+            return
+        self.conn.execute(
+            # Columnas explícitas: las tablas creadas antes aún tienen las columnas band0..band3
+            "INSERT OR REPLACE INTO fingerprints (scope, website, simhash, result, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self.scope, website, self._to_sql(fingerprint), json.dumps(data, ensure_ascii=False), time.time())
+        )
+
+    def close(self):
+        self.conn.close()
+
+def classify_failure(error=None, status=None):
+    """Clase de fallo para el calendario de reintentos, a partir de la excepción o del código HTTP"""
+    if status is not None:
+        if status in (401, 403):
+            return 'forbidden'
+        if status in (404, 410):
+            return 'not_found'
+        if status == 429:
+            return 'rate_limited'
+        return 'server_error' if status >= 500 else 'http_error'
+    
+    # Playwright solo da el código de Chromium en el mensaje (net::ERR_...)
+    message = str(error).lower()
+    os_error = getattr(error, 'os_error', None)
+    if isinstance(os_error, socket.gaierror) or 'err_name_not_resolved' in message or 'name or service not known' in message:
+        return 'dns'
+    if isinstance(error, (ssl.SSLError, aiohttp.ClientSSLError)) or 'err_cert' in message or 'err_ssl' in message:
+        return 'tls'
+    if isinstance(error, asyncio.TimeoutError) or 'timeout' in message or 'timed out' in message:
+        return 'timeout'
+    if isinstance(error, aiohttp.ClientConnectionError) or 'err_connection' in message:
+        return 'connection'
+    return 'unknown'
+
+class FailureStore:
+    """Sitios que fallaron, con la clase de fallo, intentos y último intento.
+
+    Sustituye a la lista permanente de sitios bloqueados: cada clase de fallo
+    tiene su propia espera base (RETRY_BASE_HOURS) que se duplica con cada
+    fallo seguido, así un timeout se reintenta en la siguiente ejecución
+    y un DNS inexistente no se vuelve a sondear durante días. Un éxito borra
+    la entrada. Se guarda como JSONL append-only (gana la última línea por URL).
+    """
+
+    def __init__(self, path=FAILURES_FILE, legacy=()):
+        self.path = path
+        self.entries = {}
+        self.lines = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # Línea a medio escribir por una caída
+                    self.lines += 1
+            self.compact()
+        else:
+            # Importar blocked_sites.json y los bloqueos del journal como fallos de clase desconocida
+            now = time.time()
+            for url in load_blocked_sites() | set(legacy):
+                self.entries[url] = {'url': url, 'reason': 'unknown', 'attempts': 1, 'last_attempt': now}
+            self.compact()
+
+    def _apply(self, entry):
+        if entry.get('reason') is None:
+            self.entries.pop(entry['url'], None)
+        else:
+            self.entries[entry['url']] = entry
+
+    def _append(self, entry):
+        self._apply(entry)
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.lines += 1
+
+    def record(self, url, reason):
+        """Anotar un fallo más de `url`"""
+        previous = self.entries.get(url, {})
+        self._append({'url': url, 'reason': reason, 'attempts': previous.get('attempts', 0) + 1, 'last_attempt': time.time()})
+        metrics.inc('failures_total', reason=reason)
+
+    def resolve(self, url):
+        """El sitio respondió: olvidar sus fallos"""
+        if url in self.entries:
+            self._append({'url': url, 'reason': None})
+
+    def retry_at(self, url):
+        """Momento (epoch) a partir del cual toca reintentar `url`, o None si no falló"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        hours = RETRY_BASE_HOURS.get(entry['reason'], RETRY_BASE_HOURS['unknown']) * 2 ** (entry['attempts'] - 1)
+        return entry['last_attempt'] + min(hours * 3600, RETRY_MAX_DAYS * 86400)
+
+    def should_skip(self, url, now=None):
+        retry_at = self.retry_at(url)
+        return retry_at is not None and (now or time.time()) < retry_at
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, url):
+        return url in self.entries
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        if self.lines > 2 * len(self.entries) + 1000:
+            self.compact()
+
+    def compact(self):
+        if getattr(self, 'file', None):
+            self.file.close()
+        _atomic_write(self.path, "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self.entries.values()).encode('utf-8'))
+        self.lines = len(self.entries)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def clear(self):
+        self.entries.clear()
+        self.compact()
+
+    def close(self):
+        self.file.close()
 
 def load_blocked_sites():
-    """Cargar lista de sitios bloqueados/inaccesibles"""
+    """Cargar lista de sitios bloqueados/inaccesibles (formato anterior a FailureStore)"""
     if os.path.exists(BLOCKED_SITES_FILE):
         try:
             with open(BLOCKED_SITES_FILE, encoding="utf-8") as f:
@@ -514,62 +2628,87 @@ def load_blocked_sites():
             logger.warning(f"Error cargando sitios bloqueados: {e}")
     return set()
 
-def save_blocked_sites(blocked_sites):
-    """Guardar lista de sitios bloqueados"""
-    try:
-        with open(BLOCKED_SITES_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(blocked_sites), f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Error guardando sitios bloqueados: {e}")
+def create_http_session():
+    """Sesión HTTP para toda la ejecución: pool de conexiones con keep-alive y caché de DNS"""
+    connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+    timeout = aiohttp.ClientTimeout(total=URL_VALIDATION_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'User-Agent': USER_AGENT})
+
+async def validate_url(url, use_fallback=True, session=None, prefetch=None, failure=None):
+    """Validar si una URL es accesible antes del procesamiento con múltiples métodos.
 
-async def validate_url(url, use_fallback=True):
-    """Validar si una URL es accesible antes del procesamiento con múltiples métodos"""
+    Con `prefetch` (un dict) se va directo al GET y, si la respuesta es HTML,
+    se guarda el cuerpo en `prefetch['html']` (y sus validadores) para usarlo
+    como descarga HTTP simple de la home sin pedirla otra vez. Si se pasa
+    `failure` (un dict), al fallar se deja en `failure['reason']` la clase
+    de fallo del último intento.
+    """
+    failure = failure if failure is not None else {}
     try:
+        if session is None:
+            async with create_http_session() as own_session:
+                return await validate_url(url, use_fallback, own_session, prefetch, failure)
+        
         # Primer intento: HEAD request
-        timeout = aiohttp.ClientTimeout(total=URL_VALIDATION_TIMEOUT)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        if prefetch is None:
             try:
                 async with session.head(url) as response:
                     if response.status < 400:
                         return True
-            except:
-                pass  # Si HEAD falla, intentar GET
-            
-            # Segundo intento: GET request (algunos sitios bloquean HEAD)
-            if use_fallback:
-                try:
-                    async with session.get(url) as response:
-                        return response.status < 400
-                except:
-                    pass
+                    failure['reason'] = classify_failure(status=response.status)
+            except Exception as e:
+                failure['reason'] = classify_failure(e)  # Si HEAD falla, intentar GET
+        
+        # Segundo intento: GET request (algunos sitios bloquean HEAD), leyendo solo el principio
+        if use_fallback or prefetch is not None:
+            try:
+                async with session.get(url) as response:
+                    if response.status >= 400:
+                        failure['reason'] = classify_failure(status=response.status)
+                        return False
+                    if prefetch is not None and 'html' in response.headers.get('Content-Type', 'text/html').lower():
+                        store_validators(prefetch, response.headers)
+                        prefetch['html'] = await response.text(errors='replace')
+                    else:
+                        await response.content.read(VALIDATE_PEEK_BYTES)
+                    return True
+            except Exception as e:
+                failure['reason'] = classify_failure(e)
         
         return False
         
     except Exception as e:
         logger.warning(f"URL no accesible {url}: {e}")
+        failure['reason'] = classify_failure(e)
         return False
 
-def review_blocked_sites(blocked_sites, df):
-    """Revisar y mostrar estadísticas de sitios bloqueados"""
-    if not blocked_sites:
+def review_blocked_sites(failures, companies):
+    """Revisar y mostrar estadísticas de sitios fallidos y cuándo se reintentan.
+
+    `companies` es un iterable de `(idx, empresa, url_normalizada)` como el de
+    `iter_companies`.
+    """
+    if not len(failures):
         logger.info("No hay sitios bloqueados")
         return
     
-    logger.info(f"=== SITIOS BLOQUEADOS: {len(blocked_sites)} ===")
+    logger.info(f"=== SITIOS BLOQUEADOS: {len(failures)} ===")
+    reasons = {}
+    for entry in failures.entries.values():
+        reasons[entry['reason']] = reasons.get(entry['reason'], 0) + 1
+    for reason, count in sorted(reasons.items(), key=lambda item: -item[1]):
+        logger.info(f"  {reason}: {count}")
     
     # Contar empresas afectadas
-    affected_companies = []
-    for idx, row in df.iterrows():
-        url = str(row.get("Website", "")).strip()
-        if url and normalize_url(url) in blocked_sites:
-            company_name = row.get('Company Name', f"empresa_{idx}")
-            affected_companies.append((company_name, normalize_url(url)))
+    affected_companies = [(company, url) for _, company, url in companies if url in failures]
     
     logger.info(f"Empresas afectadas: {len(affected_companies)}")
     
     # Mostrar algunos ejemplos
     for i, (company, url) in enumerate(affected_companies[:10]):
-        logger.info(f"  {i+1}. {company}: {url}")
+        entry = failures.get(url)
+        retry_at = datetime.fromtimestamp(failures.retry_at(url)).isoformat(sep=' ', timespec='minutes')
+        logger.info(f"  {i+1}. {company}: {url} ({entry['reason']}, {entry['attempts']} intentos, reintento desde {retry_at})")
     
     if len(affected_companies) > 10:
         logger.info(f"  ... y {len(affected_companies) - 10} más")
@@ -579,6 +2718,13 @@ def review_blocked_sites(blocked_sites, df):
 def clear_blocked_sites_file():
     """Limpiar archivo de sitios bloqueados"""
     try:
+        journal = CheckpointJournal()
+        failures = FailureStore(legacy=journal.legacy_blocked)
+        journal.close()
+        cleared = len(failures)
+        failures.clear()
+        failures.close()
+        logger.info(f"{cleared} sitios fallidos eliminados del registro de fallos")
         if os.path.exists(BLOCKED_SITES_FILE):
             os.remove(BLOCKED_SITES_FILE)
             logger.info("Archivo de sitios bloqueados eliminado")
@@ -593,233 +2739,936 @@ def normalize_gpt_response(data):
     # but it just calls the new function.
     return normalize_response(data)
 
-async def save_result_to_csv(result_data):
-    """Guardar resultado individual al CSV de forma thread-safe"""
-    try:
-        out_df = pd.DataFrame([result_data])
-        # Verificar si el archivo existe para determinar si escribir headers
-        header_needed = not os.path.exists(OUTPUT_FILE) or os.path.getsize(OUTPUT_FILE) == 0
-        out_df.to_csv(OUTPUT_FILE, mode='a', index=False, header=header_needed, encoding='utf-8')
-        logger.info(f"    ✓ Guardado al CSV: {result_data['company_name']}")
+class ResultWriter:
+    """Salida de resultados por lotes, sin duplicar webs.
+
+    Las filas se acumulan en memoria y se escriben cada `batch_size` filas (o al
+    llamar a `flush`) con una sola escritura en modo append seguida de fsync,
+    bajo un bloqueo de archivo para que dos procesos no intercalen filas. Si
+    una web ya está en la salida (p. ej. al refrescar), la fila nueva reemplaza
+    a la anterior reescribiendo el archivo de forma atómica.
+
+    Con `fmt='parquet'` cada lote se escribe como un archivo de partes dentro
+    de la carpeta `<OUTPUT_FILE sin extensión>.parquet`.
+    """
+
+    def __init__(self, path=OUTPUT_FILE, batch_size=RESULT_BATCH_SIZE, fmt=RESULT_FORMAT):
+        if fmt == 'parquet':
+            if pq is None:
+                raise ImportError("RESULT_FORMAT=parquet requiere pyarrow (pip install pyarrow)")
+            path = os.path.splitext(path)[0] + ".parquet"
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = max(1, batch_size)
+        self.buffer = {}
+        self.rows_written = 0
+        self.websites = self._load_websites()
+
+    def add(self, row):
+        """Encolar una fila; la última fila de cada web es la que se conserva"""
+        self.buffer[row['website']] = row
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Escribir las filas pendientes. Devuelve False si no se pudieron guardar"""
+        if not self.buffer:
+            return True
+        rows = list(self.buffer.values())
+        replaced = self.websites & self.buffer.keys()
+        try:
+            with self._locked():
+                if self.fmt == 'parquet':
+                    self._write_parquet(rows, replaced)
+                elif replaced:
+                    self._rewrite_csv(rows, replaced)
+                else:
+                    self._append_csv(rows)
+        except Exception as e:
+            logger.error(f"    ✗ Error guardando {len(rows)} resultados en {self.path}: {e}")
+            return False
+        self.websites.update(self.buffer)
+        self.buffer.clear()
+        self.rows_written += len(rows)
+        logger.info(f"    ✓ Guardados {len(rows)} resultados ({len(replaced)} reemplazados) en {self.path}")
         return True
-    except Exception as e:
-        logger.error(f"    ✗ Error guardando CSV para {result_data.get('company_name', 'desconocida')}: {e}")
-        return False
 
-async def process_single_company(idx, row, total, blocked_sites, gpt_cache):
-    """Procesar una sola empresa de manera asíncrona"""
-    company = row.get('Company Name', f"empresa_{idx}")
-    url = str(row.get("Website", "")).strip()
-    
-    if not url:
-        logger.warning(f"[{idx+1}/{total}] {company}: URL vacía, saltando")
-        return None
-    
-    # Normalizar URL
-    url = normalize_url(url)
-    
-    # Verificar si está en sitios bloqueados
-    if url in blocked_sites:
-        logger.warning(f"[{idx+1}/{total}] {company}: Sitio previamente bloqueado, saltando")
-        return None
-    
-    # Validar URL antes de procesar (validación menos estricta)
-    if not await validate_url(url, use_fallback=True):
-        logger.warning(f"[{idx+1}/{total}] {company}: URL no accesible después de validación completa, agregando a sitios bloqueados")
-        blocked_sites.add(url)
-        return None
+    def close(self):
+        return self.flush()
+
+    def _load_websites(self):
+        if self.fmt == 'parquet':
+            websites = set()
+            for part in self._parquet_parts():
+                websites.update(pq.read_table(part, columns=['website']).column('website').to_pylist())
+            return websites
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return set()
+        return set(pd.read_csv(self.path, usecols=['website'], dtype=str)['website'].dropna())
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path.rstrip(os.sep) + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append_csv(self, rows):
+        header_needed = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        data = pd.DataFrame(rows).to_csv(index=False, header=header_needed).encode('utf-8')
+        # Una sola escritura en O_APPEND: el lote entra entero o no entra
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        metrics.inc('bytes_written_total', len(data), target='results')
+
+    def _rewrite_csv(self, rows, replaced):
+        existing = pd.read_csv(self.path, dtype=str, keep_default_na=False)
+        merged = pd.concat([existing[~existing['website'].isin(replaced)], pd.DataFrame(rows)], ignore_index=True)
+        data = merged.to_csv(index=False).encode('utf-8')
+        _atomic_write(self.path, data)
+        metrics.inc('bytes_written_total', len(data), target='results')
+
+    def _parquet_parts(self):
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.parquet'))
+
+    def _write_parquet(self, rows, replaced):
+        if replaced:
+            # Quitar la versión anterior de las webs refrescadas de las partes ya escritas
+            for part in self._parquet_parts():
+                table = pq.read_table(part)
+                keep = [website not in replaced for website in table.column('website').to_pylist()]
+                if not all(keep):
+                    self._write_parquet_part(part, table.filter(pa.array(keep)))
+        name = f"part-{datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}.parquet"
+        self._write_parquet_part(os.path.join(self.path, name), pa.Table.from_pylist(rows))
+
+    @staticmethod
+    def _write_parquet_part(path, table):
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        metrics.inc('bytes_written_total', os.path.getsize(tmp_path), target='results')
+        os.replace(tmp_path, path)
+
+def _atomic_write(path, data):
+    """Escribir un archivo completo vía temporal + fsync + rename"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# ========== EJECUCIÓN REPARTIDA ==========
+
+class Shard:
+    """Parte de la lista de empresas que procesa este proceso.
+
+    Con `--shard i/N` el reparto es estático: cada web va al shard
+    `md5(web) % N`, así que siempre cae en el mismo sin coordinación, también
+    entre máquinas sin disco compartido. Con `--ledger` el reparto es
+    dinámico: cada worker reclama las empresas en un WorkLedger compartido
+    justo antes de procesarlas.
+
+    Cada shard tiene su propio journal, fallos, manifiesto, snapshots,
+    perfiles de dominio y salida (el mismo nombre con `.<shard>` antes de la
+    extensión). La primera vez se siembran con el estado global para no
+    repetir lo ya hecho. La caché del LLM (SQLite en modo WAL) es compartida.
+    Al terminar, `--merge` junta las salidas de todos los shards.
+    """
+
+    def __init__(self, name, index=None, count=None, ledger=None, lock=None):
+        self.name = name
+        self.index = index
+        self.count = count
+        self.ledger = ledger
+        # Archivo bloqueado mientras vive el proceso, para que dos workers no usen el mismo nombre
+        self.lock = lock
+
+    @classmethod
+    def parse(cls, spec):
+        """Shard estático a partir de 'i/N' (0 <= i < N)"""
+        index, _, count = spec.partition('/')
+        try:
+            index, count = int(index), int(count)
+        except ValueError:
+            raise ValueError(f"Shard no válido: {spec!r} (se espera i/N, p. ej. 0/4)")
+        if not 0 <= index < count:
+            raise ValueError(f"Shard fuera de rango: {spec!r} (se espera 0 <= i < N)")
+        return cls(f"shard-{index}of{count}", index, count)
+
+    @classmethod
+    def leased(cls, worker=None, path=WORK_LEDGER_FILE):
+        """Worker que reclama empresas en el ledger compartido.
+
+        Sin `worker` el nombre es `<host>-<n>` con el menor `n` libre en esta
+        máquina: un worker reiniciado recupera el nombre (y con él el journal y
+        los HTMLs) del que murió, en lugar de empezar con estado nuevo.
+        """
+        if worker:
+            lock = _lock_worker_name(path, worker)
+            if lock is None:
+                raise ValueError(f"El worker {worker!r} ya está en ejecución")
+        else:
+            slot = 0
+            while True:
+                worker = f"{socket.gethostname()}-{slot}"
+                lock = _lock_worker_name(path, worker)
+                if lock is not None:
+                    break
+                slot += 1
+        return cls(f"worker-{safe_filename(worker)}", ledger=WorkLedger(path, worker), lock=lock)
+
+    def owns(self, url):
+        """Si la web le toca a este shard (con ledger lo decide `claim`)"""
+        if self.count is None:
+            return True
+        return int(hashlib.md5(url.encode('utf-8')).hexdigest(), 16) % self.count == self.index
+
+    def path(self, path):
+        root, ext = os.path.splitext(path.rstrip(os.sep))
+        return f"{root}.{self.name}{ext}"
+
+    def seed(self, path, key=None):
+        """Ruta del shard para `path`, creada desde el archivo global si aún no existe.
+
+        Con `key`, solo se copian las líneas JSONL cuyo `key` es una web del shard.
+        """
+        shard_path = self.path(path)
+        if os.path.exists(shard_path) or not os.path.isfile(path):
+            return shard_path
+        with open(path, "rb") as f:
+            data = f.read()
+        if key is not None:
+            lines = []
+            for line in data.splitlines(keepends=True):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Línea a medio escribir por una caída
+                if not isinstance(record, dict) or self.owns(record.get(key, '')):
+                    lines.append(line)
+            data = b"".join(lines)
+        _atomic_write(shard_path, data)
+        logger.info(f"Estado del shard {self.name} sembrado desde {path}")
+        return shard_path
+
+def _lock_worker_name(ledger_path, worker):
+    """Reservar el nombre de worker con un flock que se suelta al morir el proceso; None si está ocupado"""
+    lock = open(f"{ledger_path}.{safe_filename(worker)}.lock", "w")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+    return lock
+
+class WorkLedger:
+    """Registro compartido (SQLite) de qué worker tiene cada empresa.
+
+    `claim` reserva una web durante `lease_seconds` si nadie la tiene, si el
+    arriendo anterior venció (su worker murió) o si ya era de este worker;
+    `renew` alarga los arriendos mientras se procesa y `finish` la da por
+    terminada cuando su resultado ya está en disco. Una empresa fallida
+    (`fail`) vuelve a la bolsa cuando le toca el reintento según el
+    FailureStore. Cada reclamo es una sola sentencia, así que dos workers
+    nunca tienen la misma empresa a la vez.
+
+    `done` vale 0 (en curso), 1 (terminada) o 2 (fallida; `expires` es el
+    momento del reintento).
+
+    SQLite necesita bloqueos de archivo fiables: sirve entre procesos de una
+    máquina, no sobre NFS. Entre máquinas sin disco compartido usar `--shard`.
+    Un ledger vale para una campaña; para volver a procesar todo, borrarlo.
+    """
+
+    def __init__(self, path, worker, lease_seconds=LEASE_SECONDS):
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "url TEXT PRIMARY KEY, worker TEXT NOT NULL, expires REAL NOT NULL, done INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def claim(self, url):
+        """Reservar `url` para este worker. Devuelve False si otro la tiene o ya está hecha"""
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO leases (url, worker, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET worker = excluded.worker, expires = excluded.expires, done = 0 "
+            "WHERE leases.done != 1 AND (leases.expires < ? OR (leases.done = 0 AND leases.worker = excluded.worker))",
+            (url, self.worker, now + self.lease_seconds, now),
+        )
+        return cursor.rowcount == 1
+
+    def renew(self, urls):
+        """Alargar los arriendos de las empresas que este worker sigue procesando"""
+        expires = time.time() + self.lease_seconds
+        self._update("UPDATE leases SET expires = ? WHERE url = ? AND worker = ? AND done = 0",
+                     [(expires, url, self.worker) for url in urls])
+
+    def finish(self, urls):
+        """Marcar empresas como terminadas (resultado en disco o sin cambios)"""
+        self._update("UPDATE leases SET done = 1 WHERE url = ?", [(url,) for url in urls])
+
+    def fail(self, url, retry_at):
+        """Devolver una empresa fallida a la bolsa a partir de `retry_at` (epoch)"""
+        self._update("UPDATE leases SET done = 2, expires = ? WHERE url = ? AND done = 0", [(retry_at, url)])
+
+    def release(self, urls):
+        """Soltar arriendos sin terminar para que otro worker los retome ya"""
+        self._update("UPDATE leases SET expires = 0 WHERE url = ? AND worker = ? AND done = 0",
+                     [(url, self.worker) for url in urls])
+
+    def settled(self, urls):
+        """Cuáles de `urls` ya no están en curso (terminadas o fallidas)"""
+        urls = list(urls)
+        finished = set()
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT url FROM leases WHERE done != 0 AND url IN ({placeholders})", chunk)
+            finished.update(url for url, in rows)
+        return finished
+
+    def _update(self, sql, params):
+        if not params:
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(sql, params)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def close(self):
+        self.conn.close()
+
+def merge_shard_outputs(path=OUTPUT_FILE, fmt=RESULT_FORMAT):
+    """Juntar en `path` las salidas de los shards (`--merge`) y borrarlas una vez guardadas.
+
+    Se recorren de la más antigua a la más reciente, así que si una web salió
+    en varios shards se conserva la última fila escrita.
+    """
+    root, ext = os.path.splitext(path)
+    if fmt == 'parquet':
+        ext = ".parquet"
+    pattern = glob.escape(root)
+    parts = glob.glob(f"{pattern}.shard-*{ext}") + glob.glob(f"{pattern}.worker-*{ext}")
+    parts.sort(key=os.path.getmtime)
+    if not parts:
+        logger.info("No hay salidas de shards para juntar")
+        return 0
     
-    prefix = safe_filename(company)
-    already_extracted = any(fname.startswith(prefix) and fname.endswith(".html") for fname in os.listdir(HTML_DIR))
+    writer = ResultWriter(path, fmt=fmt)
+    rows = 0
+    for part in parts:
+        if fmt == 'parquet':
+            part_rows = pq.read_table(part).to_pylist() if os.listdir(part) else []
+        elif os.path.getsize(part):
+            part_rows = pd.read_csv(part, dtype=str, keep_default_na=False).to_dict('records')
+        else:
+            part_rows = []
+        for row in part_rows:
+            writer.add(row)
+        rows += len(part_rows)
+        logger.info(f"  {part}: {len(part_rows)} filas")
+    if not writer.close():
+        logger.error("No se pudo escribir la salida combinada; las salidas de los shards se conservan")
+        return 0
     
-    # Descargar HTMLs solo si no existen
-    if not already_extracted:
-        logger.info(f"[{idx+1}/{total}] Descargando HTMLs de {company}: {url}")
+    for part in parts:
+        if os.path.isdir(part):
+            shutil.rmtree(part)
+        else:
+            os.remove(part)
+        lock_path = part.rstrip(os.sep) + ".lock"
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
+    logger.info(f"Juntadas {rows} filas de {len(parts)} shards en {writer.path}")
+    return rows
+
+# ========== PIPELINE POR ETAPAS ==========
+
+class CompanyPipeline:
+    """Pipeline continuo por etapas: validación -> descarga -> extracción -> LLM.
+
+    Cada etapa tiene su propia cola acotada y su propio número de workers, de
+    modo que una etapa lenta frena a las anteriores (backpressure) sin dejar
+    huecos ociosos en el resto. Cada empresa termina en `on_done(job, result)`,
+    con `result=None` si se descartó en alguna etapa.
+
+    Cada etapa superada queda en el journal; un trabajo con `job['stage']`
+    retoma desde ahí (las etapas ya hechas se saltan).
+    """
+
+    def __init__(self, journal, failures, manifest, gpt_cache, semantic_cache, llm_client, browser_pool, domain_profiles, session, scheduler, on_done):
+        self.journal = journal
+        self.failures = failures
+        self.manifest = manifest
+        self.gpt_cache = gpt_cache
+        self.semantic_cache = semantic_cache
+        self.llm_client = llm_client
+        self.browser_pool = browser_pool
+        self.domain_profiles = domain_profiles
+        self.session = session
+        self.scheduler = scheduler
+        self.on_done = on_done
+
+    async def run(self, jobs):
+        stages = [
+            ('validación', self.validate, VALIDATE_CONCURRENCY),
+            ('descarga', self.fetch, RENDER_CONCURRENCY),
+            ('extracción', self.extract, EXTRACT_CONCURRENCY),
+            ('LLM', self.analyze, LLM_CONCURRENCY),
+        ]
+        queues = [asyncio.Queue(maxsize=2 * max(1, count)) for _, _, count in stages]
+        workers = []
+        for i, (name, handler, count) in enumerate(stages):
+            metrics.gauge('queue_size', queues[i].qsize, stage=handler.__name__)
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            for _ in range(max(1, count)):
+                if outbox is None and GEMINI_BATCH_SIZE > 1:
+                    worker = self._batch_worker(name, self.analyze_batch, queues[i], GEMINI_BATCH_SIZE)
+                else:
+                    worker = self._worker(name, handler, queues[i], outbox)
+                workers.append(asyncio.create_task(worker))
         
         try:
-            html_home = await get_rendered_html_async(url)
-            if html_home:
-                home_filename = safe_filename(company, "home") + ".html"
-                with open(os.path.join(OUTPUT_DIR, home_filename), "w", encoding="utf-8") as f:
-                    f.write(html_home)
+            for job in jobs:
+                await queues[0].put(job)
+            # Cada trabajo se pasa a la siguiente cola antes de marcarse como hecho,
+            # así que esperar las colas en orden garantiza que todo terminó
+            for queue in queues:
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, name, handler, inbox, outbox):
+        stage = handler.__name__
+        while True:
+            job = await inbox.get()
+            metrics.observe('queue_depth', inbox.qsize(), buckets=DEPTH_BUCKETS, stage=stage)
+            started = time.perf_counter()
+            try:
+                try:
+                    next_job = await handler(job)
+                    outcome = 'ok' if next_job is not None else job.get('status', 'dropped')
+                except Exception as e:
+                    logger.error(f"Error en etapa de {name} para {job['company']}: {e}")
+                    next_job, outcome = None, 'error'
+                metrics.observe('stage_seconds', time.perf_counter() - started, stage=stage)
+                metrics.inc('stage_jobs_total', stage=stage, outcome=outcome)
                 
-                links = find_internal_links(html_home, url)
-                if links:
-                    logger.info(f"    Secciones relevantes encontradas: {len(links)}")
-                    await download_sections(links, company, OUTPUT_DIR, timeout=20000)
+                if next_job is None:
+                    await self.on_done(job, None)
+                elif outbox is None:
+                    await self.on_done(job, next_job['result'])
+                else:
+                    await outbox.put(next_job)
+            except Exception as e:
+                logger.error(f"Error finalizando {job['company']} en etapa de {name}: {e}")
+            finally:
+                inbox.task_done()
+
+    async def _batch_worker(self, name, handler, inbox, batch_size):
+        """Worker de la última etapa que agrupa hasta `batch_size` empresas por llamada"""
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await inbox.get()]
+            deadline = loop.time() + GEMINI_BATCH_WAIT
+            while len(jobs) < batch_size and loop.time() < deadline:
+                try:
+                    jobs.append(await asyncio.wait_for(inbox.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            
+            metrics.observe('queue_depth', inbox.qsize(), buckets=DEPTH_BUCKETS, stage=handler.__name__)
+            metrics.observe('batch_size', len(jobs), buckets=DEPTH_BUCKETS)
+            started = time.perf_counter()
+            try:
+                try:
+                    await handler(jobs)
+                    outcome = 'ok'
+                except Exception as e:
+                    logger.error(f"Error en etapa de {name} para un lote de {len(jobs)} empresas: {e}")
+                    outcome = 'error'
+                metrics.observe('stage_seconds', time.perf_counter() - started, stage=handler.__name__)
+                metrics.inc('stage_jobs_total', len(jobs), stage=handler.__name__, outcome=outcome)
+                for job in jobs:
+                    await self.on_done(job, job.get('result'))
+            except Exception as e:
+                logger.error(f"Error finalizando lote en etapa de {name}: {e}")
+            finally:
+                for _ in jobs:
+                    inbox.task_done()
+
+    def _reached(self, job, stage):
+        """True si el trabajo retoma en `stage` o en una etapa posterior"""
+        return job.get('stage') in STAGES and STAGES.index(job['stage']) >= STAGES.index(stage)
+
+    async def validate(self, job):
+        company, url = job['company'], job['url']
+        tag = f"[{job['idx']+1}/{job['total']}]"
+        if self._reached(job, 'validated'):
+            return job
+        
+        # Verificar si está en sitios bloqueados (y aún no toca reintentarlo)
+        if self.failures.should_skip(url):
+            logger.warning(f"{tag} {company}: Sitio previamente bloqueado, saltando")
+            return None
+        
+        # Validar URL antes de procesar (validación menos estricta)
+        # Si aún hay que descargar la home, el GET de validación sirve de descarga HTTP simple
+        profile = self.domain_profiles.get(urlparse(url).netloc, {})
+        prefetch = {} if VALIDATE_PREFETCH and not self.manifest.has(company) and (self.browser_pool is None or profile.get('tier') != 'browser') else None
+        failure = {}
+        async with host_slot(self.scheduler, url):
+            with metrics.timer('validate_seconds'):
+                accessible = await validate_url(url, use_fallback=True, session=self.session, prefetch=prefetch, failure=failure)
+        if not accessible:
+            reason = failure.get('reason', 'unknown')
+            logger.warning(f"{tag} {company}: URL no accesible después de validación completa ({reason}), agregando a sitios bloqueados")
+            self.failures.record(url, reason)
+            return None
+        if prefetch and 'html' in prefetch:
+            job['prefetch'] = prefetch
+        self.failures.resolve(url)
+        self.journal.mark(url, 'validated')
+        return job
+
+    async def fetch(self, job):
+        company, url = job['company'], job['url']
+        tag = f"[{job['idx']+1}/{job['total']}]"
+        if self._reached(job, 'fetched'):
+            return job
+        
+        # Descargar HTMLs solo si no existen (o, al refrescar, solo las páginas que cambiaron)
+        if self.manifest.has(company):
+            if job.get('refresh'):
+                job = await self.refresh(job)
             else:
-                logger.error(f"    Error al procesar {company} ({url}), agregando a sitios bloqueados")
-                blocked_sites.add(url)
+                logger.info(f"{tag} {company}: HTMLs ya descargados, extrayendo datos...")
+            if job is not None:
+                self.failures.resolve(url)
+                self.journal.mark(url, 'fetched')
+            return job
+        
+        logger.info(f"{tag} Descargando HTMLs de {company}: {url}")
+        try:
+            prefetch = job.pop('prefetch', {})
+            page_info = {key: prefetch[key] for key in ('etag', 'last_modified') if key in prefetch}
+            failure = {}
+            html_home = await fetch_html_tiered(
+                url, self.session,
+                (lambda: get_rendered_html_async(url, self.browser_pool, self.domain_profiles, page_info=page_info, failure=failure))
+                if self.browser_pool is not None else None,
+                self.domain_profiles, page_info, self.scheduler, prefetched=prefetch.get('html')
+            )
+            if not html_home:
+                reason = failure.get('reason', 'render')
+                logger.error(f"    Error al procesar {company} ({url}): {reason}, agregando a sitios bloqueados")
+                self.failures.record(url, reason)
                 return None
-                
+            
+            home_filename = safe_filename(company, "home") + ".html"
+            await self.manifest.save_async(company, url, html_home, home_filename, page_info)
+            
+            sitemap_urls = await fetch_sitemap_urls(self.session, url, self.scheduler) if SITEMAP_SEED else []
+            links = (await parse_in_pool(parse_html_page, html_home, url, 14000, sitemap_urls))['links']
+            if links:
+                logger.info(f"    Secciones relevantes encontradas: {len(links)}")
+                await download_sections(links, company, self.browser_pool, self.session, self.manifest, self.domain_profiles,
+                                        timeout=20000, scheduler=self.scheduler)
+        
         except Exception as e:
             logger.error(f"Error descargando {company}: {e}")
-            blocked_sites.add(url)
+            self.failures.record(url, classify_failure(e))
             return None
         
-        # Pequeña pausa para evitar sobrecargar el servidor
-        await asyncio.sleep(2)
-    else:
-        logger.info(f"[{idx+1}/{total}] {company}: HTMLs ya descargados, extrayendo datos...")
+        self.failures.resolve(url)
+        self.journal.mark(url, 'fetched')
+        return job
 
-    logger.info(f"--- Extrayendo y analizando para {company} ---")
-    
-    try:
-        all_html_text = merge_htmls_for_company(company, HTML_DIR)
-        if not all_html_text:
+    async def refresh(self, job):
+        """Re-crawl incremental: GET condicional por página y re-descarga solo de las que cambiaron"""
+        company = job['company']
+        tag = f"[{job['idx']+1}/{job['total']}]"
+        # Los archivos indexados desde disco no tienen URL ni validadores: no hay con qué comparar
+        pages = [entry for entry in self.manifest.entries[company].values() if entry['url'].startswith(('http://', 'https://'))]
+        unchanged = await asyncio.gather(*(page_unchanged(self.session, entry, self.scheduler) for entry in pages))
+        changed = [entry for entry, same in zip(pages, unchanged) if not same]
+        if pages and not changed:
+            logger.info(f"{tag} {company}: sin cambios desde la última descarga (304)")
+            job['status'] = 'unchanged'
+            return None
+        
+        logger.info(f"{tag} Refrescando {len(changed)}/{len(pages)} páginas de {company}")
+        for entry in changed:
+            page_info = {}
+            html = await fetch_html_tiered(
+                entry['url'], self.session,
+                (lambda: get_rendered_html_async(entry['url'], self.browser_pool, self.domain_profiles, page_info=page_info))
+                if self.browser_pool is not None else None,
+                self.domain_profiles, page_info, self.scheduler
+            )
+            if html:
+                await self.manifest.save_async(company, entry['url'], html, entry.get('file'), page_info)
+        return job
+
+    async def extract(self, job):
+        company = job['company']
+        logger.info(f"--- Extrayendo y analizando para {company} ---")
+        
+        extracted = await parse_in_pool(extract_company_data, self.manifest.refs(company), HTML_DIR)
+        visible_text = extracted['text']
+        if not visible_text:
             logger.warning(f"No se encontró contenido HTML para {company}")
             return None
-            
-        visible_text = extract_visible_text(all_html_text, max_length=14000)
-        prompt = build_prompt(visible_text)
-        response = call_gemini(prompt, cache=gpt_cache)
-        data = parse_response_to_dict(response)
-
-        result = {
-            'company_name': company,
-            'website': url,
-            'hq_city': data.get('hq_city', 'No Information'),
-            'hq_state': data.get('hq_state', 'No Information'),
-            'company_description': data.get('company_description', 'No Information'),
-            'sector': data.get('sector', 'No Information'),
-            'rol_empresa': data.get('rol_empresa', 'No Information'),
-            'presence_in_latam': data.get('presence_in_latam', 'No Information'),
-            'contact_phone': data.get('contact_phone', 'No Information'),
-            'productos_comercializan': data.get('productos_comercializan', 'No Information')
-        }
+        
+        # Si el texto extraído es idéntico al ya analizado, el resultado anterior sigue valiendo
+        job['text_sha256'] = hashlib.sha256(visible_text.encode('utf-8')).hexdigest()
+        if job.get('refresh') and job['text_sha256'] == self.manifest.text_hash(company):
+            logger.info(f"{company}: el texto no cambió, se conserva el resultado anterior")
+            job['status'] = 'unchanged'
+            return None
+        
+        job['text'] = visible_text
+        job['fields'] = extracted['fields']
+        if job['fields']:
+            logger.info(f"    Pre-extraídos sin LLM: {', '.join(job['fields'])}")
+        job['fingerprint'] = await parse_in_pool(text_fingerprint, visible_text)
+        self.journal.mark(job['url'], 'extracted')
+        return job
+
+    async def analyze(self, job):
+        known = job.get('fields', {})
+        cached = self.semantic_cache.lookup(job['fingerprint'], job['url'], job['text'])
+        if cached is not None:
+            known = dict(cached, **known)
+        fields = fields_for_llm(known)
+        data = {}
+        if fields:
+            response = await call_gemini(build_prompt(job['text'], fields), self.llm_client, cache=self.gpt_cache)
+            data = dict(parse_response_to_dict(response), **known)
+            self.semantic_cache.store(job['fingerprint'], job['url'], data)
+        elif cached is None:
+            logger.info(f"{job['company']}: campos resueltos sin LLM, se omite la llamada")
+            metrics.inc('llm_skipped_total')
+        job['result'] = build_result(job['company'], job['url'], dict(data, **known))
+        self.journal.mark(job['url'], 'llm_done', job['result'])
+        logger.info(f"-> Procesado exitosamente {job['company']}")
+        return job
 
-        logger.info(f"-> Procesado exitosamente {company}")
-        return result, url
+    async def analyze_batch(self, jobs):
+        pending = []
+        known = {}
+        for job in jobs:
+            cached = self.semantic_cache.lookup(job['fingerprint'], job['url'], job['text'])
+            known[job['idx']] = dict(cached or {}, **job.get('fields', {}))
+            if fields_for_llm(known[job['idx']]):
+                pending.append(job)
+            else:
+                if cached is None:
+                    logger.info(f"{job['company']}: campos resueltos sin LLM, se omite la llamada")
+                    metrics.inc('llm_skipped_total')
+                job['result'] = build_result(job['company'], job['url'], known[job['idx']])
         
-    except Exception as e:
-        logger.error(f"Error procesando {company}: {e}")
-        return None
+        if pending:
+            texts = {str(job['idx']): job['text'] for job in pending}
+            fields = {str(job['idx']): fields_for_llm(known[job['idx']]) for job in pending}
+            responses = await call_gemini_batch(texts, self.llm_client, cache=self.gpt_cache, fields=fields)
+            for job in pending:
+                data = dict(parse_response_to_dict(responses[str(job['idx'])]), **known[job['idx']])
+                self.semantic_cache.store(job['fingerprint'], job['url'], data)
+                job['result'] = build_result(job['company'], job['url'], data)
+        
+        for job in jobs:
+            self.journal.mark(job['url'], 'llm_done', job['result'])
+            logger.info(f"-> Procesado exitosamente {job['company']}")
+        return jobs
+
+def build_result(company, url, data):
+    """Fila de salida para una empresa a partir de la respuesta normalizada"""
+    return {
+        'company_name': company,
+        'website': url,
+        'hq_city': data.get('hq_city', 'No Information'),
+        'hq_state': data.get('hq_state', 'No Information'),
+        'company_description': data.get('company_description', 'No Information'),
+        'sector': data.get('sector', 'No Information'),
+        'rol_empresa': data.get('rol_empresa', 'No Information'),
+        'presence_in_latam': data.get('presence_in_latam', 'No Information'),
+        'contact_phone': data.get('contact_phone', 'No Information'),
+        'productos_comercializan': data.get('productos_comercializan', 'No Information')
+    }
 
 
 # ========== FLUJO PRINCIPAL MEJORADO ==========
 
-async def main():
-    """Flujo principal con procesamiento en paralelo mejorado"""
+async def main(refresh=False, shard=None):
+    """Flujo principal con pipeline por etapas.
+
+    Con `refresh=True` también se revisan las empresas ya procesadas: solo se
+    re-descargan las páginas que cambiaron y solo se llama al LLM si cambió el
+    texto extraído.
+
+    Con `shard` (ver `Shard`) solo se procesan las empresas de ese shard, con
+    su propio estado y su propia salida.
+    """
     start_time = datetime.now()
-    logger.info("Iniciando procesamiento de empresas")
+    logger.info("Iniciando procesamiento de empresas" + (f" (shard {shard.name})" if shard else ""))
+    metrics.reset()
+    
+    def state_path(path, key=None):
+        return shard.seed(path, key) if shard is not None else path
     
     # Cargar datos y caches
-    processed = load_checkpoint()
-    blocked_sites = load_blocked_sites()
-    gpt_cache = load_gpt_cache()
+    journal = CheckpointJournal(state_path(JOURNAL_FILE, 'url'))
+    failures = FailureStore(state_path(FAILURES_FILE, 'url'), legacy=journal.legacy_blocked)
+    llm_client = create_llm_client()
+    gpt_cache = LLMCache(model_name=llm_client.model_name)
+    semantic_cache = SemanticCache(model_name=llm_client.model_name)
+    profiles_path = state_path(DOMAIN_PROFILES_FILE)
+    domain_profiles = load_domain_profiles(profiles_path)
 
-    df = pd.read_excel(INPUT_CSV)
-    total = len(df)
+    store = None
+    if HTML_STORE == 'snapshots':
+        store = SnapshotStore(shard.path(SNAPSHOT_DIR) if shard is not None else SNAPSHOT_DIR)
+    # Lo ya guardado como snapshots (también el almacén global, si este es un shard)
+    # se sigue leyendo aunque ahora se escriban archivos
+    readers = []
+    if (store is None or shard is not None) and os.path.isdir(SNAPSHOT_DIR):
+        readers.append(SnapshotStore())
+    manifest = HtmlManifest(state_path(MANIFEST_FILE), store=store, readers=readers)
+    # Solo recorre la entrada si el manifiesto aún no existe
+    manifest.bootstrap((company for _, company, url in iter_companies() if shard is None or shard.owns(url)), HTML_DIR)
     
-    # Revisar sitios bloqueados
-    if blocked_sites:
-        logger.info("\n" + "="*50)
-        review_blocked_sites(blocked_sites, df)
-        logger.info("="*50 + "\n")
-        
-        # Opcional: Si hay muchos sitios bloqueados, considera limpiar la lista
-        if len(blocked_sites) > 50:
-            logger.warning(f"ATENCIÓN: Hay {len(blocked_sites)} sitios bloqueados.")
-            logger.warning("Si quieres reintentar sitios bloqueados, puedes limpiar el archivo:")
-            logger.warning(f"rm {BLOCKED_SITES_FILE}")
+    result_writer = ResultWriter(shard.path(OUTPUT_FILE) if shard is not None else OUTPUT_FILE)
+    # URLs cuyos resultados están en el buffer del writer y aún no en disco
+    pending_written = []
     
-    # Filtrar empresas que necesitan procesamiento
+    # Con ledger: webs reclamadas por este worker y aún sin terminar, y webs que
+    # tenía otro worker (se retoman al final si su arriendo vence)
+    ledger = shard.ledger if shard is not None else None
+    claimed = set()
+    waiting = {}
+    
+    def finish(urls):
+        if ledger is not None and urls:
+            ledger.finish(urls)
+            claimed.difference_update(urls)
+    
+    def save_progress():
+        # Solo se marcan como escritas las empresas cuyos resultados ya están en disco
+        if result_writer.flush():
+            for url in pending_written:
+                journal.mark(url, 'written')
+            journal.sync()
+            finish(pending_written)
+            pending_written.clear()
+        journal.sync()
+        failures.sync()
+        save_domain_profiles(domain_profiles, profiles_path)
+    
+    # Filtrar empresas que necesitan procesamiento (la entrada se lee en streaming)
     companies_to_process = []
+    blocked_companies = []
     companies_with_html = 0
     companies_already_processed = 0
-    companies_blocked = 0
+    companies_resumed = 0
+    companies_retried = 0
+    total = 0
     
-    for idx, row in df.iterrows():
-        url = str(row.get("Website", "")).strip()
-        company_name = row.get('Company Name', f"empresa_{idx}")
+    for idx, company_name, normalized_url in iter_companies():
+        total = idx + 1
+        if shard is not None and not shard.owns(normalized_url):
+            continue
+        stage = journal.stage(normalized_url)
         
-        if not url:
+        # Verificar si está bloqueado y aún no toca reintentarlo
+        if failures.should_skip(normalized_url):
+            blocked_companies.append((idx, company_name, normalized_url))
             continue
-            
-        normalized_url = normalize_url(url)
+        if normalized_url in failures:
+            companies_retried += 1
         
-        # Verificar si está bloqueado
-        if normalized_url in blocked_sites:
-            companies_blocked += 1
+        # Resultado del LLM que no llegó a escribirse antes de cortarse la ejecución
+        if stage == 'llm_done':
+            result_writer.add(journal.result(normalized_url))
+            pending_written.append(normalized_url)
+            companies_resumed += 1
             continue
         
         # Verificar si tiene archivos HTML descargados
-        prefix = safe_filename(company_name)
-        has_html_files = any(fname.startswith(prefix) and fname.endswith(".html") for fname in os.listdir(HTML_DIR))
-        
-        if has_html_files:
+        job = {'idx': idx, 'company': company_name, 'url': normalized_url}
+        if manifest.has(company_name):
             companies_with_html += 1
-            # Si ya tiene HTMLs Y está en processed, no procesar
-            if normalized_url in processed:
+            # Si ya tiene HTMLs Y está escrita, no procesar (salvo al refrescar)
+            if stage == 'written':
                 companies_already_processed += 1
-                continue
+                if not refresh:
+                    continue
+                job['refresh'] = True
         
         # Procesar si:
         # 1. No tiene HTMLs descargados, O
-        # 2. Tiene HTMLs pero no está en processed (para extraer datos con GPT)
-        companies_to_process.append((idx, row))
+        # 2. Tiene HTMLs pero no está escrita (retomando desde la última etapa registrada), O
+        # 3. Se pidió refrescar lo ya procesado
+        resume = resume_stage(stage, manifest.has(company_name)) if not job.get('refresh') else None
+        if resume is not None:
+            job['stage'] = resume
+            companies_resumed += 1
+        companies_to_process.append(job)
+    for job in companies_to_process:
+        job['total'] = total
+    save_progress()
+    
+    # Revisar sitios bloqueados
+    if len(failures):
+        logger.info("\n" + "="*50)
+        review_blocked_sites(failures, blocked_companies)
+        logger.info("="*50 + "\n")
+        
+        # Opcional: Si hay muchos sitios bloqueados, considera limpiar la lista
+        if len(failures) > 50:
+            logger.warning(f"ATENCIÓN: Hay {len(failures)} sitios bloqueados.")
+            logger.warning("Si quieres reintentar sitios bloqueados, puedes limpiarlos con:")
+            logger.warning("python 0_html_processing.py --clear-blocked")
     
     logger.info(f"Total empresas: {total}")
     logger.info(f"Empresas con HTMLs existentes: {companies_with_html}")
     logger.info(f"Empresas completamente procesadas: {companies_already_processed}")
-    logger.info(f"Empresas bloqueadas: {companies_blocked}")
+    logger.info(f"Empresas bloqueadas: {len(blocked_companies)}")
+    logger.info(f"Empresas fallidas antes que toca reintentar: {companies_retried}")
+    logger.info(f"Empresas retomadas desde el journal: {companies_resumed}")
     logger.info(f"Empresas por procesar: {len(companies_to_process)}")
     
     if not companies_to_process:
         logger.info("No hay empresas nuevas para procesar")
+        gpt_cache.close()
+        semantic_cache.close()
+        journal.close()
+        failures.close()
+        if ledger is not None:
+            ledger.close()
         return
     
-    # Procesar en lotes para control de concurrencia
-    batch_size = MAX_CONCURRENT_COMPANIES
     successful_count = 0
     failed_count = 0
+    unchanged_count = 0
+    completed_count = 0
     
-    for i in range(0, len(companies_to_process), batch_size):
-        batch = companies_to_process[i:i+batch_size]
-        logger.info(f"Procesando lote {i//batch_size + 1} de {(len(companies_to_process)-1)//batch_size + 1}")
-        
-        # Crear tareas asíncronas para el lote
-        tasks = []
-        for idx, row in batch:
-            task = process_single_company(idx, row, total, blocked_sites, gpt_cache)
-            tasks.append(task)
-        
-        # Ejecutar tareas en paralelo
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Procesar resultados
-        for result in results:
-            if isinstance(result, Exception):
-                logger.error(f"Error en tarea: {result}")
-                failed_count += 1
-                continue
-                
-            if result is None:
-                failed_count += 1
-                continue
-                
-            try:
-                result_data, url = result
-                processed.add(url)
-                
-                # Guardar resultado al CSV INMEDIATAMENTE
-                if await save_result_to_csv(result_data):
-                    successful_count += 1
-                else:
-                    failed_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error procesando resultado: {e}")
-                failed_count += 1
-        
-        # Guardar progreso después de cada lote
-        save_checkpoint(processed)
-        save_blocked_sites(blocked_sites)
-        save_gpt_cache(gpt_cache)
+    async def on_done(job, result_data):
+        nonlocal successful_count, failed_count, unchanged_count, completed_count
+        if job.get('status') == 'unchanged':
+            journal.mark(job['url'], 'written')
+            finish([job['url']])
+            unchanged_count += 1
+            metrics.inc('companies_total', outcome='unchanged')
+        elif result_data is None:
+            # Vuelve a la bolsa cuando toque reintentarla según el FailureStore de este worker
+            if ledger is not None:
+                ledger.fail(job['url'], failures.retry_at(job['url']) or time.time())
+                claimed.discard(job['url'])
+            failed_count += 1
+            metrics.inc('companies_total', outcome='failed')
+        else:
+            pending_written.append(job['url'])
+            result_writer.add(result_data)
+            successful_count += 1
+            manifest.record_text_hash(job['company'], job['text_sha256'])
+            metrics.inc('companies_total', outcome='ok')
         
-        # Pausa entre lotes para respetar rate limits
-        if i + batch_size < len(companies_to_process):
-            await asyncio.sleep(2)
+        # Guardar progreso periódicamente
+        completed_count += 1
+        if completed_count % CHECKPOINT_EVERY == 0:
+            logger.info(f"Progreso: {completed_count}/{len(companies_to_process)} empresas terminadas")
+            save_progress()
+    
+    metrics.gauge('companies_pending', lambda: len(companies_to_process) - completed_count)
+    metrics.gauge('semantic_cache_total', lambda: semantic_cache.hits, result='hit')
+    metrics.gauge('semantic_cache_total', lambda: semantic_cache.misses, result='miss')
+    metrics_runner = await start_metrics_server(metrics) if METRICS_PORT else None
+    
+    def claimed_jobs(jobs):
+        """Trabajos que este worker consigue reclamar, justo antes de encolarlos"""
+        for job in jobs:
+            if ledger.claim(job['url']):
+                claimed.add(job['url'])
+                yield job
+            else:
+                waiting[job['url']] = job
+    
+    async def renew_leases():
+        while True:
+            await asyncio.sleep(ledger.lease_seconds / 3)
+            ledger.renew(claimed)
+    
+    async def run_claimed(pipeline):
+        heartbeat = asyncio.create_task(renew_leases())
+        try:
+            await pipeline.run(claimed_jobs(companies_to_process))
+            # Esperar a las empresas de otros workers: si alguno muere, su
+            # arriendo vence y se reclaman aquí
+            while waiting:
+                # Guardar lo propio primero: los demás workers también esperan a que termine
+                save_progress()
+                for url in ledger.settled(waiting):
+                    del waiting[url]
+                retry = [waiting.pop(url) for url in list(waiting) if ledger.claim(url)]
+                if retry:
+                    logger.info(f"Retomando {len(retry)} empresas con arriendos vencidos")
+                    claimed.update(job['url'] for job in retry)
+                    await pipeline.run(retry)
+                elif waiting:
+                    await asyncio.sleep(min(ledger.lease_seconds / 3, 30))
+        finally:
+            heartbeat.cancel()
+    
+    # Un único navegador y una única sesión HTTP para toda la ejecución
+    browser_pool = BrowserPool() if RENDER_BROWSER else None
+    if browser_pool is not None:
+        await browser_pool.start()
+    else:
+        logger.warning("RENDER_BROWSER=0: sin navegador, las páginas se descargan solo por HTTP simple")
+    
+    try:
+        async with create_http_session() as session:
+            scheduler = HostScheduler(session, domain_profiles)
+            pipeline = CompanyPipeline(journal, failures, manifest, gpt_cache, semantic_cache, llm_client, browser_pool, domain_profiles, session, scheduler, on_done)
+            if ledger is None:
+                await pipeline.run(companies_to_process)
+            else:
+                await run_claimed(pipeline)
+    finally:
+        if browser_pool is not None:
+            await browser_pool.close()
+        shutdown_parse_pool()
+        save_progress()
+        if ledger is not None:
+            # Lo que quedó a medias (corte o error de escritura) lo retoma otro worker
+            ledger.release(claimed)
+            ledger.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
     
     # Estadísticas finales
     end_time = datetime.now()
@@ -830,9 +3679,47 @@ async def main():
     logger.info(f"Tiempo total: {duration}")
     logger.info(f"Empresas procesadas exitosamente: {successful_count}")
     logger.info(f"Empresas fallidas: {failed_count}")
-    logger.info(f"Sitios bloqueados total: {len(blocked_sites)}")
+    if refresh:
+        logger.info(f"Empresas sin cambios: {unchanged_count}")
+    logger.info(f"Sitios bloqueados total: {len(failures)}")
     logger.info(f"Entradas en caché GPT: {len(gpt_cache)}")
+    logger.info(f"Caché semántica: {semantic_cache.hits} aciertos, {semantic_cache.misses} fallos")
+    
+    # Resumen de métricas junto con la configuración usada, para comparar ejecuciones
+    llm_lookups = metrics.counter('llm_cache_total')
+    semantic_lookups = semantic_cache.hits + semantic_cache.misses
+    summary = metrics.summary()
+    summary['run'] = {
+        'total': total,
+        'to_process': len(companies_to_process),
+        'successful': successful_count,
+        'failed': failed_count,
+        'unchanged': unchanged_count,
+        'resumed': companies_resumed,
+        'duration_seconds': round(duration.total_seconds(), 3),
+        'companies_per_minute': round(completed_count * 60 / max(duration.total_seconds(), 1e-6), 2),
+        'llm_cache_hit_ratio': round(metrics.counter('llm_cache_total', result='hit') / llm_lookups, 4) if llm_lookups else None,
+        'semantic_cache_hit_ratio': round(semantic_cache.hits / semantic_lookups, 4) if semantic_lookups else None,
+    }
+    summary['config'] = {
+        'MAX_CONCURRENT': MAX_CONCURRENT_COMPANIES, 'GPT_DELAY': GPT_RATE_LIMIT_DELAY, 'URL_TIMEOUT': URL_VALIDATION_TIMEOUT,
+        'VALIDATE_CONCURRENCY': VALIDATE_CONCURRENCY, 'RENDER_CONCURRENCY': RENDER_CONCURRENCY,
+        'EXTRACT_CONCURRENCY': EXTRACT_CONCURRENCY, 'LLM_CONCURRENCY': LLM_CONCURRENCY, 'LLM_RPM': LLM_RPM,
+        'GEMINI_BATCH_SIZE': GEMINI_BATCH_SIZE, 'HOST_CONCURRENCY': HOST_CONCURRENCY, 'HOST_MIN_INTERVAL': HOST_MIN_INTERVAL,
+        'BROWSER_POOL_SIZE': BROWSER_POOL_SIZE, 'PARSE_WORKERS': PARSE_WORKERS,
+    }
+    if shard is not None:
+        summary['run']['shard'] = shard.name
+    summary_path = shard.path(RUN_SUMMARY_FILE) if shard is not None else RUN_SUMMARY_FILE
+    _atomic_write(summary_path, json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8'))
+    logger.info(f"Resumen de métricas guardado en {summary_path}")
+    
+    gpt_cache.close()
+    semantic_cache.close()
+    journal.close()
+    failures.close()
     logger.info("¡Extracción finalizada!")
+    return summary
 
 if __name__ == "__main__":
     import sys
@@ -846,10 +3733,42 @@ if __name__ == "__main__":
     
     if len(sys.argv) > 1 and sys.argv[1] == "--show-blocked":
         logger.info("Mostrando sitios bloqueados...")
-        df = pd.read_excel(INPUT_CSV)
-        blocked_sites = load_blocked_sites()
-        review_blocked_sites(blocked_sites, df)
+        journal = CheckpointJournal()
+        failures = FailureStore(legacy=journal.legacy_blocked)
+        review_blocked_sites(failures, iter_companies())
+        journal.close()
+        failures.close()
+        sys.exit(0)
+    
+    # Juntar las salidas de una ejecución repartida en OUTPUT_FILE
+    if "--merge" in sys.argv[1:]:
+        merge_shard_outputs()
         sys.exit(0)
     
-    # Ejecutar el flujo principal asíncrono
-    asyncio.run(main())
\ No newline at end of file
+    def option(name):
+        """Valor que sigue a `name` en la línea de comandos"""
+        if name in sys.argv[1:-1]:
+            return sys.argv[sys.argv.index(name) + 1]
+        return None
+    
+    # Ejecución repartida: --shard i/N (reparto fijo por hash de la web) o
+    # --ledger [--worker NOMBRE] (cada worker reclama empresas en WORK_LEDGER_FILE)
+    shard = None
+    if "--shard" in sys.argv[1:] and "--ledger" in sys.argv[1:]:
+        logger.error("Usa --shard o --ledger, no ambos")
+        sys.exit(2)
+    if "--shard" in sys.argv[1:]:
+        try:
+            shard = Shard.parse(option("--shard") or "")
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit(2)
+    elif "--ledger" in sys.argv[1:]:
+        try:
+            shard = Shard.leased(option("--worker"))
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit(2)
+    
+    # Ejecutar el flujo principal asíncrono (--refresh revisa también lo ya procesado)
+    asyncio.run(main(refresh="--refresh" in sys.argv[1:], shard=shard))
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""Benchmark de extremo a extremo del pipeline, sin red ni API de Gemini.
+
+Uso:
+    python src/scripts/bench_pipeline.py [--companies N] [--hosts H] [--latency-ms MS] [--fail-rate P]
+                                         [--llm-latency S] [--mix fixture=0.6,heavy=0.2,js=0.2] [--no-browser]
+
+Levanta en un proceso aparte un servidor HTTP local con `--hosts` puertos
+(cada puerto es un dominio distinto para el scheduler por dominio) que sirve
+N empresas sintéticas: los HTMLs de src/data/htmls como home ('fixture'),
+páginas grandes con mucho marcado ('heavy') y shells de JavaScript que solo
+muestran contenido tras renderizar ('js', que se excluyen con `--no-browser`). Cada respuesta tarda `--latency-ms`
+(±50 %) y falla con un 503 con probabilidad `--fail-rate`. Cualquier otra
+ruta devuelve una sección sintética (contacto, nosotros...).
+
+Después ejecuta main() de 0_html_processing.py sobre esas empresas con el
+backend LLM 'stub' (`--llm-latency` segundos por llamada), con todos los
+datos en un directorio temporal, y muestra empresas terminadas con éxito por minuto, p50/p95 por
+etapa y el pico de memoria (RSS). Con `--json` guarda el resultado para
+comparar ejecuciones.
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Sin resource (Windows) no se informa el pico de memoria
+    resource = None
+
+from aiohttp import web
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HTML_DIR = os.path.join(SCRIPTS_DIR, "..", "data", "htmls")
+
+KINDS = ('fixture', 'heavy', 'js')
+SECTION_SLUGS = ['about-us', 'contact', 'services', 'products', 'our-team', 'history', 'careers', 'blog']
+WORDS = ("empresa industrial soluciones clientes productos servicios calidad distribución fabricación logística "
+         "tecnología mercado equipo experiencia proyectos innovación sostenible global regional oficinas planta "
+         "company industrial solutions customers products services quality distribution manufacturing logistics").split()
+CITIES = [('Monterrey', 'Nuevo León', 'MX'), ('Bogotá', 'Cundinamarca', 'CO'), ('Austin', 'Texas', 'US'),
+          ('Santiago', 'Región Metropolitana', 'CL'), ('Madrid', 'Madrid', 'ES')]
+
+
+def load_processing_module(work_dir, args, input_path):
+    """Importar 0_html_processing.py con todos sus datos en `work_dir` y el LLM simulado"""
+    # Las rutas se fuerzan (no setdefault) para no tocar nunca los datos reales
+    os.environ["COMPANY_XLSX"] = input_path
+    os.environ["COMPANY_HTML"] = os.path.join(work_dir, "htmls")
+    os.environ["COMPANY_OUT"] = os.path.join(work_dir, "processed", "out.csv")
+    os.environ["RUN_SUMMARY_FILE"] = os.path.join(work_dir, "run_summary.json")
+    os.environ["LLM_BACKEND"] = "stub"
+    os.environ["STUB_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["RENDER_BROWSER"] = "0" if args.no_browser else "1"
+    spec = importlib.util.spec_from_file_location("html_processing", os.path.join(SCRIPTS_DIR, "0_html_processing.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["html_processing"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise argparse.ArgumentTypeError(f"tipo de página desconocido: {kind} (válidos: {', '.join(KINDS)})")
+        weights[kind.strip()] = float(weight or 1)
+    return weights
+
+
+def company_kinds(count, mix, seed):
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    return [rng.choices(kinds, weights)[0] for _ in range(count)]
+
+
+# ---------- Sitios sintéticos (se generan en el proceso del servidor) ----------
+
+def sentence(rng, words=14):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def contact_block(rng):
+    city, state, country = rng.choice(CITIES)
+    phone = f"+52 {rng.randint(10, 99)} {rng.randint(1000, 9999)} {rng.randint(1000, 9999)}"
+    return (f'<p>Oficinas en {city}, {state}. Teléfono: {phone}</p><a href="tel:{phone.replace(" ", "")}">Llámanos</a>',
+            {"@context": "https://schema.org", "@type": "Organization", "telephone": phone,
+             "address": {"@type": "PostalAddress", "addressLocality": city, "addressRegion": state, "addressCountry": country}})
+
+
+def heavy_page(index, kb, rng):
+    """Home grande: navegación, cientos de tarjetas anidadas y JSON-LD"""
+    nav = "".join(f'<li><a href="/c{index}/{slug}">{slug.replace("-", " ").title()}</a></li>' for slug in SECTION_SLUGS)
+    contact, jsonld = contact_block(rng)
+    cards, size = [], 0
+    while size < kb * 1024:
+        card = (f'<div class="card"><div class="inner"><h3>{sentence(rng, 4)}</h3><p>{sentence(rng)}</p>'
+                f'<ul>{"".join(f"<li>{sentence(rng, 5)}</li>" for _ in range(5))}</ul></div></div>')
+        cards.append(card)
+        size += len(card)
+    return (f'<html><head><title>Empresa {index}</title><script type="application/ld+json">{json.dumps(jsonld)}</script>'
+            f'</head><body><nav><ul>{nav}</ul></nav><main class="content"><h1>Empresa {index}</h1>{"".join(cards)}'
+            f'</main><footer>{contact}</footer></body></html>')
+
+
+def js_page(index, rng):
+    """Shell de SPA: sin navegador casi no tiene texto visible"""
+    links = "".join(f'<a href="/c{index}/{slug}">{slug}</a> ' for slug in SECTION_SLUGS[:4])
+    content = f"<h1>Empresa {index}</h1>" + "".join(f"<p>{sentence(rng)}</p>" for _ in range(30)) + links
+    return (f'<html><head><title>Empresa {index}</title></head><body><div id="root"></div>'
+            f'<script>document.getElementById("root").innerHTML = {json.dumps(content)};</script></body></html>')
+
+
+def section_page(path, rng):
+    contact, jsonld = contact_block(rng)
+    return (f'<html><head><title>{path}</title><script type="application/ld+json">{json.dumps(jsonld)}</script></head>'
+            f'<body><main><h1>{path.strip("/").replace("-", " ").title()}</h1>'
+            f'{"".join(f"<p>{sentence(rng)}</p>" for _ in range(20))}{contact}</main></body></html>')
+
+
+def run_site_server(hosts, kinds, fixtures_dir, latency_ms, fail_rate, heavy_kb, seed, ready):
+    """Proceso del servidor: publica los puertos en `ready` y sirve hasta que lo terminan"""
+    asyncio.run(_serve_sites(hosts, kinds, fixtures_dir, latency_ms, fail_rate, heavy_kb, seed, ready))
+
+
+async def _serve_sites(hosts, kinds, fixtures_dir, latency_ms, fail_rate, heavy_kb, seed, ready):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            fixtures.append(f.read())
+    rng = random.Random(seed)
+    homes = {}
+
+    def home_page(index):
+        if index not in homes:
+            page_rng = random.Random(f"{seed}-{index}")
+            if kinds[index] == 'fixture' and fixtures:
+                homes[index] = fixtures[index % len(fixtures)]
+            elif kinds[index] == 'js':
+                homes[index] = js_page(index, page_rng)
+            else:
+                homes[index] = heavy_page(index, heavy_kb, page_rng)
+        return homes[index]
+
+    async def handle(request):
+        if latency_ms:
+            await asyncio.sleep(latency_ms * rng.uniform(0.5, 1.5) / 1000)
+        if rng.random() < fail_rate:
+            return web.Response(status=503, text="Service Unavailable")
+        if request.path in ('/robots.txt', '/sitemap.xml'):
+            return web.Response(status=404)
+        match = re.fullmatch(r'/c(\d+)/?', request.path)
+        if match and int(match.group(1)) < len(kinds):
+            return web.Response(text=home_page(int(match.group(1))), content_type='text/html')
+        return web.Response(text=section_page(request.path, random.Random(request.path)), content_type='text/html')
+
+    app = web.Application()
+    app.router.add_route('GET', '/{tail:.*}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    ports = []
+    for _ in range(hosts):
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        ports.append(runner.addresses[-1][1])
+    ready.put(ports)
+    await asyncio.Event().wait()
+
+
+# ---------- Ejecución y reporte ----------
+
+def peak_rss_mb(who):
+    if resource is None:
+        return None
+    usage = resource.getrusage(who).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return usage / 1024 / 1024 if sys.platform == 'darwin' else usage / 1024
+
+
+def write_companies(path, ports, count):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Company Name", "Website"])
+        for index in range(count):
+            writer.writerow([f"Bench Company {index}", f"http://127.0.0.1:{ports[index % len(ports)]}/c{index}/"])
+
+
+def stage_table(summary):
+    rows = []
+    for name, stats in summary['histograms'].items():
+        if name.startswith(('stage_seconds', 'fetch_seconds', 'validate_seconds', 'host_wait_seconds',
+                            'llm_request_seconds', 'llm_wait_seconds')):
+            rows.append((name, stats['count'], stats['p50'] * 1000, stats['p95'] * 1000, stats['max'] * 1000))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--companies", type=int, default=50)
+    parser.add_argument("--hosts", type=int, default=10, help="dominios (puertos) entre los que se reparten las empresas")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("fixture=0.6,heavy=0.2,js=0.2"))
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--heavy-kb", type=int, default=300)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-browser", action="store_true", help="no lanzar Chromium (RENDER_BROWSER=0)")
+    parser.add_argument("--fixtures", default=DEFAULT_HTML_DIR)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    parser.add_argument("--keep", action="store_true", help="conservar el directorio temporal de datos")
+    parser.add_argument("--verbose", action="store_true", help="mostrar el log del pipeline")
+    args = parser.parse_args()
+    if args.no_browser and args.mix.pop('js', 0):
+        # Sin navegador los shells de JavaScript no tienen texto y solo medirían fallos
+        if not any(args.mix.values()):
+            parser.error("--no-browser necesita algún tipo de página distinto de 'js' en --mix")
+        print("Aviso: con --no-browser se excluyen las páginas 'js' de la mezcla", file=sys.stderr)
+
+    kinds = company_kinds(args.companies, args.mix, args.seed)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=run_site_server, daemon=True,
+        args=(max(1, args.hosts), kinds, args.fixtures, args.latency_ms, args.fail_rate, args.heavy_kb, args.seed, ready),
+    )
+    server.start()
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        ports = ready.get(timeout=30)
+        input_path = os.path.join(work_dir, "companies.csv")
+        write_companies(input_path, ports, args.companies)
+
+        hp = load_processing_module(work_dir, args, input_path)
+        if not args.verbose:
+            for handler in logging.getLogger().handlers:
+                if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+                    handler.setLevel(logging.WARNING)
+
+        start = time.perf_counter()
+        summary = asyncio.run(hp.main())
+        elapsed = time.perf_counter() - start
+        # El pool de parseo ya terminó dentro de main(); el servidor sigue vivo y no cuenta como hijo
+        rss = {'process_mb': peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+               'largest_child_mb': peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None}
+    finally:
+        server.terminate()
+        server.join()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if summary is None:
+        sys.exit("main() no procesó ninguna empresa; no hay métricas que mostrar")
+    run = summary['run']
+    # Solo cuentan las empresas terminadas con éxito: las fallidas no son rendimiento
+    companies_per_minute = run['successful'] * 60 / elapsed
+    mix = {kind: kinds.count(kind) for kind in KINDS}
+    print(f"\nEmpresas: {args.companies} {mix} en {args.hosts} dominios, latencia {args.latency_ms:g} ms, "
+          f"fallos {args.fail_rate:.0%}, LLM {args.llm_latency:g} s, navegador {'no' if args.no_browser else 'sí'}")
+    print(f"Resultado: {run['successful']} ok, {run['failed']} fallidas en {elapsed:.1f} s "
+          f"-> {companies_per_minute:.1f} empresas/min")
+    print(f"\n{'serie':<45} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, count, p50, p95, maximum in stage_table(summary):
+        print(f"{name:<45} {count:>6} {p50:>9.1f} {p95:>9.1f} {maximum:>9.1f}")
+    if rss['process_mb'] is not None:
+        print(f"\nRSS pico: proceso {rss['process_mb']:.0f} MB, mayor proceso hijo {rss['largest_child_mb']:.0f} MB")
+    if args.keep:
+        print(f"Datos de la ejecución en {work_dir}")
+
+    if args.json:
+        result = {
+            'args': {key: value for key, value in vars(args).items() if key not in ('json', 'keep', 'verbose')},
+            'kinds': mix,
+            'elapsed_seconds': round(elapsed, 3),
+            'companies_per_minute': round(companies_per_minute, 2),
+            'peak_rss': rss,
+            'summary': summary,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Resultado guardado en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
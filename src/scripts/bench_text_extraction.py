@@ -0,0 +1,82 @@
+"""Benchmark del extractor de texto visible: BeautifulSoup (original) vs lxml (una pasada).
+
+Uso:
+    python src/scripts/bench_text_extraction.py [directorio_htmls] [--repeat N]
+
+Para cada HTML muestra el tiempo de ambos extractores y el solapamiento de
+sus salidas (Jaccard sobre el conjunto de palabras y qué fracción de las
+palabras del extractor original conserva el nuevo).
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import re
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HTML_DIR = os.path.join(SCRIPTS_DIR, "..", "data", "htmls")
+
+
+def load_processing_module():
+    """Importar 0_html_processing.py sin tocar los datos reales (logs y salidas a un tmp)"""
+    tmp_dir = tempfile.mkdtemp(prefix="bench_")
+    os.environ.setdefault("COMPANY_HTML", os.path.join(tmp_dir, "htmls"))
+    os.environ.setdefault("COMPANY_OUT", os.path.join(tmp_dir, "processed", "out.csv"))
+    spec = importlib.util.spec_from_file_location("html_processing", os.path.join(SCRIPTS_DIR, "0_html_processing.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["html_processing"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def best_time(func, html, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(html)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def words(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("html_dir", nargs="?", default=DEFAULT_HTML_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-length", type=int, default=14000)
+    args = parser.parse_args()
+
+    hp = load_processing_module()
+    files = sorted(glob.glob(os.path.join(args.html_dir, "*.html")))
+    if not files:
+        print(f"No hay HTMLs en {args.html_dir}")
+        return
+
+    print(f"{'archivo':<55} {'KB':>7} {'bs4 ms':>8} {'lxml ms':>8} {'x':>6} {'jaccard':>8} {'recall':>7}")
+    total_old = total_new = 0.0
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        old_time, old_text = best_time(lambda h: hp.extract_visible_text_bs4(h, args.max_length), html, args.repeat)
+        new_time, new_text = best_time(lambda h: hp.extract_visible_text_lxml(h, args.max_length), html, args.repeat)
+        total_old += old_time
+        total_new += new_time
+
+        old_words, new_words = words(old_text), words(new_text)
+        union = old_words | new_words
+        jaccard = len(old_words & new_words) / len(union) if union else 1.0
+        recall = len(old_words & new_words) / len(old_words) if old_words else 1.0
+        print(f"{os.path.basename(path)[:55]:<55} {len(html) / 1024:>7.0f} {old_time * 1000:>8.1f} {new_time * 1000:>8.1f} "
+              f"{old_time / new_time:>6.1f} {jaccard:>8.2f} {recall:>7.2f}")
+
+    print(f"\nTotal: bs4 {total_old * 1000:.0f} ms, lxml {total_new * 1000:.0f} ms ({total_old / total_new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
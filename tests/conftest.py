@@ -0,0 +1,36 @@
+"""Carga de src/scripts/0_html_processing.py para los tests.
+
+El script configura rutas, logging y carpetas al importarse, así que se
+apunta todo a un directorio temporal antes de cargarlo y se usa el backend
+LLM local (`stub`).
+"""
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "scripts")
+DATA_DIR = tempfile.mkdtemp(prefix="html_processing_tests_")
+
+os.environ["COMPANY_HTML"] = os.path.join(DATA_DIR, "htmls")
+os.environ["COMPANY_OUT"] = os.path.join(DATA_DIR, "processed", "out.csv")
+os.environ["LLM_BACKEND"] = "stub"
+os.environ["STUB_LLM_LATENCY"] = "0"
+
+
+@pytest.fixture(scope="session")
+def hp():
+    """El módulo 0_html_processing.py"""
+    if "html_processing" not in sys.modules:
+        spec = importlib.util.spec_from_file_location("html_processing", os.path.join(SCRIPTS_DIR, "0_html_processing.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["html_processing"] = module
+        spec.loader.exec_module(module)
+    return sys.modules["html_processing"]
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
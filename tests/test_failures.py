@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def clock(hp, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(hp.time, "time", lambda: now[0])
+    return now
+
+
+def test_backoff_doubles_per_failure_and_is_capped(hp, tmp_path, clock):
+    failures = hp.FailureStore(str(tmp_path / "failures.jsonl"))
+    assert failures.retry_at("https://a.com/") is None
+    
+    failures.record("https://a.com/", "timeout")
+    assert failures.retry_at("https://a.com/") == clock[0] + 3600
+    failures.record("https://a.com/", "timeout")
+    assert failures.retry_at("https://a.com/") == clock[0] + 2 * 3600
+    
+    for _ in range(20):
+        failures.record("https://b.com/", "not_found")
+    assert failures.retry_at("https://b.com/") == clock[0] + hp.RETRY_MAX_DAYS * 86400
+    failures.close()
+
+
+def test_should_skip_until_retry_and_resolve_forgets(hp, tmp_path, clock):
+    path = str(tmp_path / "failures.jsonl")
+    failures = hp.FailureStore(path)
+    failures.record("https://a.com/", "dns")
+    assert failures.should_skip("https://a.com/")
+    assert failures.should_skip("https://a.com/", now=clock[0] + 72 * 3600 - 1)
+    assert not failures.should_skip("https://a.com/", now=clock[0] + 72 * 3600)
+    
+    failures.record("https://b.com/", "timeout")
+    failures.resolve("https://b.com/")
+    assert not failures.should_skip("https://b.com/")
+    failures.close()
+    
+    # Al reabrir se reconstruye el mismo estado desde el JSONL
+    failures = hp.FailureStore(path)
+    assert failures.get("https://a.com/")["attempts"] == 1
+    assert "https://b.com/" not in failures
+    failures.close()
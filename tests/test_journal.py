@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+
+def test_journal_restores_stages_and_results(hp, tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = hp.CheckpointJournal(path)
+    journal.mark("https://a.com/", "validated")
+    journal.mark("https://a.com/", "fetched")
+    journal.mark("https://b.com/", "llm_done", {"website": "https://b.com/", "hq_city": "Lima"})
+    journal.mark("https://c.com/", "written")
+    journal.mark("https://c.com/", None)
+    journal.sync()
+    journal.close()
+    
+    journal = hp.CheckpointJournal(path)
+    assert journal.stage("https://a.com/") == "fetched"
+    assert journal.stage("https://b.com/") == "llm_done"
+    assert journal.result("https://b.com/")["hq_city"] == "Lima"
+    assert journal.stage("https://c.com/") is None
+    journal.close()
+
+
+def test_journal_drops_a_torn_last_line(hp, tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = hp.CheckpointJournal(path)
+    journal.mark("https://a.com/", "extracted")
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"url": "https://b.com/", "sta')
+    
+    journal = hp.CheckpointJournal(path)
+    assert journal.stage("https://a.com/") == "extracted"
+    assert journal.stage("https://b.com/") is None
+    journal.mark("https://b.com/", "validated")
+    journal.close()
+    assert hp.CheckpointJournal(path).stage("https://b.com/") == "validated"
+
+
+def test_journal_migrates_checkpoint_json_as_written(hp, tmp_path, monkeypatch):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps(["https://a.com/", "https://b.com/"]), encoding="utf-8")
+    monkeypatch.setattr(hp, "CHECKPOINT_FILE", str(checkpoint))
+    journal = hp.CheckpointJournal(str(tmp_path / "journal.jsonl"))
+    assert journal.stage("https://a.com/") == "written"
+    assert journal.stage("https://b.com/") == "written"
+    journal.close()
+
+
+@pytest.mark.parametrize("stage, has_html, expected", [
+    (None, False, None),
+    ("validated", False, "validated"),
+    ("fetched", True, "fetched"),
+    ("extracted", True, "extracted"),
+    # Sin HTMLs en el manifiesto hay que volver a descargar
+    ("fetched", False, "validated"),
+    ("extracted", False, "validated"),
+    # llm_done se escribe directamente; written sin HTMLs (migrada) se procesa entera
+    ("llm_done", True, None),
+    ("written", False, None),
+])
+def test_resume_stage(hp, stage, has_html, expected):
+    assert hp.resume_stage(stage, has_html) == expected
@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def clock(hp, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(hp.time, "time", lambda: now[0])
+    return now
+
+
+def ledgers(hp, tmp_path):
+    path = str(tmp_path / "ledger.db")
+    return hp.WorkLedger(path, "w1", lease_seconds=60), hp.WorkLedger(path, "w2", lease_seconds=60)
+
+
+def test_lease_is_exclusive_until_it_expires(hp, tmp_path, clock):
+    first, second = ledgers(hp, tmp_path)
+    assert first.claim("https://a.com/")
+    assert first.claim("https://a.com/")
+    assert not second.claim("https://a.com/")
+    
+    clock[0] += 61  # El worker 1 murió sin renovar
+    assert second.claim("https://a.com/")
+    assert not first.claim("https://a.com/")
+
+
+def test_failed_lease_is_reclaimable_only_after_retry_at(hp, tmp_path, clock):
+    first, second = ledgers(hp, tmp_path)
+    assert first.claim("https://a.com/")
+    first.fail("https://a.com/", clock[0] + 3600)
+    assert first.settled(["https://a.com/"]) == {"https://a.com/"}
+    
+    clock[0] += 3599
+    assert not second.claim("https://a.com/")
+    assert not first.claim("https://a.com/")
+    clock[0] += 2
+    assert second.claim("https://a.com/")
+    assert first.settled(["https://a.com/"]) == set()
+
+
+def test_finished_lease_is_never_reclaimed(hp, tmp_path, clock):
+    first, second = ledgers(hp, tmp_path)
+    assert first.claim("https://a.com/")
+    first.finish(["https://a.com/"])
+    first.fail("https://a.com/", 0)  # Un fallo tardío no la devuelve a la bolsa
+    
+    clock[0] += 365 * 86400
+    assert not first.claim("https://a.com/")
+    assert not second.claim("https://a.com/")
+
+
+def test_merge_keeps_the_latest_row_per_website(hp, tmp_path):
+    path = str(tmp_path / "out.csv")
+    old, new = str(tmp_path / "out.shard-0-2.csv"), str(tmp_path / "out.worker-b.csv")
+    pd.DataFrame([{"website": "https://a.com/", "hq_city": "Lima"},
+                  {"website": "https://b.com/", "hq_city": "Quito"}]).to_csv(old, index=False)
+    pd.DataFrame([{"website": "https://a.com/", "hq_city": "Cusco"}]).to_csv(new, index=False)
+    os.utime(old, (1, 1))
+    
+    assert hp.merge_shard_outputs(path, fmt="csv") == 3
+    data = pd.read_csv(path, dtype=str).set_index("website")["hq_city"].to_dict()
+    assert data == {"https://a.com/": "Cusco", "https://b.com/": "Quito"}
+    assert not os.path.exists(old) and not os.path.exists(new)
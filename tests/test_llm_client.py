@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import pytest
+
+
+class FlakyBackend:
+    """Backend que falla `failures` veces con `code` antes de responder"""
+
+    model_name = "flaky"
+
+    def __init__(self, failures, code):
+        self.failures = failures
+        self.code = code
+        self.calls = 0
+
+    async def generate(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            error = RuntimeError(f"HTTP {self.code}")
+            error.code = self.code
+            raise error
+        return '{"hq_city": "Lima"}', 42
+
+
+class CountingStub:
+    """StubBackend que cuenta las llamadas"""
+
+    def __init__(self, hp):
+        self.inner = hp.StubBackend(latency=0)
+        self.model_name = self.inner.model_name
+        self.calls = 0
+
+    async def generate(self, prompt):
+        self.calls += 1
+        return await self.inner.generate(prompt)
+
+
+@pytest.fixture
+def no_backoff(hp, monkeypatch):
+    monkeypatch.setattr(hp, "LLM_BACKOFF_BASE", 0.0)
+
+
+def test_stub_client_answers_every_prompt_field(hp):
+    client = hp.create_llm_client("stub")
+    assert client.model_name == "stub"
+    response = asyncio.run(client.generate(hp.build_prompt("Acme SA, Monterrey, México")))
+    assert set(json.loads(response)) == set(hp.PROMPT_FIELDS)
+
+
+def test_retryable_errors_are_retried(hp, no_backoff):
+    backend = FlakyBackend(failures=2, code=503)
+    client = hp.LLMClient(backend, max_retries=3)
+    assert asyncio.run(client.generate("prompt")) == '{"hq_city": "Lima"}'
+    assert backend.calls == 3
+
+
+def test_other_errors_are_not_retried(hp, no_backoff):
+    backend = FlakyBackend(failures=1, code=400)
+    client = hp.LLMClient(backend, max_retries=3)
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.generate("prompt"))
+    assert backend.calls == 1
+
+
+def test_retries_give_up_after_max_retries(hp, no_backoff):
+    backend = FlakyBackend(failures=10, code=429)
+    client = hp.LLMClient(backend, max_retries=2)
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.generate("prompt"))
+    assert backend.calls == 3
+
+
+def test_call_gemini_uses_cache(hp):
+    backend = CountingStub(hp)
+    client, cache = hp.LLMClient(backend), {}
+    prompt = hp.build_prompt("Acme SA")
+    first = asyncio.run(hp.call_gemini(prompt, client, cache))
+    second = asyncio.run(hp.call_gemini(prompt, client, cache))
+    assert first == second
+    assert backend.calls == 1
+
+
+def test_call_gemini_returns_empty_json_on_error(hp, no_backoff):
+    client = hp.LLMClient(FlakyBackend(failures=10, code=400))
+    assert asyncio.run(hp.call_gemini("prompt", client)) == "{}"
+
+
+def test_batch_answers_every_company_in_one_call(hp):
+    backend = CountingStub(hp)
+    client, cache = hp.LLMClient(backend), {}
+    texts = {"1": "Acme SA", "2": "Beta Ltda", "3": "Gamma Inc"}
+    responses = asyncio.run(hp.call_gemini_batch(texts, client, cache))
+    assert set(responses) == set(texts)
+    assert all(set(hp.parse_response_to_dict(response)) >= set(hp.PROMPT_FIELDS) for response in responses.values())
+    assert backend.calls == 1
+    
+    # Las respuestas quedan en caché con la clave del prompt individual
+    asyncio.run(hp.call_gemini_batch(texts, client, cache))
+    assert asyncio.run(hp.call_gemini(hp.build_prompt("Beta Ltda"), client, cache)) == responses["2"]
+    assert backend.calls == 1
+
+
+def test_batch_falls_back_to_single_calls_on_invalid_response(hp):
+    class NoArrayBackend:
+        model_name = "no-array"
+        calls = 0
+
+        async def generate(self, prompt):
+            self.calls += 1
+            return '{"hq_city": "Quito"}', None
+
+    backend = NoArrayBackend()
+    responses = asyncio.run(hp.call_gemini_batch({"1": "Acme", "2": "Beta"}, hp.LLMClient(backend)))
+    assert responses == {"1": '{"hq_city": "Quito"}', "2": '{"hq_city": "Quito"}'}
+    assert backend.calls == 3
+
+
+def test_token_bucket_starts_with_a_small_burst(hp):
+    bucket = hp.TokenBucket(1200)
+    assert bucket.capacity == 20 * hp.LLM_BURST_SECONDS
+    assert hp.TokenBucket(6).capacity == 1
+    
+    async def acquire(count):
+        start = hp.time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return hp.time.monotonic() - start
+    
+    # La ráfaga sale de inmediato; después, 20 por segundo
+    assert asyncio.run(acquire(int(bucket.capacity))) < 0.05
+    assert asyncio.run(acquire(4)) >= 0.15
+
+
+def test_llm_cache_len_and_legacy_import_use_the_current_scope(hp, tmp_path, monkeypatch):
+    legacy = tmp_path / "gpt_cache.json"
+    legacy.write_text(json.dumps({"abc": '{"hq_city": "Lima"}'}), encoding="utf-8")
+    monkeypatch.setattr(hp, "CACHE_FILE", str(legacy))
+    path = str(tmp_path / "llm_cache.sqlite")
+    
+    cache = hp.LLMCache(path, model_name="gemini-2.5-pro", prompt_version="7")
+    assert cache["abc"] == '{"hq_city": "Lima"}'
+    cache["def"] = "{}"
+    assert len(cache) == 2
+    cache.close()
+    
+    other = hp.LLMCache(path, model_name="otro-modelo", prompt_version="7")
+    assert "abc" not in other
+    assert len(other) == 0
+    other["xyz"] = "{}"
+    assert len(other) == 1
+    other.close()
@@ -0,0 +1,32 @@
+def read_company(hp, manifest, company, html_dir):
+    return list(hp.iter_company_html(manifest.refs(company), html_dir))
+
+
+def test_manifest_last_entry_per_url_wins(hp, tmp_path):
+    html_dir = str(tmp_path)
+    manifest = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir)
+    manifest.save("Acme", "https://acme.com/", "<html>v1</html>", "Acme.html")
+    manifest.save("Acme", "https://acme.com/", "<html>v2</html>", "Acme.html")
+    manifest.save("Acme", "https://acme.com/about", "<html>about</html>", "Acme_about.html")
+    
+    reopened = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir)
+    assert reopened.has("Acme") and not reopened.has("Acm")
+    assert reopened.entries["Acme"]["https://acme.com/"]["size"] == len("<html>v2</html>")
+    assert read_company(hp, reopened, "Acme", html_dir) == ["<html>v2</html>", "<html>about</html>"]
+
+
+def test_manifest_bootstrap_uses_longest_prefix(hp, tmp_path):
+    html_dir = tmp_path / "htmls"
+    html_dir.mkdir()
+    for name in ("2048.html", "2048_Ventures.html", "2048_Ventures_team.html"):
+        (html_dir / name).write_text(f"<html>{name}</html>", encoding="utf-8")
+    
+    manifest = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), str(html_dir))
+    manifest.bootstrap(["2048", "2048 Ventures"], str(html_dir))
+    assert set(manifest.entries["2048"]) == {"2048.html"}
+    assert set(manifest.entries["2048 Ventures"]) == {"2048_Ventures.html", "2048_Ventures_team.html"}
+    
+    # Con el manifiesto ya creado no se vuelve a escanear
+    (html_dir / "2048_about.html").write_text("<html></html>", encoding="utf-8")
+    manifest.bootstrap(["2048", "2048 Ventures"], str(html_dir))
+    assert "2048_about.html" not in manifest.entries["2048"]
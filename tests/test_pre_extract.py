@@ -0,0 +1,25 @@
+import pytest
+
+
+def latam(hp, text):
+    facts = hp.page_facts(None, [(False, text)])
+    return hp.pre_extract_fields([facts]).get('presence_in_latam')
+
+
+@pytest.mark.parametrize('text', [
+    "Our spicy chile peppers are as famous as our Panama hats.",
+    "Visit our office in New Mexico.",
+    "Sede en Nuevo México.",
+    "We ship chile sauce to every store in the country.",
+])
+def test_latam_false_positives(hp, text):
+    assert latam(hp, text) is None
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("We have offices in Mexico and Chile.", "True (México, Chile)"),
+    ("Sede: Bogotá, Colombia", "True (Colombia)"),
+    ("Operations across Latin America.", "True"),
+])
+def test_latam_presence(hp, text, expected):
+    assert latam(hp, text) == expected
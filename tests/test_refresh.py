@@ -0,0 +1,72 @@
+import asyncio
+
+from aiohttp import web
+
+
+async def serve(pages, test):
+    """Servir `pages` (ruta -> (html, etag)) en un puerto local y ejecutar `test(base_url)`"""
+    async def handle(request):
+        html, etag = pages[request.path]
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+    app = web.Application()
+    app.router.add_route("GET", "/{tail:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        return await test(f"http://127.0.0.1:{runner.addresses[0][1]}")
+    finally:
+        await runner.cleanup()
+
+
+async def refresh(hp, manifest, job):
+    async with hp.create_http_session() as session:
+        pipeline = hp.CompanyPipeline(None, None, manifest, None, None, None, None, {}, session, None, None)
+        return await pipeline.refresh(job)
+
+
+def test_refresh_after_switching_to_file_store(hp, tmp_path):
+    html_dir = str(tmp_path)
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    pages = {"/": ("<html>home v1</html>", '"1"'), "/about": ("<html>about v1</html>", '"1"')}
+
+    async def test(base_url):
+        # Descarga con el almacén de snapshots
+        snapshots = hp.HtmlManifest(manifest_path, html_dir, store=hp.SnapshotStore(str(tmp_path / "snapshots")))
+        for path, (html, etag) in pages.items():
+            snapshots.save("Acme", base_url + path, html, None, {"etag": etag})
+        
+        # Refresco con HTML_STORE=files: la home cambió, /about responde 304
+        pages["/"] = ("<html>home v2</html>", '"2"')
+        files = hp.HtmlManifest(manifest_path, html_dir, readers=[hp.SnapshotStore(str(tmp_path / "snapshots"))])
+        job = await refresh(hp, files, {"idx": 0, "total": 1, "company": "Acme", "url": base_url + "/"})
+        assert job is not None and job.get("status") != "unchanged"
+        return files
+
+    manifest = asyncio.run(serve(pages, test))
+    assert (tmp_path / "Acme.html").read_text(encoding="utf-8") == "<html>home v2</html>"
+    texts = list(hp.iter_company_html(manifest.refs("Acme"), html_dir))
+    assert sorted(texts) == ["<html>about v1</html>", "<html>home v2</html>"]
+
+
+def test_refresh_skips_unchanged_pages(hp, tmp_path):
+    pages = {"/": ("<html>home</html>", '"1"')}
+
+    async def test(base_url):
+        manifest = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), str(tmp_path))
+        manifest.save("Acme", base_url + "/", "<html>home</html>", "Acme.html", {"etag": '"1"'})
+        job = {"idx": 0, "total": 1, "company": "Acme", "url": base_url + "/"}
+        assert await refresh(hp, manifest, job) is None
+        return job
+
+    assert asyncio.run(serve(pages, test))["status"] == "unchanged"
+
+
+def test_text_hash_survives_reload(hp, tmp_path):
+    manifest = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), str(tmp_path))
+    manifest.record_text_hash("Acme", "abc")
+    assert hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), str(tmp_path)).text_hash("Acme") == "abc"
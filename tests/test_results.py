@@ -0,0 +1,37 @@
+import pandas as pd
+
+
+def read(path):
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def test_writer_keeps_last_row_per_website_in_a_batch(hp, tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = hp.ResultWriter(path, batch_size=10, fmt="csv")
+    writer.add({"website": "https://a.com/", "hq_city": "Lima"})
+    writer.add({"website": "https://b.com/", "hq_city": "Quito"})
+    writer.add({"website": "https://a.com/", "hq_city": "Cusco"})
+    assert writer.close()
+    
+    assert read(path).to_dict("records") == [
+        {"website": "https://a.com/", "hq_city": "Cusco"},
+        {"website": "https://b.com/", "hq_city": "Quito"},
+    ]
+
+
+def test_writer_replaces_rows_already_on_disk(hp, tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = hp.ResultWriter(path, batch_size=2, fmt="csv")
+    writer.add({"website": "https://a.com/", "hq_city": "Lima"})
+    writer.add({"website": "https://b.com/", "hq_city": "Quito"})
+    assert writer.rows_written == 2
+    
+    # Otro proceso (o un refresco) reabre la salida y reescribe una web ya guardada
+    writer = hp.ResultWriter(path, batch_size=10, fmt="csv")
+    writer.add({"website": "https://b.com/", "hq_city": "Guayaquil"})
+    writer.add({"website": "https://c.com/", "hq_city": "Bogotá"})
+    assert writer.close()
+    
+    data = read(path)
+    assert sorted(data["website"]) == ["https://a.com/", "https://b.com/", "https://c.com/"]
+    assert data.set_index("website").loc["https://b.com/", "hq_city"] == "Guayaquil"
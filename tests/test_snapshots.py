@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+import shutil
+
+
+def test_snapshot_roundtrip_and_dedupe(hp, tmp_path):
+    store = hp.SnapshotStore(str(tmp_path / "snapshots"))
+    sha = store.put("<html>hola</html>")
+    segment = store.locate(sha)["segment"]
+    size = os.path.getsize(segment)
+    assert store.put("<html>hola</html>") == sha
+    assert os.path.getsize(segment) == size
+    assert store.get(sha) == "<html>hola</html>"
+    
+    # El índice se recarga al abrir el almacén otra vez
+    assert hp.SnapshotStore(str(tmp_path / "snapshots")).get(sha) == "<html>hola</html>"
+
+
+def test_snapshot_rolls_over_segments(hp, tmp_path):
+    store = hp.SnapshotStore(str(tmp_path / "snapshots"), segment_bytes=64)
+    shas = [store.put(f"<html>{i} {'x' * 200 * i}</html>") for i in range(1, 4)]
+    assert len({store.locate(sha)["segment"] for sha in shas}) == 3
+    assert [store.get(sha) for sha in shas] == [f"<html>{i} {'x' * 200 * i}</html>" for i in range(1, 4)]
+
+
+def test_manifest_saves_concurrently_off_the_event_loop(hp, tmp_path):
+    store = hp.SnapshotStore(str(tmp_path / "snapshots"), segment_bytes=256)
+    manifest = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), str(tmp_path), store=store)
+    pages = {f"https://a.com/{i}": f"<html>{i} {'x' * 100 * i}</html>" for i in range(20)}
+    
+    async def save_all():
+        await asyncio.gather(*(manifest.save_async("A", url, html, None) for url, html in pages.items()))
+    
+    asyncio.run(save_all())
+    reopened = hp.SnapshotStore(str(tmp_path / "snapshots"))
+    assert {url: reopened.get(entry["sha256"]) for url, entry in manifest.entries["A"].items()} == pages
+
+
+def test_snapshot_directory_can_be_moved(hp, tmp_path):
+    store = hp.SnapshotStore(str(tmp_path / "old"))
+    sha = store.put("<html>movida</html>")
+    with open(store.index_path, encoding="utf-8") as f:
+        assert not os.path.isabs(json.loads(f.readline())["segment"])
+    
+    shutil.move(str(tmp_path / "old"), str(tmp_path / "new"))
+    assert hp.SnapshotStore(str(tmp_path / "new")).get(sha) == "<html>movida</html>"
+
+
+def test_snapshot_resolves_legacy_absolute_paths(hp, tmp_path):
+    store = hp.SnapshotStore(str(tmp_path / "snapshots"))
+    sha = store.put("<html>antigua</html>")
+    location = dict(store.index[sha], segment=os.path.join("/ruta/que/ya/no/existe", store.index[sha]["segment"]))
+    with open(store.index_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(location) + "\n")
+    assert hp.SnapshotStore(str(tmp_path / "snapshots")).get(sha) == "<html>antigua</html>"
+
+
+def read_company(hp, manifest, company, html_dir):
+    return list(hp.iter_company_html(manifest.refs(company), html_dir))
+
+
+def test_manifest_reads_back_files_and_snapshots(hp, tmp_path):
+    html_dir = str(tmp_path)
+    files = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir)
+    files.save("Acme", "https://acme.com/", "<html>home</html>", "Acme.html")
+    store = hp.SnapshotStore(str(tmp_path / "snapshots"))
+    snapshots = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir, store=store)
+    snapshots.save("Acme", "https://acme.com/about", "<html>about</html>", "Acme_about.html")
+    
+    reopened = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir, store=hp.SnapshotStore(str(tmp_path / "snapshots")))
+    assert reopened.has("Acme")
+    assert sorted(read_company(hp, reopened, "Acme", html_dir)) == ["<html>about</html>", "<html>home</html>"]
+
+
+def test_manifest_reads_snapshots_when_writing_files(hp, tmp_path):
+    html_dir = str(tmp_path)
+    store = hp.SnapshotStore(str(tmp_path / "snapshots"))
+    hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir, store=store).save(
+        "Acme", "https://acme.com/", "<html>home</html>", "Acme.html")
+    
+    # HTML_STORE=files: las páginas nuevas van a archivos, las anteriores se leen de los snapshots
+    manifest = hp.HtmlManifest(str(tmp_path / "manifest.jsonl"), html_dir, readers=[hp.SnapshotStore(str(tmp_path / "snapshots"))])
+    assert read_company(hp, manifest, "Acme", html_dir) == ["<html>home</html>"]